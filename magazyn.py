@@ -6,12 +6,13 @@
 Autor: @AJPerkele  |  Licencja: GNU GPL v3.0
 """
 
-import sys, os, csv, json, shutil, sqlite3, requests
+import sys, os, re, csv, copy, json, time, queue, bisect, atexit, random, sqlite3, inspect, pathlib, tempfile, threading, itertools, functools, contextlib, collections, requests
+import http.server, urllib.parse, concurrent.futures
 from datetime import datetime, timedelta
 
 from PySide6.QtWidgets import *
-from PySide6.QtCore import QDate, Qt, QTimer, QSize
-from PySide6.QtGui import QFont, QAction, QColor, QPainter, QPen, QBrush, QLinearGradient
+from PySide6.QtCore import QDate, Qt, QTimer, QSize, QPointF, QLineF
+from PySide6.QtGui import QFont, QAction, QColor, QPainter, QPen, QBrush, QLinearGradient, QPixmap, QPolygonF
 
 APP_VERSION = "3.1.0"
 APP_NAME    = "System Magazynowo-Sprzedażowy"
@@ -20,6 +21,7 @@ APP_LICENSE = "GNU GPL v3.0"
 BUILD_DATE  = datetime.now().strftime("%Y-%m-%d")
 PLATFORMS   = ["Vinted", "OLX", "Allegro Lokalnie", "FB Marketplace", "Inne"]
 PLATFORM_LIMIT = 29  # limit sprzedaży na platformę (działalność nierejestrowana)
+QUARTERLY_LIMITS_FROM = 2026  # od tego roku limit przychodu liczony kwartalnie
 
 # ─────────────────────────────────────────────────────────
 #  MOTYWY – DZIENNY I NOCNY
@@ -100,9 +102,15 @@ THEME_NIGHT = {
 }
 
 CURRENT_THEME = THEME_DAY  # domyślnie dzienny
+THEMES    = {"day": THEME_DAY, "night": THEME_NIGHT}   # klucz "theme" w config.json
+KPI_KEYS  = ("rev", "profit", "sales", "prod", "stock")
+_QSS_CACHE = {}   # nazwa motywu -> arkusz z build_qss (budowany raz)
 
 
 def build_qss(t):
+    # kolory kart KPI – para reguł na każdy klucz kpi_* motywu
+    kpi = "".join(f'QFrame[role="kpi"][kpi="{k}"] {{ border-left-color: {t["kpi_" + k]}; }}\n'
+                  f'QLabel[role="kpi_value"][kpi="{k}"] {{ color: {t["kpi_" + k]}; }}\n' for k in KPI_KEYS)
     return f"""
 QWidget {{
     background-color: {t['bg']};
@@ -371,13 +379,58 @@ QMessageBox QLabel {{ color: {t['text']}; font-size: 13px; }}
 
 /* ── FRAME ── */
 QFrame {{ color: {t['text']}; }}
+
+/* ── ROLE WIDŻETÓW – właściwości role / tone / kpi (styled, set_tone) zamiast stylów pojedynczych widżetów ── */
+QLabel[role="title"]   {{ font-size: 15px; font-weight: 700; color: {t['text']}; }}
+QLabel[role="heading"] {{ font-size: 16px; font-weight: 800; color: {t['text']}; }}
+QLabel[role="logo"]    {{ font-size: 20px; font-weight: 800; color: {t['accent']}; }}
+QLabel[role="hint"]    {{ color: {t['text3']}; font-size: 11px; }}
+QLabel[role="caption"] {{ color: {t['text3']}; font-size: 12px; }}
+QLabel[role="section"] {{ color: {t['text3']}; font-size: 11px; font-weight: 600; }}
+QLabel[role="info"]    {{ color: {t['text2']}; font-size: 11px; }}
+QLabel[role="body"]    {{ color: {t['text2']}; font-size: 12px; }}
+QLabel[role="muted"]   {{ color: {t['text2']}; }}
+QLabel[role="accent"]  {{ color: {t['accent']}; font-weight: 700; }}
+QCheckBox[role="accent"] {{ color: {t['accent']}; font-weight: 600; }}
+QLabel[role="alert"]   {{ font-size: 11px; font-weight: 700; }}
+QLabel[role="dot"]     {{ font-size: 16px; }}
+QFrame[role="separator"] {{ background: {t['border']}; max-height: 1px; }}
+
+/* ── KARTA KPI ── */
+QFrame[role="kpi"] {{
+    background: {t['card_bg']};
+    border: 1px solid {t['border']};
+    border-radius: 8px;
+    border-left: 4px solid {t['accent']};
+}}
+QLabel[role="kpi_label"] {{
+    color: {t['text3']}; font-size: 10px; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px;
+}}
+QLabel[role="kpi_value"] {{ color: {t['accent']}; font-size: 21px; font-weight: 800; }}
+QLabel[role="kpi_note"]  {{ color: {t['text3']}; font-size: 10px; }}
+{kpi}
+/* ── STAN (tone) – po rolach, więc kolor stanu wygrywa ── */
+QLabel[tone="success"] {{ color: {t['success']}; }}
+QLabel[tone="warning"] {{ color: {t['warning']}; }}
+QLabel[tone="danger"]  {{ color: {t['danger']}; }}
+QLabel[tone="muted"]   {{ color: {t['text3']}; }}
+QLabel[role="alert"][tone="success"], QLabel[role="alert"][tone="muted"] {{ font-weight: 400; }}
+QLabel[role="kpi_note"][tone="success"], QLabel[role="kpi_note"][tone="danger"] {{ font-weight: 700; }}
+QProgressBar[tone="success"]::chunk {{ background-color: {t['success']}; }}
+QProgressBar[tone="warning"]::chunk {{ background-color: {t['warning']}; }}
+QProgressBar[tone="danger"]::chunk  {{ background-color: {t['danger']}; }}
 """
 
 
 def apply_theme(app, theme):
+    """Arkusz całej aplikacji z _QSS_CACHE. Widżety nie mają własnych stylów – wygląd zależny
+    od motywu wynika z właściwości role / tone (styled, set_tone) i selektorów arkusza, więc
+    przełączenie motywu to jedno setStyleSheet bez przebudowy widżetów"""
     global CURRENT_THEME
     CURRENT_THEME = theme
-    app.setStyleSheet(build_qss(theme))
+    qss = _QSS_CACHE.get(theme["name"])
+    if qss is None: qss = _QSS_CACHE[theme["name"]] = build_qss(theme)
+    app.setStyleSheet(qss)
 
 
 # ─────────────────────────────────────────────────────────
@@ -396,6 +449,31 @@ def get_eur_rate(date_str=None):
     return 4.25
 
 
+def get_eur_rates(date_from, date_to):
+    """Kursy EUR dla każdego dnia zakresu (dni bez notowań – kurs z poprzedniego dnia)"""
+    d0 = datetime.strptime(date_from, "%Y-%m-%d"); d1 = datetime.strptime(date_to, "%Y-%m-%d")
+    mids = {}
+    start = d0 - timedelta(days=7)  # notowanie sprzed weekendu / święta
+    while start <= d1:
+        end = min(start + timedelta(days=366), d1)   # NBP: max 367 dni na zapytanie
+        try:
+            url = (f"http://api.nbp.pl/api/exchangerates/rates/a/eur/"
+                   f"{start:%Y-%m-%d}/{end:%Y-%m-%d}/")
+            r = requests.get(url, headers={"Accept": "application/json"}, timeout=8)
+            if r.status_code == 200:
+                mids.update({x["effectiveDate"]: x["mid"] for x in r.json()["rates"]})
+        except Exception:
+            pass
+        start = end + timedelta(days=1)
+    rates, last = {}, 4.25
+    d = d0 - timedelta(days=7)
+    while d <= d1:
+        ds = d.strftime("%Y-%m-%d"); last = mids.get(ds, last)
+        if d >= d0: rates[ds] = last
+        d += timedelta(days=1)
+    return rates
+
+
 # ─────────────────────────────────────────────────────────
 #  KONFIGURACJA
 # ─────────────────────────────────────────────────────────
@@ -403,76 +481,116 @@ class Config:
     DEFAULTS = {
         "database_path":  "data.db",
         "last_opened":    None,
-        "invoice_counter": 1,
         "invoice_prefix": "R",
-        "invoice_year":   None,
         "save_pdf":       True,
         "theme":          "day",
+        "busy_timeout_ms": 5000,
+        "write_retries":  5,
+        "wal":            True,
         "business_info":  {},
         "invoice_config": {"seller_info": "", "footer_text": "Dziękuję za zakup!"},
+        "reorder":        {"lead_days": 14, "cover_days": 30, "service_level": 0.95},
         "limits": {
             "minimal_wage": 4666.0,
             "quarterly_multiplier": 2.25,
             "use_quarterly": True,
+            "platform_limit": PLATFORM_LIMIT,
             "year_limits": {
                 "2025": {"minimal_wage": 4666.0},
                 "2026": {"minimal_wage": 4666.0},
             }
         }
     }
+    SAVE_DELAY = 0.5   # s – zmiany z krótkiego okna trafiają do pliku jednym zapisem
+    # flush() działa w wątku Timer: self._d zmieniany i serializowany tylko pod self._lock,
+    # a słowniki (limity, dane sprzedawcy) wychodzą i wchodzą jako kopie
 
     def __init__(self, path="config.json"):
-        self.path = path
+        self.path   = path
+        self._lock  = threading.RLock()
+        self._timer = None
+        self._dirty = False
         if os.path.exists(path):
             with open(path, encoding="utf-8") as f:
                 self._d = json.load(f)
         else:
-            self._d = dict(self.DEFAULTS)
+            self._d = copy.deepcopy(self.DEFAULTS)
             self._save()
+        atexit.register(self.flush)
 
     def _save(self):
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(self._d, f, ensure_ascii=False, indent=2)
+        # zapis odroczony – właściwy zapis robi flush()
+        with self._lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                self._timer.daemon = True; self._timer.start()
+
+    def flush(self):
+        """Zapisuje zaległe zmiany: plik tymczasowy + os.replace (atomowo)"""
+        with self._lock:
+            if self._timer is not None: self._timer.cancel(); self._timer = None
+            if not self._dirty: return
+            text = json.dumps(self._d, ensure_ascii=False, indent=2)
+            d = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=d)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush(); os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                try: os.remove(tmp)
+                except OSError: pass
+                raise
+            self._dirty = False
 
     def get(self, key, default=None):
-        return self._d.get(key, default)
+        with self._lock: return copy.deepcopy(self._d.get(key, default))
 
-    def set(self, key, value):
-        self._d[key] = value
-        self._save()
+    def set(self, key, value): self._update(**{key: value})
 
-    def get_db_path(self):      return self._d.get("database_path", "data.db")
+    def _update(self, **kv):
+        with self._lock:
+            self._d.update(copy.deepcopy(kv)); self._save()
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._d: del self._d[key]; self._save()
+
+    def get_db_path(self):      return self.get("database_path", "data.db")
     def set_db_path(self, p):
-        self._d["database_path"] = p
-        self._d["last_opened"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        self._save()
-
-    def get_business_info(self):        return self._d.get("business_info", {})
-    def update_business_info(self, d):  self._d["business_info"] = d; self._save()
-
-    def get_invoice_config(self):       return self._d.get("invoice_config", self.DEFAULTS["invoice_config"])
-    def update_invoice_config(self, d): self._d["invoice_config"] = d; self._save()
-
-    def get_next_invoice_number(self):
-        prefix = self._d.get("invoice_prefix", "R")
-        year   = datetime.now().year
-        if self._d.get("invoice_year") != year:
-            self._d["invoice_counter"] = 1
-            self._d["invoice_year"] = year
-        n = self._d["invoice_counter"]
-        self._d["invoice_counter"] += 1
-        self._save()
-        return f"{prefix}/{n:04d}/{year}"
+        self._update(database_path=p, last_opened=datetime.now().strftime("%Y-%m-%d %H:%M"))
 
-    def reset_invoice_counter(self):
-        self._d["invoice_counter"] = 1
-        self._d["invoice_year"] = datetime.now().year
-        self._save()
+    def get_db_options(self):
+        return {"busy_timeout": int(self._d.get("busy_timeout_ms", 5000)),
+                "write_retries": int(self._d.get("write_retries", 5)),
+                "wal": bool(self._d.get("wal", True))}
+
+    def get_theme(self):         return THEMES.get(self._d.get("theme"), THEME_DAY)
+    def set_theme(self, key):    self._update(theme=key)
+
+    def get_business_info(self):        return self.get("business_info", {})
+    def update_business_info(self, d):  self._update(business_info=d)
+
+    def get_invoice_config(self):       return self.get("invoice_config", self.DEFAULTS["invoice_config"])
+    def update_invoice_config(self, d): self._update(invoice_config=d)
+
+    def migrate_invoice_counter(self, db):
+        """Przenosi licznik rachunków ze starego config.json do bazy (jednorazowo)"""
+        year = self._d.get("invoice_year")
+        if year is None: return
+        db.seed_invoice_sequence(self._d.get("invoice_prefix", "R"), int(year),
+                                 int(self._d.get("invoice_counter", 1)))
+        self.pop("invoice_counter"); self.pop("invoice_year")
 
     def should_save_pdf(self): return self._d.get("save_pdf", True)
 
-    def get_limits(self):         return self._d.get("limits", self.DEFAULTS["limits"])
-    def update_limits(self, d):   self._d["limits"] = d; self._save()
+    def get_reorder(self):        return {**self.DEFAULTS["reorder"], **self.get("reorder", {})}
+    def update_reorder(self, d):  self._update(reorder=d)
+
+    def get_limits(self):         return self.get("limits", self.DEFAULTS["limits"])
+    def update_limits(self, d):   self._update(limits=d)
 
     def get_minimal_wage(self, year=None):
         if year is None: year = datetime.now().year
@@ -480,10 +598,77 @@ class Config:
         yl  = lim.get("year_limits", {})
         return yl.get(str(year), {}).get("minimal_wage", lim.get("minimal_wage", 4666))
 
+    def get_platform_limit(self, year=None):
+        """Limit sprzedaży na platformę w roku: year_limits[rok].platform_limit lub wartość ogólna"""
+        if year is None: year = datetime.now().year
+        lim = self.get_limits()
+        return int(lim.get("year_limits", {}).get(str(year), {}).get(
+            "platform_limit", lim.get("platform_limit", PLATFORM_LIMIT)))
+
     def use_quarterly_limits(self):   return self.get_limits().get("use_quarterly", True)
     def get_quarterly_multiplier(self): return self.get_limits().get("quarterly_multiplier", 2.25)
 
 
+# ─────────────────────────────────────────────────────────
+#  OKRESY – rok, kwartał, miesiąc, ostatnie 12 miesięcy
+# ─────────────────────────────────────────────────────────
+MONTH_NAMES = ["Styczeń","Luty","Marzec","Kwiecień","Maj","Czerwiec",
+               "Lipiec","Sierpień","Wrzesień","Październik","Listopad","Grudzień"]
+# (etykieta, rodzaj, numer kwartału / miesiąca)
+PERIODS = ([("Cały rok", "year", None)] + [(f"Q{q}", "quarter", q) for q in range(1, 5)]
+           + [(m, "month", i + 1) for i, m in enumerate(MONTH_NAMES)]
+           + [("Ostatnie 12 miesięcy", "ttm", None)])
+
+
+def period_months(kind, year, n=None):
+    """(pierwszy, ostatni) miesiąc okresu jako 'YYYY-MM'; "ttm" kończy się bieżącym miesiącem"""
+    if kind == "year":    return f"{year}-01", f"{year}-12"
+    if kind == "quarter": return f"{year}-{3*n-2:02d}", f"{year}-{3*n:02d}"
+    if kind == "month":   return f"{year}-{n:02d}", f"{year}-{n:02d}"
+    now = datetime.now()
+    i   = now.year * 12 + now.month - 12
+    return f"{i // 12}-{i % 12 + 1:02d}", now.strftime("%Y-%m")
+
+
+def period_shift(months, years=-1):
+    """Ten sam okres przesunięty o `years` lat (porównanie r/r)"""
+    return tuple(f"{int(m[:4]) + years}{m[4:]}" for m in months)
+
+
+class RevenueLimit:
+    """Limit przychodu działalności nierejestrowanej w okresie zawierającym dany dzień:
+    kwartał (225% minimalnego wynagrodzenia, od QUARTERLY_LIMITS_FROM) lub miesiąc (75%).
+    Przychód okresu to suma z sales_period_totals (aktualizowanej przy każdym zapisie
+    sprzedaży) – najwyżej 3 miesiące, niezależnie od liczby sprzedaży."""
+    WARN_PCT = 80
+
+    def __init__(self, db, config):
+        self.db     = db
+        self.config = config
+
+    def period(self, date=None):
+        """(etykieta, (pierwszy, ostatni) miesiąc, limit PLN); date – 'YYYY-MM-DD', domyślnie dziś"""
+        d    = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now()
+        wage = self.config.get_minimal_wage(d.year)
+        lim  = self.config.get_limits()
+        if lim.get("use_quarterly", True) and d.year >= QUARTERLY_LIMITS_FROM:
+            q = (d.month - 1) // 3 + 1
+            return (f"Limit kwartalny Q{q}/{d.year}", period_months("quarter", d.year, q),
+                    wage * lim.get("quarterly_multiplier", 2.25))
+        return (f"Limit miesięczny {d.month}/{d.year}", period_months("month", d.year, d.month),
+                wage * 0.75)
+
+    def status(self, date=None, amount=0.0):
+        """Stan limitu; amount – kwota planowanej sprzedaży doliczana do `after`"""
+        label, months, limit = self.period(date)
+        used  = self.db.get_period_revenue(months)
+        after = used + amount
+        pct   = lambda v: v / limit * 100 if limit > 0 else 0.0
+        return {"label": label, "months": months, "limit": limit, "used": used, "after": after,
+                "pct": pct(used), "pct_after": pct(after), "remaining": max(limit - used, 0.0),
+                "over": limit > 0 and after > limit, "warn": pct(after) >= self.WARN_PCT}
+
+
 # ─────────────────────────────────────────────────────────
 #  BAZA DANYCH
 # ─────────────────────────────────────────────────────────
@@ -496,62 +681,614 @@ except ImportError:
     HAS_EXCEL = False
 
 
+class DBProfiler:
+    """Liczniki wywołań, histogramy czasu i liczba wierszy – per metoda DB i per zapytanie.
+    Zapytania wolniejsze niż slow_ms trafiają do logu razem z EXPLAIN QUERY PLAN."""
+    BUCKETS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float("inf")]
+    _LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+    def __init__(self, raw_conn, slow_ms=50.0, log_path=None):
+        self.raw = raw_conn; self.slow_ms = slow_ms; self.log_path = log_path
+        self.methods, self.statements = {}, {}
+        self.slow = collections.deque(maxlen=200)
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self._explaining = False
+
+    @classmethod
+    def normalize(cls, sql):
+        return cls._LITERALS.sub("?", " ".join(sql.split()))
+
+    def _entry(self, table, key):
+        e = table.get(key)
+        if e is None:
+            e = table[key] = {"calls": 0, "timed": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                              "hist": [0] * len(self.BUCKETS)}
+        return e
+
+    def _observe(self, e, ms, rows):
+        e["timed"] += 1; e["total_ms"] += ms; e["rows"] += rows
+        if ms > e["max_ms"]: e["max_ms"] = ms
+        e["hist"][bisect.bisect_left(self.BUCKETS, ms)] += 1
+
+    def on_trace(self, sql):
+        # set_trace_callback: każde zapytanie wykonane przez SQLite (także BEGIN/COMMIT)
+        if not self._explaining:
+            self._entry(self.statements, self.normalize(sql))["calls"] += 1
+
+    def record_method(self, name, ms, rows):
+        e = self._entry(self.methods, name); e["calls"] += 1
+        self._observe(e, ms, rows)
+
+    def record_statement(self, sql, params, ms, rows):
+        key = self.normalize(sql)
+        self._observe(self._entry(self.statements, key), ms, rows)
+        if ms >= self.slow_ms: self._log_slow(key, sql, params, ms, rows)
+
+    def _log_slow(self, key, sql, params, ms, rows):
+        plan = []
+        if key.split(" ", 1)[0].upper() in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+            self._explaining = True
+            try:
+                plan = [r[3] for r in self.raw.execute("EXPLAIN QUERY PLAN " + sql, params or ())]
+            except sqlite3.Error as e:
+                plan = [f"(brak planu: {e})"]
+            finally:
+                self._explaining = False
+        rec = {"at": datetime.now().isoformat(timespec="seconds"), "ms": round(ms, 3), "rows": rows,
+               "sql": key, "params": repr(params)[:200], "plan": plan}
+        self.slow.append(rec)
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+    def reset(self):
+        self.methods.clear(); self.statements.clear(); self.slow.clear()
+        self.started = datetime.now().isoformat(timespec="seconds")
+
+    def to_dict(self):
+        labels = [f"<={b:g}ms" for b in self.BUCKETS[:-1]] + [f">{self.BUCKETS[-2]:g}ms"]
+        def out(table):
+            return {k: {**{f: round(v, 3) if isinstance(v, float) else v
+                           for f, v in e.items() if f != "hist"},
+                        "avg_ms": round(e["total_ms"] / e["timed"], 3) if e["timed"] else None,
+                        "hist": {l: n for l, n in zip(labels, e["hist"]) if n}}
+                    for k, e in sorted(table.items(), key=lambda kv: -kv[1]["total_ms"])}
+        return {"started": self.started, "slow_ms": self.slow_ms,
+                "methods": out(self.methods), "statements": out(self.statements),
+                "slow_queries": list(self.slow)}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+class _ProfiledCursor:
+    """Kursor mierzący czas wykonania i pobierania wierszy"""
+    def __init__(self, prof, cur):
+        self._prof = prof; self._cur = cur; self._obs = None
+
+    def __getattr__(self, name): return getattr(self._cur, name)
+
+    @property
+    def row_factory(self): return self._cur.row_factory
+    @row_factory.setter
+    def row_factory(self, f): self._cur.row_factory = f
+
+    def _finish(self):
+        if self._obs:
+            sql, params, ms, rows = self._obs; self._obs = None
+            self._prof.record_statement(sql, params, ms, rows)
+
+    def _run(self, fn, sql, params):
+        self._finish()
+        t = time.perf_counter(); fn(sql, params)
+        self._obs = [sql, params, (time.perf_counter() - t) * 1000, 0]
+        if self._cur.description is None:  # DML – brak wierszy do pobrania
+            self._obs[3] = max(self._cur.rowcount, 0); self._finish()
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self._cur.execute, sql, params)
+
+    def executemany(self, sql, seq):
+        seq = list(seq)
+        return self._run(self._cur.executemany, sql, seq)
+
+    def executescript(self, script):
+        self._finish(); self._cur.executescript(script); return self
+
+    def _fetch(self, fn, *a):
+        t = time.perf_counter(); res = fn(*a)
+        if self._obs:
+            self._obs[2] += (time.perf_counter() - t) * 1000
+            self._obs[3] += len(res) if isinstance(res, list) else int(res is not None)
+        return res
+
+    def fetchone(self):
+        r = self._fetch(self._cur.fetchone); self._finish(); return r
+
+    def fetchall(self):
+        r = self._fetch(self._cur.fetchall); self._finish(); return r
+
+    def fetchmany(self, size=None):
+        r = self._fetch(self._cur.fetchmany, size or self._cur.arraysize)
+        if not r: self._finish()
+        return r
+
+    def __iter__(self):
+        try:
+            while True:
+                r = self._fetch(self._cur.fetchone)
+                if r is None: break
+                yield r
+        finally:
+            self._finish()
+
+
+class _ProfiledConnection:
+    """Połączenie zwracające kursory _ProfiledCursor; reszta przekazywana bez zmian"""
+    def __init__(self, prof, conn):
+        self._prof = prof; self._conn = conn
+
+    def __getattr__(self, name): return getattr(self._conn, name)
+    def __enter__(self): return self._conn.__enter__()
+    def __exit__(self, *exc): return self._conn.__exit__(*exc)
+
+    def cursor(self): return _ProfiledCursor(self._prof, self._conn.cursor())
+    def execute(self, sql, params=()): return self.cursor().execute(sql, params)
+    def executemany(self, sql, seq): return self.cursor().executemany(sql, seq)
+    def executescript(self, script): return self.cursor().executescript(script)
+
+    def commit(self):
+        t = time.perf_counter(); self._conn.commit()
+        self._prof.record_statement("COMMIT", None, (time.perf_counter() - t) * 1000, 0)
+
+
+class _Record:
+    """Wiersz jak sqlite3.Row (r["pole"], r[0], dict(r), .get) i atrybuty r.pole – ale zwykła
+    krotka bez słownika instancji i bez odwołania do opisu kursora"""
+    __slots__ = ()
+    _shared   = ()   # pola tekstowe powtarzane w wielu wierszach (data, platforma, SKU)
+
+    def __getitem__(self, k): return getattr(self, k) if isinstance(k, str) else tuple.__getitem__(self, k)
+    def keys(self):           return self._fields
+    def get(self, k, default=None): return getattr(self, k, default)
+
+    @classmethod
+    def factory(cls, share=False):
+        """row_factory kursora: krotka z SQLite → obiekt klasy (bez pośredniego sqlite3.Row).
+        share=True – jednakowe teksty pól _shared są jednym obiektem str dla wszystkich wierszy
+        (SQLite tworzy nowy str w każdym wierszu); dla list trzymanych w pamięci"""
+        new = tuple.__new__
+        if not (share and cls._shared): return lambda cur, row: new(cls, row)
+        idx, same = [cls._fields.index(f) for f in cls._shared], {}.setdefault
+        def make(cur, row):
+            row = list(row)
+            for i in idx: row[i] = same(row[i], row[i])
+            return new(cls, row)
+        return make
+
+
+class Product(_Record, collections.namedtuple("Product", "id sku title stock")):
+    __slots__ = ()
+
+class PurchaseLot(_Record, collections.namedtuple("PurchaseLot",
+                                                  "id sku title qty unit_cost available_qty total_pln date")):
+    __slots__ = (); _shared = ("sku", "title", "date")
+
+class Sale(_Record, collections.namedtuple("Sale", "id platform total_pln total_eur purchase_cost profit date items")):
+    __slots__ = (); _shared = ("platform", "date")
+
+class SaleLine(_Record, collections.namedtuple("SaleLine", "order_id platform date order_total_pln order_total_eur "
+                                               "order_total_cost sku title qty item_revenue_pln item_cost item_profit")):
+    __slots__ = (); _shared = ("platform", "date", "sku", "title")
+
+class Invoice(_Record, collections.namedtuple("Invoice", "id invoice_number sale_order_id file_path customer_name "
+                                              "customer_address issue_date total_amount created_at platform")):
+    __slots__ = (); _shared = ("issue_date", "platform")
+
+
+class _Rollback(Exception):
+    """Wycofanie transakcji bez błędu (np. import w trybie dry_run)"""
+
+
 class DB:
-    def __init__(self, path="data.db"):
+    RETRY_BACKOFF = 0.05   # s – pierwsza przerwa przed ponowieniem BEGIN IMMEDIATE
+    # sales_period_totals liczone od zera z sales_orders (przebudowa i weryfikacja)
+    PERIOD_TOTALS_SQL = """
+        SELECT COALESCE(strftime('%Y-%m',date),'') AS month, COALESCE(platform,'') AS platform,
+               COUNT(*) AS sale_count, SUM(COALESCE(total_pln,0)) AS revenue,
+               SUM(COALESCE(purchase_cost,0)) AS cost
+        FROM {sales_orders} GROUP BY 1, 2"""
+    PLATFORM_COUNTERS_SQL = """
+        SELECT COALESCE(CAST(strftime('%Y',date) AS INTEGER),0) AS year, COALESCE(platform,'') AS platform,
+               COUNT(*) AS sale_count
+        FROM {sales_orders} GROUP BY 1, 2"""
+    # pozostałość partii FIFO na koniec dnia ?1: partie od ostatniego zamknięcia roku ?2 (bilans
+    # otwarcia z dnia ?2 i zakupy po nim) minus sprzedaż po ?2 – sprzedaż zdejmuje najpierw najstarsze.
+    # {after} = "AND so.date>?2" tylko po zamknięciu – bez niego SQLite sumuje całą sprzedaż z indeksu produktu
+    FIFO_LEFT_SQL = """
+        SELECT l.*, MAX(0, MIN(l.qty, l.cum-COALESCE(s.q,0))) AS left FROM (
+            SELECT pi.id, pi.product_id, pi.qty, pi.available_qty, COALESCE(pi.unit_cost,0) AS unit_cost, po.date,
+                   COALESCE(pi.origin_item_id,pi.id) AS origin_item_id, COALESCE(pi.origin_date,po.date) AS origin_date,
+                   SUM(pi.qty) OVER (PARTITION BY pi.product_id ORDER BY po.date, pi.id) AS cum
+            FROM {purchase_items} pi JOIN {purchase_orders} po ON po.id=pi.order_id
+            WHERE po.date BETWEEN ?2 AND ?1 AND (pi.origin_item_id IS NOT NULL)=(po.date=?2)
+        ) l LEFT JOIN (
+            SELECT si.product_id, SUM(si.qty) AS q
+            FROM {sales_items} si JOIN {sales_orders} so ON so.id=si.order_id
+            WHERE so.date<=?1 {after} GROUP BY si.product_id
+        ) s ON s.product_id=l.product_id"""
+    # tabele przenoszone do archive_YYYY.db (archive_year); odczyty historyczne idą przez self._h
+    ARCHIVE_TABLES = ("purchase_orders", "purchase_items", "sales_orders", "sales_items", "invoices")
+
+    def __init__(self, path="data.db", busy_timeout=5000, write_retries=5, readonly=False, wal=True):
+        """busy_timeout – ms oczekiwania SQLite na blokadę, write_retries – dodatkowe próby
+        rozpoczęcia transakcji zapisu (z rosnącą przerwą), gdy baza jest zajęta.
+        readonly – połączenie tylko do odczytu (mode=ro) dla wątków czytających, bez migracji.
+        wal – dziennik WAL: odczyty nie blokują zapisu i odwrotnie (wyłącz dla bazy w folderze
+        sieciowym – WAL wymaga pamięci współdzielonej na jednym komputerze)"""
         self.path = path
-        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro" if readonly else path,
+                                    uri=readonly, timeout=busy_timeout / 1000, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self.busy_timeout  = busy_timeout
+        self.write_retries = write_retries
+        self.readonly  = readonly
+        self.profiler  = None
+        self._tx_depth = 0
+        self._writes   = 0   # zatwierdzone transakcje tej instancji (data_version ich nie widzi)
+        self._local    = threading.local()   # połączenie do odczytu bieżącego wątku (reader())
+        self._readers  = []
+        self._rlock    = threading.Lock()
+        self._cache    = {}   # analizy liczone z całej bazy: nazwa -> (klucz aktualności, wynik)
+        self._archives = ()   # lata dołączone z archiwum (ATTACH)
+        self._h = {t: t for t in self.ARCHIVE_TABLES}   # tabela historyczna -> tabela lub widok all_*
+        if readonly:
+            self._sync_archives(); return
+        try: self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        except sqlite3.OperationalError: pass   # inna instancja trzyma bazę – zostaje bieżący tryb
         self._migrate()
+        self._sync_archives()
 
     def _migrate(self):
-        c = self.conn.cursor()
-        c.executescript("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sku TEXT UNIQUE, title TEXT, stock INTEGER DEFAULT 0
-        );
-        CREATE TABLE IF NOT EXISTS purchase_orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, total_pln REAL, date TEXT
-        );
-        CREATE TABLE IF NOT EXISTS purchase_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER, product_id INTEGER,
-            qty INTEGER, unit_cost REAL DEFAULT 0, available_qty INTEGER DEFAULT 0
-        );
-        CREATE TABLE IF NOT EXISTS purchase_stock_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            purchase_item_id INTEGER, product_id INTEGER,
-            qty INTEGER, date TEXT, sale_order_id INTEGER DEFAULT NULL
-        );
-        CREATE TABLE IF NOT EXISTS sales_orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            platform TEXT, total_pln REAL, total_eur REAL,
-            purchase_cost REAL DEFAULT 0, date TEXT
-        );
-        CREATE TABLE IF NOT EXISTS sales_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER, product_id INTEGER, qty INTEGER
-        );
-        CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_number TEXT UNIQUE, sale_order_id INTEGER,
-            file_path TEXT, customer_name TEXT, customer_address TEXT,
-            issue_date TEXT, total_amount REAL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (sale_order_id) REFERENCES sales_orders(id) ON DELETE SET NULL
-        );
+        # schemat w jednej transakcji zapisu – kilka instancji może startować naraz
+        with self.transaction() as c:
+            for stmt in filter(str.strip, """
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sku TEXT UNIQUE, title TEXT, stock INTEGER DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS purchase_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, total_pln REAL, date TEXT
+                );
+                CREATE TABLE IF NOT EXISTS purchase_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER, product_id INTEGER,
+                    qty INTEGER, unit_cost REAL DEFAULT 0, available_qty INTEGER DEFAULT 0
+                );
+                -- pobrania partii przez sprzedaż (delete_sale zwraca ilość do tych partii)
+                CREATE TABLE IF NOT EXISTS purchase_stock_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    purchase_item_id INTEGER, product_id INTEGER,
+                    qty INTEGER, date TEXT, sale_order_id INTEGER DEFAULT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sales_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    platform TEXT, total_pln REAL, total_eur REAL,
+                    purchase_cost REAL DEFAULT 0, date TEXT
+                );
+                CREATE TABLE IF NOT EXISTS sales_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER, product_id INTEGER, qty INTEGER,
+                    revenue_pln REAL, purchase_cost REAL
+                );
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    invoice_number TEXT UNIQUE, sale_order_id INTEGER,
+                    file_path TEXT, customer_name TEXT, customer_address TEXT,
+                    issue_date TEXT, total_amount REAL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (sale_order_id) REFERENCES sales_orders(id) ON DELETE SET NULL
+                );
+                CREATE TABLE IF NOT EXISTS invoice_sequences (
+                    prefix TEXT NOT NULL, year INTEGER NOT NULL, next_no INTEGER NOT NULL,
+                    PRIMARY KEY (prefix, year)
+                );
+                -- rejestr ruchów magazynowych (tylko dopisywanie), ref_id: purchase_items.id
+                -- dla zakupu, sales_orders.id dla sprzedaży, NULL dla korekty
+                CREATE TABLE IF NOT EXISTS stock_movements (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER NOT NULL, date TEXT NOT NULL, qty INTEGER NOT NULL,
+                    kind TEXT NOT NULL CHECK (kind IN ('purchase','sale','correction','reversal')),
+                    ref_id INTEGER, created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_movements_product_date ON stock_movements(product_id, date);
+                CREATE INDEX IF NOT EXISTS idx_movements_date ON stock_movements(date);
+                CREATE INDEX IF NOT EXISTS idx_sales_items_order ON sales_items(order_id);
+                CREATE INDEX IF NOT EXISTS idx_sales_orders_date ON sales_orders(date);
+                CREATE INDEX IF NOT EXISTS idx_purchase_orders_date ON purchase_orders(date);
+                CREATE INDEX IF NOT EXISTS idx_purchase_items_order ON purchase_items(order_id);
+                -- stan produktu na koniec miesiąca (cache rejestru, można odbudować)
+                CREATE TABLE IF NOT EXISTS stock_snapshots (
+                    product_id INTEGER NOT NULL, date TEXT NOT NULL, stock INTEGER NOT NULL,
+                    PRIMARY KEY (product_id, date)
+                ) WITHOUT ROWID;
+                -- sumy sprzedaży miesiąc x platforma (utrzymywane triggerami na sales_orders)
+                CREATE TABLE IF NOT EXISTS sales_period_totals (
+                    month TEXT NOT NULL, platform TEXT NOT NULL,
+                    sale_count INTEGER NOT NULL DEFAULT 0,
+                    revenue REAL NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (month, platform)
+                ) WITHOUT ROWID;
+                -- liczba sprzedaży w roku na platformie (limit PLATFORM_LIMIT), też z triggerów
+                CREATE TABLE IF NOT EXISTS platform_year_counters (
+                    year INTEGER NOT NULL, platform TEXT NOT NULL,
+                    sale_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (year, platform)
+                ) WITHOUT ROWID;
+                -- SKU/ID oferty z eksportu platformy -> produkt (import zamówień z platform)
+                CREATE TABLE IF NOT EXISTS listing_skus (
+                    platform TEXT NOT NULL, listing_sku TEXT NOT NULL, product_id INTEGER NOT NULL,
+                    PRIMARY KEY (platform, listing_sku)
+                ) WITHOUT ROWID;
+                -- lata przeniesione do plików archive_YYYY.db (archive_year)
+                CREATE TABLE IF NOT EXISTS archives (
+                    year INTEGER PRIMARY KEY, file TEXT NOT NULL,
+                    sales INTEGER, purchases INTEGER, invoices INTEGER,
+                    archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+                );
+                -- zamknięte lata (close_year): sumy roku dla raportów, zapisy z datą ≤ koniec roku odrzucane
+                CREATE TABLE IF NOT EXISTS closed_periods (
+                    year INTEGER PRIMARY KEY,
+                    sale_count INTEGER NOT NULL, revenue REAL NOT NULL, cost REAL NOT NULL,
+                    purchase_count INTEGER NOT NULL, purchases_pln REAL NOT NULL,
+                    stock_qty INTEGER NOT NULL, stock_value REAL NOT NULL, lots INTEGER NOT NULL,
+                    closed_at TEXT DEFAULT CURRENT_TIMESTAMP
+                );
+                """.split(";")):
+                c.execute(stmt)
+            for op in ("UPDATE", "DELETE"):
+                c.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS stock_movements_no_{op.lower()} BEFORE {op} ON stock_movements
+                    BEGIN SELECT RAISE(ABORT, 'stock_movements: rejestr tylko do dopisywania'); END
+                """)
+            for name, event, body in [("ins", "INSERT", self._period_delta("NEW", 1)),
+                                      ("del", "DELETE", self._period_delta("OLD", -1)),
+                                      ("upd", "UPDATE OF date,platform,total_pln,purchase_cost",
+                                       self._period_delta("OLD", -1) + self._period_delta("NEW", 1))]:
+                c.execute(f"CREATE TRIGGER IF NOT EXISTS sales_totals_{name} AFTER {event} ON sales_orders "
+                          f"BEGIN {body} END")
+            for name, event, when, body in [
+                    ("ins", "INSERT", "", self._counter_delta("NEW", 1)),
+                    ("del", "DELETE", "", self._counter_delta("OLD", -1)),
+                    ("upd", "UPDATE OF date,platform",
+                     "WHEN OLD.date IS NOT NEW.date OR OLD.platform IS NOT NEW.platform",
+                     self._counter_delta("OLD", -1) + self._counter_delta("NEW", 1))]:
+                c.execute(f"CREATE TRIGGER IF NOT EXISTS platform_counters_{name} AFTER {event} ON sales_orders "
+                          f"{when} BEGIN {body} END")
+            added = set()
+            for col, tbl, decl in [("purchase_cost","sales_orders","REAL DEFAULT 0"),
+                                   ("unit_cost","purchase_items","REAL DEFAULT 0"),
+                                   ("available_qty","purchase_items","REAL DEFAULT 0"),
+                                   ("external_order_id","sales_orders","TEXT"),
+                                   # przychód i koszt FIFO pozycji (suma pozycji = kwoty zamówienia)
+                                   ("revenue_pln","sales_items","REAL"),
+                                   ("purchase_cost","sales_items","REAL"),
+                                   # partia bilansu otwarcia: pierwotna pozycja zakupu i jej data
+                                   ("origin_item_id","purchase_items","INTEGER"),
+                                   ("origin_date","purchase_items","TEXT")]:
+                try: c.execute(f"SELECT {col} FROM {tbl} LIMIT 1")
+                except sqlite3.OperationalError:
+                    c.execute(f"ALTER TABLE {tbl} ADD COLUMN {col} {decl}"); added.add((tbl, col))
+            if ("sales_items", "revenue_pln") in added:
+                self._backfill_line_amounts(c)
+            # rentowność SKU liczona z samego indeksu (get_sku_profitability)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sales_items_product "
+                      "ON sales_items(product_id, order_id, qty, revenue_pln, purchase_cost)")
+            # otwarte partie produktu – FIFO nie czyta partii już zdjętych ani lat zamkniętych
+            c.execute("CREATE INDEX IF NOT EXISTS idx_stock_history_sale ON purchase_stock_history(sale_order_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_purchase_items_open "
+                      "ON purchase_items(product_id) WHERE available_qty>0")
+            # numer zamówienia z platformy – ponowny import tego samego eksportu niczego nie dubluje
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_external "
+                      "ON sales_orders(platform, external_order_id) WHERE external_order_id IS NOT NULL")
+            if not c.execute("SELECT 1 FROM stock_movements LIMIT 1").fetchone():
+                self._backfill_movements(c)
+            self._refresh_snapshots(c)
+            if not c.execute("SELECT 1 FROM sales_period_totals LIMIT 1").fetchone():
+                self._rebuild_period_totals(c)
+            if not c.execute("SELECT 1 FROM platform_year_counters LIMIT 1").fetchone():
+                self._rebuild_platform_counters(c)
+
+    @staticmethod
+    def _period_delta(row, sign):
+        return f"""
+            INSERT INTO sales_period_totals(month,platform,sale_count,revenue,cost)
+            VALUES(COALESCE(strftime('%Y-%m',{row}.date),''), COALESCE({row}.platform,''), {sign},
+                   {sign}*COALESCE({row}.total_pln,0), {sign}*COALESCE({row}.purchase_cost,0))
+            ON CONFLICT(month,platform) DO UPDATE SET sale_count=sale_count+excluded.sale_count,
+                revenue=revenue+excluded.revenue, cost=cost+excluded.cost;"""
+
+    @staticmethod
+    def _counter_delta(row, sign):
+        return f"""
+            INSERT INTO platform_year_counters(year,platform,sale_count)
+            VALUES(COALESCE(CAST(strftime('%Y',{row}.date) AS INTEGER),0), COALESCE({row}.platform,''), {sign})
+            ON CONFLICT(year,platform) DO UPDATE SET sale_count=sale_count+excluded.sale_count;"""
+
+    def _rebuild_platform_counters(self, c):
+        c.execute("DELETE FROM platform_year_counters")
+        c.execute(f"INSERT INTO platform_year_counters(year,platform,sale_count) "
+                  f"{self.PLATFORM_COUNTERS_SQL.format(**self._h)}")
+
+    def _rebuild_period_totals(self, c):
+        c.execute("DELETE FROM sales_period_totals")
+        c.execute(f"INSERT INTO sales_period_totals(month,platform,sale_count,revenue,cost) "
+                  f"{self.PERIOD_TOTALS_SQL.format(**self._h)}")
+
+    def _backfill_movements(self, c):
+        # rejestr odtworzony z zakupów i sprzedaży; różnica względem products.stock to
+        # dawne ręczne korekty bez daty – zapisywane jako jedna korekta z dniem migracji
+        c.execute("""
+            INSERT INTO stock_movements(product_id,date,qty,kind,ref_id)
+            SELECT product_id, date, qty, kind, ref_id FROM (
+                SELECT pi.product_id, po.date, pi.qty, 'purchase' AS kind, pi.id AS ref_id
+                FROM purchase_items pi JOIN purchase_orders po ON po.id=pi.order_id
+                UNION ALL
+                SELECT si.product_id, so.date, -si.qty, 'sale', so.id
+                FROM sales_items si JOIN sales_orders so ON so.id=si.order_id
+            ) WHERE date IS NOT NULL AND qty<>0 ORDER BY date
+        """)
+        c.execute("""
+            INSERT INTO stock_movements(product_id,date,qty,kind)
+            SELECT p.id, date('now','localtime'), p.stock-COALESCE(m.s,0), 'correction'
+            FROM products p
+            LEFT JOIN (SELECT product_id, SUM(qty) AS s FROM stock_movements GROUP BY product_id) m
+                   ON m.product_id=p.id
+            WHERE p.stock<>COALESCE(m.s,0)
         """)
-        for col, tbl in [("purchase_cost","sales_orders"),("unit_cost","purchase_items"),
-                         ("available_qty","purchase_items")]:
-            try: c.execute(f"SELECT {col} FROM {tbl} LIMIT 1")
-            except sqlite3.OperationalError:
-                c.execute(f"ALTER TABLE {tbl} ADD COLUMN {col} REAL DEFAULT 0")
-        self.conn.commit()
+
+    @staticmethod
+    def _allocate(total, weights):
+        """Dzieli kwotę proporcjonalnie do wag (części w groszach, reszta w ostatniej –
+        suma części jest równa total)"""
+        if not weights: return []
+        s = sum(weights)
+        if not s: weights, s = [1] * len(weights), len(weights)
+        parts = [round(total * w / s, 2) for w in weights[:-1]]
+        return parts + [round(total - sum(parts), 2)]
+
+    def _backfill_line_amounts(self, c):
+        # zamówienia sprzed podziału na pozycje: przychód wg ilości (jak koszt w zakupach),
+        # koszt wg ilości x średni koszt partii produktu – jednopozycyjne wychodzą dokładnie
+        rows = c.execute("""
+            SELECT si.id, si.order_id, si.qty, so.total_pln, so.purchase_cost, COALESCE(a.avg,0) AS avg
+            FROM sales_items si JOIN sales_orders so ON so.id=si.order_id
+            LEFT JOIN (SELECT product_id, SUM(qty*unit_cost)/SUM(qty) AS avg FROM purchase_items
+                       GROUP BY product_id HAVING SUM(qty)>0) a ON a.product_id=si.product_id
+            WHERE si.revenue_pln IS NULL ORDER BY si.order_id, si.id
+        """).fetchall()
+        upd = []
+        for _, lines in itertools.groupby(rows, key=lambda r: r["order_id"]):
+            lines = list(lines)
+            rev  = self._allocate(lines[0]["total_pln"] or 0, [l["qty"] for l in lines])
+            cost = self._allocate(lines[0]["purchase_cost"] or 0, [l["qty"] * l["avg"] for l in lines])
+            upd += [(r, k, l["id"]) for l, r, k in zip(lines, rev, cost)]
+        c.executemany("UPDATE sales_items SET revenue_pln=?, purchase_cost=? WHERE id=?", upd)
+
+    def _refresh_snapshots(self, c, force=False):
+        # snapshoty na koniec każdego zakończonego miesiąca; przebudowa tylko gdy od
+        # ostatniego snapshotu doszły ruchy z zamkniętych już miesięcy
+        cutoff = (datetime.now().replace(day=1) - timedelta(days=1)).strftime("%Y-%m-%d")
+        last   = c.execute("SELECT COALESCE(MAX(date),'') FROM stock_snapshots").fetchone()[0]
+        if not force and not c.execute("SELECT 1 FROM stock_movements WHERE date>? AND date<=? LIMIT 1",
+                                       (last, cutoff)).fetchone():
+            return
+        c.execute("DELETE FROM stock_snapshots")
+        c.execute("""
+            INSERT INTO stock_snapshots(product_id,date,stock)
+            SELECT product_id, m, SUM(d) OVER (PARTITION BY product_id ORDER BY m)
+            FROM (SELECT product_id, date(date,'start of month','+1 month','-1 day') AS m, SUM(qty) AS d
+                  FROM stock_movements WHERE date<=? GROUP BY product_id, m)
+            WHERE m IS NOT NULL
+        """, (cutoff,))
+
+    def _moves(self, c, rows):
+        """Dopisuje ruchy [(pid, data, ilość, rodzaj, ref_id), ...]; products.stock i snapshoty
+        są aktualizowane w tej samej transakcji"""
+        rows = [r for r in rows if r[2]]
+        if not rows: return
+        c.executemany("INSERT INTO stock_movements(product_id,date,qty,kind,ref_id) VALUES(?,?,?,?,?)", rows)
+        delta = collections.Counter()
+        for pid, _, qty, _, _ in rows: delta[pid] += qty
+        c.executemany("UPDATE products SET stock=stock+? WHERE id=?", [(q, pid) for pid, q in delta.items() if q])
+        # ruch z datą wsteczną przesuwa późniejsze snapshoty
+        c.executemany("UPDATE stock_snapshots SET stock=stock+? WHERE product_id=? AND date>=?",
+                      [(qty, pid, d) for pid, d, qty, _, _ in rows])
+
+    # ── TRANSAKCJE ──
+    def _begin(self):
+        # IMMEDIATE: blokada zapisu od razu, a nie w połowie operacji (np. między
+        # odczytem partii FIFO a ich zdjęciem) – dalsze zapytania nie dostaną SQLITE_BUSY
+        for attempt in range(self.write_retries + 1):
+            try:
+                self.conn.execute("BEGIN IMMEDIATE"); return
+            except sqlite3.OperationalError as e:
+                if attempt == self.write_retries or not ("locked" in str(e) or "busy" in str(e)): raise
+                time.sleep(min(self.RETRY_BACKOFF * 2 ** attempt, 2.0) * random.uniform(0.5, 1.5))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Jednostka pracy: metody DB wywołane w bloku `with db.transaction():` nie zatwierdzają
+        osobno – całość to jeden COMMIT (jeden fsync). Zagnieżdżenie = SAVEPOINT, więc błąd
+        wewnętrznego bloku cofa tylko jego zmiany, a wyjątek z bloku zewnętrznego – wszystko."""
+        if self._tx_depth:
+            sp = f"sp{self._tx_depth}"
+            self.conn.execute(f"SAVEPOINT {sp}"); self._tx_depth += 1
+            try:
+                yield self.conn.cursor()
+            except BaseException:
+                self._tx_depth -= 1
+                self.conn.execute(f"ROLLBACK TO {sp}"); self.conn.execute(f"RELEASE {sp}"); raise
+            self._tx_depth -= 1; self.conn.execute(f"RELEASE {sp}")
+            return
+        self._begin(); self._tx_depth = 1
+        try:
+            yield self.conn.cursor()
+        except BaseException:
+            self._tx_depth = 0; self.conn.rollback(); raise
+        self._tx_depth = 0; self.conn.commit(); self._writes += 1
+
+    def reader(self):
+        """Połączenie tylko do odczytu tej samej bazy, osobne dla każdego wątku (tworzone przy
+        pierwszym użyciu). Długie odczyty na nim nie trzymają połączenia, którym się zapisuje"""
+        if self.readonly: return self
+        r = getattr(self._local, "db", None)
+        if r is None:
+            r = self._local.db = DB(self.path, self.busy_timeout, readonly=True)
+            with self._rlock: self._readers.append(r)
+        return r
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """Spójny odczyt: `with db.snapshot() as r:` – wszystkie zapytania na r widzą bazę z jednej
+        chwili (transakcja odczytu na reader()). W trybie WAL zapisy w tym czasie nie czekają.
+        Zagnieżdżenie korzysta z już otwartej migawki"""
+        r = self.reader()
+        if r._tx_depth:
+            yield r; return
+        r._sync_archives()   # rok zarchiwizowany przez inną instancję
+        r.conn.execute("BEGIN"); r._tx_depth = 1
+        try: yield r
+        finally:
+            r._tx_depth = 0; r.conn.rollback()   # tylko odczyt – nic do zatwierdzenia
+
+    def close_readers(self):
+        with self._rlock:
+            for r in self._readers: r.conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+
+    def close(self):
+        self.close_readers()
+        self.conn.close()
+
+    def data_version(self):
+        """Znacznik zmian: (PRAGMA data_version, licznik własnych zapisów).
+        data_version rośnie po COMMIT z innego połączenia (np. drugiej instancji programu),
+        własne zapisy liczy _writes – razem wystarczą do taniego sprawdzenia „czy coś się zmieniło”"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0], self._writes
 
     # ── PRODUCTS ──
     def add_product(self, sku, title):
-        self.conn.execute("INSERT INTO products(sku,title,stock) VALUES(?,?,0)", (sku,title))
-        self.conn.commit()
+        with self.transaction() as c:
+            c.execute("INSERT INTO products(sku,title,stock) VALUES(?,?,0)", (sku,title))
+            return c.lastrowid
 
     def check_sku_exists(self, sku):
         return self.conn.execute("SELECT id FROM products WHERE sku=?", (sku,)).fetchone() is not None
@@ -560,70 +1297,145 @@ class DB:
         r = self.conn.execute("SELECT id FROM products WHERE sku=?", (sku,)).fetchone()
         return r["id"] if r else None
 
+    def _records(self, cls, sql, args=(), share=False):
+        """Kursor zwracający obiekty cls (Product, Sale, …; None – zwykłe krotki) zamiast sqlite3.Row.
+        Kolumny zapytania muszą być w kolejności pól klasy; share – jak w _Record.factory"""
+        cur = self.conn.cursor(); cur.row_factory = cls and cls.factory(share)
+        return cur.execute(sql, args)
+
+    PRODUCT_SQL = "SELECT id, sku, title, stock FROM products"
+
+    def iter_products(self):
+        """Produkty (Product) alfabetycznie – kursor, wiersze czytane dopiero przy iteracji"""
+        return self._records(Product, self.PRODUCT_SQL + " ORDER BY title")
+
     def list_products(self):
-        return self.conn.execute("SELECT * FROM products ORDER BY title").fetchall()
+        return self.iter_products().fetchall()
 
     def get_product_info(self, pid):
-        return self.conn.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
+        return self._records(Product, self.PRODUCT_SQL + " WHERE id=?", (pid,)).fetchone()
 
     def update_stock(self, pid, delta):
-        self.conn.execute("UPDATE products SET stock=stock+? WHERE id=?", (delta,pid))
-        self.conn.commit()
+        with self.transaction() as c:
+            self._moves(c, [(pid, datetime.now().strftime("%Y-%m-%d"), delta, "correction", None)])
+
+    def apply_stock_corrections(self, corrections):
+        """Korekty inwentaryzacyjne [(pid, delta), ...] jednym executemany i jednym COMMIT"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        rows  = [(pid, today, d, "correction", None) for pid, d in corrections if d]
+        with self.transaction() as c:
+            self._moves(c, rows)
+        return len(rows)
 
     def check_stock(self, pid, qty):
         r = self.conn.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()
         return r and r["stock"] >= qty
 
     def update_product(self, pid, sku, title):
-        self.conn.execute("UPDATE products SET sku=?,title=? WHERE id=?", (sku,title,pid))
-        self.conn.commit()
+        with self.transaction() as c:
+            c.execute("UPDATE products SET sku=?,title=? WHERE id=?", (sku,title,pid))
 
     def delete_product(self, pid):
-        p = self.get_product_info(pid)
-        if p and p["stock"] > 0: return False
-        c = self.conn.cursor()
-        c.execute("DELETE FROM purchase_items WHERE product_id=?", (pid,))
-        c.execute("DELETE FROM sales_items WHERE product_id=?", (pid,))
-        c.execute("DELETE FROM purchase_stock_history WHERE product_id=?", (pid,))
-        c.execute("DELETE FROM products WHERE id=?", (pid,))
-        self.conn.commit()
+        with self.transaction() as c:
+            p = c.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()
+            if p and p["stock"] > 0: return False
+            end = self.closed_until()
+            if end and c.execute("""
+                SELECT 1 FROM purchase_items pi JOIN purchase_orders po ON po.id=pi.order_id
+                WHERE pi.product_id=?1 AND po.date<=?2
+                UNION ALL
+                SELECT 1 FROM sales_items si JOIN sales_orders so ON so.id=si.order_id
+                WHERE si.product_id=?1 AND so.date<=?2 LIMIT 1
+            """, (pid, end)).fetchone():
+                raise ValueError(f"Produkt ma zakupy lub sprzedaż w zamkniętym okresie (do {end}).")
+            c.execute("DELETE FROM purchase_items WHERE product_id=?", (pid,))
+            c.execute("DELETE FROM sales_items WHERE product_id=?", (pid,))
+            c.execute("DELETE FROM purchase_stock_history WHERE product_id=?", (pid,))
+            c.execute("DELETE FROM listing_skus WHERE product_id=?", (pid,))
+            c.execute("DELETE FROM products WHERE id=?", (pid,))
         return True
 
+    # ── RUCHY MAGAZYNOWE ──
+    def stock_at(self, pid, date):
+        """Stan produktu na koniec dnia `date`: ostatni snapshot ≤ date + ruchy po nim
+        (oba odczyty po indeksie, więc koszt nie rośnie z długością historii)"""
+        s = self.conn.execute("""
+            SELECT date, stock FROM stock_snapshots WHERE product_id=? AND date<=?
+            ORDER BY date DESC LIMIT 1
+        """, (pid, date)).fetchone()
+        since, base = (s["date"], s["stock"]) if s else ("", 0)
+        return base + self.conn.execute("""
+            SELECT COALESCE(SUM(qty),0) FROM stock_movements WHERE product_id=? AND date>? AND date<=?
+        """, (pid, since, date)).fetchone()[0]
+
+    def list_movements(self, pid, date_from=None, date_to=None):
+        return self.conn.execute("""
+            SELECT * FROM stock_movements WHERE product_id=? AND date BETWEEN ? AND ?
+            ORDER BY date, id
+        """, (pid, date_from or "", date_to or "9999-12-31")).fetchall()
+
+    def verify_stock_cache(self, fix=False):
+        """Porównuje products.stock z sumą rejestru ruchów; fix=True nadpisuje cache"""
+        bad = [dict(r) for r in self.conn.execute("""
+            SELECT p.id, p.sku, p.stock, COALESCE(m.s,0) AS ledger
+            FROM products p
+            LEFT JOIN (SELECT product_id, SUM(qty) AS s FROM stock_movements GROUP BY product_id) m
+                   ON m.product_id=p.id
+            WHERE p.stock<>COALESCE(m.s,0)
+        """)]
+        if fix and bad:
+            with self.transaction() as c:
+                c.executemany("UPDATE products SET stock=? WHERE id=?", [(b["ledger"], b["id"]) for b in bad])
+        return bad
+
+    def rebuild_stock_snapshots(self):
+        with self.transaction() as c:
+            self._refresh_snapshots(c, force=True)
+
     # ── PURCHASES ──
     def add_purchase_order(self, total_pln, date, items):
-        c = self.conn.cursor()
-        c.execute("INSERT INTO purchase_orders(total_pln,date) VALUES(?,?)", (total_pln,date))
-        oid = c.lastrowid
         total_qty = sum(q for _,q in items)
-        for pid, qty in items:
-            unit = (total_pln * qty / total_qty) / qty if total_qty > 0 and qty > 0 else 0
-            c.execute(
-                "INSERT INTO purchase_items(order_id,product_id,qty,unit_cost,available_qty) VALUES(?,?,?,?,?)",
-                (oid,pid,qty,unit,qty))
-            pi_id = c.lastrowid
-            c.execute(
-                "INSERT INTO purchase_stock_history(purchase_item_id,product_id,qty,date) VALUES(?,?,?,?)",
-                (pi_id,pid,qty,date))
-            self.conn.execute("UPDATE products SET stock=stock+? WHERE id=?", (qty,pid))
-        self.conn.commit()
+        with self.transaction() as c:
+            self._check_open(c, date)
+            c.execute("INSERT INTO purchase_orders(total_pln,date) VALUES(?,?)", (total_pln,date))
+            oid = c.lastrowid
+            for pid, qty in items:
+                unit = (total_pln * qty / total_qty) / qty if total_qty > 0 and qty > 0 else 0
+                c.execute(
+                    "INSERT INTO purchase_items(order_id,product_id,qty,unit_cost,available_qty) VALUES(?,?,?,?,?)",
+                    (oid,pid,qty,unit,qty))
+                self._moves(c, [(pid, date, qty, "purchase", c.lastrowid)])
+        return oid
 
-    def list_purchases(self):
-        return self.conn.execute("""
-            SELECT pi.id, p.sku, p.title, pi.qty, po.total_pln, po.date
-            FROM purchase_items pi
-            JOIN purchase_orders po ON po.id=pi.order_id
+    def iter_purchases(self, date_from=None, date_to=None, share=False):
+        """Pozycje zakupów (PurchaseLot) od najnowszej, opcjonalnie tylko z zamówień z okresu (indeks
+        daty zamówienia), bez partii bilansu otwarcia (close_year). Zwraca kursor – wiersze są
+        czytane dopiero przy iteracji"""
+        ranged = date_from is not None or date_to is not None
+        return self._records(PurchaseLot, f"""
+            SELECT pi.id, p.sku, p.title, pi.qty, pi.unit_cost, pi.available_qty, po.total_pln, po.date
+            FROM {self._h['purchase_orders']} po
+            JOIN {self._h['purchase_items']} pi ON pi.order_id=po.id
             JOIN products p ON p.id=pi.product_id
-            ORDER BY po.date DESC
-        """).fetchall()
+            WHERE pi.origin_item_id IS NULL {"AND po.date BETWEEN ? AND ?" if ranged else ""}
+            ORDER BY po.date DESC, pi.id DESC
+        """, (date_from or "", date_to or "9999-12-31") if ranged else (), share)
+
+    def list_purchases(self, date_from=None, date_to=None):
+        return self.iter_purchases(date_from, date_to, share=True).fetchall()
 
     def delete_purchase(self, item_id):
-        c = self.conn.cursor()
-        item = c.execute("SELECT * FROM purchase_items WHERE id=?", (item_id,)).fetchone()
-        if not item: return
-        c.execute("UPDATE products SET stock=stock-? WHERE id=?", (item["qty"],item["product_id"]))
-        c.execute("DELETE FROM purchase_stock_history WHERE purchase_item_id=?", (item_id,))
-        c.execute("DELETE FROM purchase_items WHERE id=?", (item_id,))
-        self.conn.commit()
+        with self.transaction() as c:
+            item = c.execute("""
+                SELECT pi.*, po.date FROM purchase_items pi JOIN purchase_orders po ON po.id=pi.order_id
+                WHERE pi.id=?
+            """, (item_id,)).fetchone()
+            if not item:
+                self._check_archived("purchase_items", item_id); return
+            self._check_open(c, item["date"])
+            self._moves(c, [(item["product_id"], item["date"], -item["qty"], "reversal", item_id)])
+            c.execute("DELETE FROM purchase_stock_history WHERE purchase_item_id=?", (item_id,))
+            c.execute("DELETE FROM purchase_items WHERE id=?", (item_id,))
 
     def get_fifo_batches(self, pid, qty):
         return self.conn.execute("""
@@ -635,171 +1447,1382 @@ class DB:
         """, (pid, qty*10)).fetchall()
 
     # ── SALES ──
-    def add_sale_order(self, platform, total_pln, total_eur, items, fifo_cost, date):
-        c = self.conn.cursor()
-        c.execute(
-            "INSERT INTO sales_orders(platform,total_pln,total_eur,purchase_cost,date) VALUES(?,?,?,?,?)",
-            (platform,total_pln,total_eur,fifo_cost,date))
-        oid = c.lastrowid
-        for pid, qty in items:
-            c.execute("INSERT INTO sales_items(order_id,product_id,qty) VALUES(?,?,?)", (oid,pid,qty))
-            remaining = qty
-            batches = self.conn.execute("""
-                SELECT pi.id, pi.available_qty FROM purchase_items pi
-                JOIN purchase_orders po ON po.id=pi.order_id
-                WHERE pi.product_id=? AND pi.available_qty>0
-                ORDER BY po.date ASC, pi.id ASC
-            """, (pid,)).fetchall()
-            for b in batches:
-                if remaining <= 0: break
-                take = min(remaining, b["available_qty"])
-                self.conn.execute(
-                    "UPDATE purchase_items SET available_qty=available_qty-? WHERE id=?", (take,b["id"]))
-                remaining -= take
-            self.conn.execute("UPDATE products SET stock=stock-? WHERE id=?", (qty,pid))
-        self.conn.commit()
+    def add_sale_order(self, platform, total_pln, total_eur, items, fifo_cost, date, invoice=None):
+        """Sprzedaż z pobraniem partii FIFO w jednej transakcji zapisu.
+        Stan jest sprawdzany wewnątrz transakcji (ValueError przy braku towaru), a zapisany
+        koszt to koszt faktycznie pobranych partii – fifo_cost z okna jest tylko podglądem.
+        invoice – opcjonalnie dict(prefix, customer_name, customer_address): numer rachunku
+        jest nadawany i zapisywany w tej samej transakcji co sprzedaż"""
+        with self.transaction() as c:
+            self._check_open(c, date)
+            # ten sam produkt może być w kilku pozycjach – stan porównywany z sumą ilości
+            want = collections.Counter()
+            for pid, qty in items: want[pid] += qty
+            for pid, qty in want.items():
+                r = c.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()
+                if not r or r["stock"] < qty:
+                    raise ValueError(f"Niewystarczający stan produktu ID {pid}.")
+            c.execute(
+                "INSERT INTO sales_orders(platform,total_pln,total_eur,purchase_cost,date) VALUES(?,?,?,0,?)",
+                (platform,total_pln,total_eur,date))
+            oid  = c.lastrowid
+            cost = 0.0
+            took = []   # (partia, produkt, ilość) – purchase_stock_history
+            # przychód pozycji wg ilości; koszt pozycji = koszt jej partii FIFO
+            for (pid, qty), rev in zip(items, self._allocate(total_pln, [q for _, q in items])):
+                line_cost = 0.0
+                remaining = qty
+                batches = c.execute("""
+                    SELECT pi.id, pi.unit_cost, pi.available_qty FROM purchase_items pi
+                    JOIN purchase_orders po ON po.id=pi.order_id
+                    WHERE pi.product_id=? AND pi.available_qty>0
+                    ORDER BY po.date ASC, pi.id ASC
+                """, (pid,)).fetchall()
+                for b in batches:
+                    if remaining <= 0: break
+                    take = min(remaining, b["available_qty"])
+                    c.execute("UPDATE purchase_items SET available_qty=available_qty-? WHERE id=?", (take,b["id"]))
+                    line_cost += take * (b["unit_cost"] or 0); remaining -= take
+                    took.append((b["id"], pid, take))
+                c.execute("INSERT INTO sales_items(order_id,product_id,qty,revenue_pln,purchase_cost) "
+                          "VALUES(?,?,?,?,?)", (oid,pid,qty,rev,line_cost))
+                cost += line_cost
+            self._moves(c, [(pid, date, -qty, "sale", oid) for pid, qty in items])
+            self._record_lots(c, [(i, pid, q, date, oid) for i, pid, q in took])
+            c.execute("UPDATE sales_orders SET purchase_cost=? WHERE id=?", (cost,oid))
+            if invoice:
+                inv_no = self._next_invoice_number(c, invoice.get("prefix") or "R", datetime.now().year)
+                c.execute("""
+                    INSERT INTO invoices(invoice_number,sale_order_id,customer_name,
+                                         customer_address,issue_date,total_amount)
+                    VALUES(?,?,?,?,?,?)
+                """, (inv_no,oid,invoice.get("customer_name",""),invoice.get("customer_address",""),
+                      datetime.now().strftime("%Y-%m-%d"),total_pln))
         return oid
 
-    def list_sales(self):
-        return self.conn.execute("""
-            SELECT so.id, so.platform, so.total_pln, so.total_eur,
-                   so.purchase_cost,
-                   (so.total_pln - so.purchase_cost) AS profit,
-                   so.date,
-                   GROUP_CONCAT(p.sku || ' x' || si.qty, ', ') AS items
-            FROM sales_orders so
-            LEFT JOIN sales_items si ON si.order_id=so.id
-            LEFT JOIN products p ON p.id=si.product_id
-            GROUP BY so.id ORDER BY so.date DESC
-        """).fetchall()
+    SALE_SQL = """SELECT id, platform, total_pln, total_eur, purchase_cost, (total_pln - purchase_cost) AS profit, date
+                  FROM {sales_orders}"""
+
+    def _sale_items(self, ids=None):
+        """order_id -> 'SKU xN, SKU xM'. Lista id (po 500) to zapytanie po indeksie order_id – SQLite
+        przenosi ją do każdego pliku archiwum zamiast składać wszystkie pozycje z widoku;
+        ids=None – cała historia jednym przejściem"""
+        items = {}
+        sql   = (f"SELECT si.order_id, p.sku, si.qty FROM {self._h['sales_items']} si "
+                 f"JOIN products p ON p.id=si.product_id {{}} ORDER BY si.id")
+        if ids is None: chunks = [(sql.format(""), ())]
+        else:
+            chunks = [(sql.format(f"WHERE si.order_id IN ({','.join('?' * len(ids[i:i+500]))})"), ids[i:i+500])
+                      for i in range(0, len(ids), 500)]
+        for q, args in chunks:
+            for oid, sku, qty in self._records(None, q, args):
+                # dopisywanie do tekstu zamiast listy na zamówienie – zwykle 1–2 pozycje
+                items[oid] = f"{items[oid]}, {sku} x{qty}" if oid in items else f"{sku} x{qty}"
+        return items
+
+    def list_sales(self, limit=None, offset=0):
+        """Sprzedaże (Sale, items = 'SKU xN, SKU xM') od najnowszej; limit/offset stronicują zamówienia"""
+        cur  = self._records(None, self.SALE_SQL.format(**self._h) + " ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+                             (-1 if limit is None else limit, offset))
+        # cała historia: najpierw pozycje, zamówienia prosto z kursora – bez listy pośrednich krotek
+        if limit is None: page, items = cur, self._sale_items()
+        else:
+            page  = cur.fetchall()
+            items = self._sale_items([s[0] for s in page])
+        make = Sale.factory(share=True)
+        return [make(None, (*s, items.get(s[0]))) for s in page]
+
+    def iter_sales(self, date_from=None, date_to=None, batch=500):
+        """Sprzedaże (Sale) od najnowszej bez listy całej historii w pamięci: zamówienia czytane
+        partiami po `batch`, pozycje partii jednym zapytaniem z listą id"""
+        ranged = date_from is not None or date_to is not None
+        cur = self._records(None, self.SALE_SQL.format(**self._h)
+                            + (" WHERE date BETWEEN ? AND ?" if ranged else "") + " ORDER BY date DESC, id DESC",
+                            (date_from or "", date_to or "9999-12-31") if ranged else ())
+        make = Sale.factory()
+        while page := cur.fetchmany(batch):
+            items = self._sale_items([s[0] for s in page])
+            for s in page: yield make(None, (*s, items.get(s[0])))
+
+    def count_sales(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self._h['sales_orders']}").fetchone()[0]
+
+    def get_sale(self, order_id):
+        """Sprzedaż z pozycjami jako dict (None, gdy nie istnieje)"""
+        so = self.conn.execute(f"SELECT * FROM {self._h['sales_orders']} WHERE id=?", (order_id,)).fetchone()
+        if not so: return None
+        return dict(so, items=[dict(r) for r in self.conn.execute(f"""
+            SELECT si.product_id, p.sku, si.qty, si.revenue_pln, si.purchase_cost FROM {self._h['sales_items']} si
+            LEFT JOIN products p ON p.id=si.product_id WHERE si.order_id=? ORDER BY si.id
+        """, (order_id,))])
 
     def delete_sale(self, order_id):
-        c = self.conn.cursor()
-        items = c.execute("SELECT product_id,qty FROM sales_items WHERE order_id=?", (order_id,)).fetchall()
-        for item in items:
-            c.execute("UPDATE products SET stock=stock+? WHERE id=?", (item["qty"],item["product_id"]))
-        c.execute("DELETE FROM sales_items WHERE order_id=?", (order_id,))
-        c.execute("DELETE FROM invoices WHERE sale_order_id=?", (order_id,))
-        c.execute("DELETE FROM sales_orders WHERE id=?", (order_id,))
-        self.conn.commit()
-
-    def get_detailed_sales(self, date_from, date_to):
-        return self.conn.execute("""
+        with self.transaction() as c:
+            items = c.execute("""
+                SELECT si.product_id, si.qty, so.date FROM sales_items si
+                JOIN sales_orders so ON so.id=si.order_id WHERE si.order_id=?
+            """, (order_id,)).fetchall()
+            if not items: self._check_archived("sales_orders", order_id)
+            so = c.execute("SELECT date FROM sales_orders WHERE id=?", (order_id,)).fetchone()
+            if so: self._check_open(c, so["date"])
+            self._moves(c, [(i["product_id"], i["date"], i["qty"], "reversal", order_id) for i in items])
+            self._restore_lots(c, order_id, items)
+            c.execute("DELETE FROM sales_items WHERE order_id=?", (order_id,))
+            c.execute("DELETE FROM invoices WHERE sale_order_id=?", (order_id,))
+            c.execute("DELETE FROM sales_orders WHERE id=?", (order_id,))
+
+    @staticmethod
+    def _record_lots(c, rows):
+        """Zapis pobrań partii [(partia, produkt, ilość, data, sprzedaż), ...]"""
+        c.executemany("INSERT INTO purchase_stock_history(purchase_item_id,product_id,qty,date,sale_order_id) "
+                      "VALUES(?,?,?,?,?)", rows)
+
+    def _restore_lots(self, c, order_id, items):
+        """Zwraca ilość usuwanej sprzedaży do partii, z których ją pobrano (purchase_stock_history).
+        Bez zapisu pobrania (sprzedaż sprzed historii, partia usunięta lub w archiwum) ilość
+        wraca do ostatnio zdjętych partii produktu, odwrotnie do FIFO – stan = suma partii"""
+        back, left = collections.Counter(), collections.Counter()
+        for i in items: left[i["product_id"]] += i["qty"]
+        for h in c.execute("""
+            SELECT h.purchase_item_id, h.product_id, h.qty FROM purchase_stock_history h
+            JOIN purchase_items pi ON pi.id=h.purchase_item_id WHERE h.sale_order_id=?
+        """, (order_id,)).fetchall():
+            back[h["purchase_item_id"]] += h["qty"]; left[h["product_id"]] -= h["qty"]
+        end = self.closed_until()
+        for pid, q in left.items():
+            if q <= 0: continue
+            for b in c.execute("""
+                SELECT pi.id, pi.qty-pi.available_qty AS used FROM purchase_items pi
+                JOIN purchase_orders po ON po.id=pi.order_id
+                WHERE pi.product_id=? AND pi.available_qty<pi.qty AND po.date>?
+                ORDER BY po.date DESC, pi.id DESC
+            """, (pid, end)).fetchall():
+                take = min(q, b["used"] - back[b["id"]])
+                if take <= 0: continue
+                back[b["id"]] += take; q -= take
+                if not q: break
+        c.executemany("UPDATE purchase_items SET available_qty=available_qty+? WHERE id=?",
+                      [(q, i) for i, q in back.items()])
+        c.execute("DELETE FROM purchase_stock_history WHERE sale_order_id=?", (order_id,))
+
+    def iter_sale_lines(self, date_from, date_to, share=False):
+        """Pozycje sprzedaży okresu (SaleLine) z danymi zamówienia – kursor, wiersze czytane przy iteracji"""
+        return self._records(SaleLine, f"""
             SELECT so.id AS order_id, so.platform, so.date,
                    so.total_pln AS order_total_pln,
                    so.total_eur AS order_total_eur,
                    so.purchase_cost AS order_total_cost,
                    p.sku, p.title, si.qty,
-                   so.total_pln AS item_revenue_pln,
-                   so.purchase_cost AS item_cost,
-                   (so.total_pln - so.purchase_cost) AS item_profit
-            FROM sales_orders so
-            JOIN sales_items si ON si.order_id=so.id
+                   si.revenue_pln AS item_revenue_pln,
+                   si.purchase_cost AS item_cost,
+                   (si.revenue_pln - si.purchase_cost) AS item_profit
+            FROM {self._h['sales_orders']} so
+            JOIN {self._h['sales_items']} si ON si.order_id=so.id
             JOIN products p ON p.id=si.product_id
             WHERE so.date BETWEEN ? AND ?
             ORDER BY so.date, so.id
-        """, (date_from,date_to)).fetchall()
+        """, (date_from,date_to), share)
+
+    def get_detailed_sales(self, date_from, date_to):
+        return self.iter_sale_lines(date_from, date_to, share=True).fetchall()
+
+    def get_report_orders(self, date_from, date_to):
+        """Zamówienia okresu do raportu: jeden wiersz na zamówienie (dict, products = 'SKU xN, SKU xM'
+        w kolejności dodania). Złączenie zamówień z pozycjami po indeksach – także przez widoki
+        archiwum, gdzie podzapytanie z GROUP_CONCAT składałoby najpierw wszystkie pozycje"""
+        rows = self.conn.execute(f"""
+            SELECT so.id, so.date, so.platform, so.total_pln AS pln, so.purchase_cost AS cost, p.sku, si.qty
+            FROM {self._h['sales_orders']} so
+            JOIN {self._h['sales_items']} si ON si.order_id=so.id
+            JOIN products p ON p.id=si.product_id
+            WHERE so.date BETWEEN ? AND ?
+            ORDER BY so.date, so.id, si.id
+        """, (date_from,date_to))
+        out = []
+        for _, lines in itertools.groupby(rows, key=lambda r: r["id"]):
+            lines = list(lines); o = lines[0]
+            out.append({"date": o["date"], "platform": o["platform"], "pln": o["pln"], "cost": o["cost"],
+                        "products": ", ".join(f"{l['sku']} x{l['qty']}" for l in lines)})
+        return out
+
+    def get_sales_totals(self, date_from, date_to):
+        if date_from.endswith("-01-01") and date_to == f"{date_from[:4]}-12-31":
+            cp = self.closed_period(int(date_from[:4]))   # cały zamknięty rok
+            if cp: return {"count": cp["sale_count"], "revenue": cp["revenue"], "cost": cp["cost"]}
+        r = self.conn.execute(f"""
+            SELECT COUNT(*) AS count, COALESCE(SUM(total_pln),0) AS revenue,
+                   COALESCE(SUM(purchase_cost),0) AS cost
+            FROM {self._h['sales_orders']} WHERE date BETWEEN ? AND ?
+        """, (date_from,date_to)).fetchone()
+        return dict(r)
+
+    def get_sku_profitability(self, date_from=None, date_to=None):
+        """Rentowność produktów w okresie (domyślnie cała historia), od największego zysku:
+        sztuki, zamówienia, przychód, koszt FIFO, zysk i marża % – sumy pozycji liczone w SQL"""
+        if date_from is None and date_to is None:
+            src = f"{self._h['sales_items']} si"   # bez filtra dat: sam indeks idx_sales_items_product
+        else:
+            src = (f"{self._h['sales_orders']} so JOIN {self._h['sales_items']} si ON si.order_id=so.id "
+                   "WHERE so.date BETWEEN ? AND ?")
+        args = () if date_from is None and date_to is None else (date_from or "", date_to or "9999-12-31")
+        items = [dict(r) for r in self.conn.execute(f"""
+            SELECT p.id AS product_id, p.sku, p.title, s.units, s.orders,
+                   ROUND(s.revenue,2) AS revenue, ROUND(s.cost,2) AS cost, ROUND(s.revenue-s.cost,2) AS profit
+            FROM (SELECT si.product_id, SUM(si.qty) AS units, COUNT(DISTINCT si.order_id) AS orders,
+                         COALESCE(SUM(si.revenue_pln),0) AS revenue, COALESCE(SUM(si.purchase_cost),0) AS cost
+                  FROM {src} GROUP BY si.product_id) s
+            JOIN products p ON p.id=s.product_id
+            ORDER BY profit DESC, p.sku
+        """, args)]
+        for it in items: it["margin"] = it["profit"] / it["revenue"] * 100 if it["revenue"] else 0.0
+        return items
 
     # ── INVOICES ──
     def add_invoice(self, invoice_number, sale_id, file_path, customer_name, customer_address, amount):
-        self.conn.execute("""
-            INSERT INTO invoices(invoice_number,sale_order_id,file_path,customer_name,
-                                 customer_address,issue_date,total_amount)
-            VALUES(?,?,?,?,?,?,?)
-        """, (invoice_number,sale_id,file_path,customer_name,customer_address,
-              datetime.now().strftime("%Y-%m-%d"),amount))
-        self.conn.commit()
+        issue_date = datetime.now().strftime("%Y-%m-%d")
+        with self.transaction() as c:
+            self._check_open(c, issue_date)
+            c.execute("""
+                INSERT INTO invoices(invoice_number,sale_order_id,file_path,customer_name,
+                                     customer_address,issue_date,total_amount)
+                VALUES(?,?,?,?,?,?,?)
+            """, (invoice_number,sale_id,file_path,customer_name,customer_address,issue_date,amount))
+
+    # ── NUMERACJA RACHUNKÓW ──
+    def _ensure_invoice_sequence(self, c, prefix, year):
+        # nowa seria startuje za najwyższym numerem już obecnym w invoices
+        if c.execute("SELECT 1 FROM invoice_sequences WHERE prefix=? AND year=?", (prefix, year)).fetchone():
+            return
+        # prefiks i rok porównywane dokładnie (LIKE ignoruje wielkość liter, a % i _ w prefiksie
+        # działałyby jak wzorzec); środek numeru musi składać się z samych cyfr
+        c.execute(f"""
+            INSERT OR IGNORE INTO invoice_sequences(prefix,year,next_no)
+            SELECT ?1, ?2, COALESCE(MAX(CAST(no AS INTEGER)), 0) + 1
+            FROM (SELECT substr(invoice_number, length(?1)+2,
+                                length(invoice_number)-length(?1)-length(?2)-2) AS no
+                  FROM {self._h['invoices']}
+                  WHERE substr(invoice_number, 1, length(?1)+1) = ?1 || '/'
+                    AND substr(invoice_number, -length(?2)-1) = '/' || ?2)
+            WHERE no GLOB '[0-9]*' AND no NOT GLOB '*[^0-9]*'
+        """, (prefix, str(year)))
+
+    def _next_invoice_number(self, c, prefix, year):
+        self._ensure_invoice_sequence(c, prefix, year)
+        n = c.execute("""
+            UPDATE invoice_sequences SET next_no=next_no+1
+            WHERE prefix=? AND year=? RETURNING next_no-1
+        """, (prefix, year)).fetchone()[0]
+        return f"{prefix}/{n:04d}/{year}"
+
+    def next_invoice_number(self, prefix="R", year=None):
+        """Rezerwuje kolejny numer rachunku (atomowo, w bazie)"""
+        with self.transaction() as c:
+            return self._next_invoice_number(c, prefix, year or datetime.now().year)
+
+    def seed_invoice_sequence(self, prefix, year, next_no):
+        # licznik nigdy nie cofa się poniżej już przydzielonych numerów
+        with self.transaction() as c:
+            self._ensure_invoice_sequence(c, prefix, year)
+            c.execute("""
+                UPDATE invoice_sequences SET next_no=MAX(next_no, ?) WHERE prefix=? AND year=?
+            """, (next_no, prefix, year))
+
+    def reset_invoice_sequence(self, prefix="R", year=None):
+        # seria zostanie odtworzona od najwyższego istniejącego numeru (lub od 1)
+        year = int(year or datetime.now().year)
+        with self.transaction() as c:
+            self._check_open(c, f"{year}-12-31")   # numeracja zamkniętego roku zostaje
+            c.execute("DELETE FROM invoice_sequences WHERE prefix=? AND year=?", (prefix, year))
+
+    def get_sale_invoice(self, sale_id):
+        r = self.conn.execute(f"SELECT * FROM {self._h['invoices']} WHERE sale_order_id=? ORDER BY id DESC LIMIT 1",
+                              (sale_id,)).fetchone()
+        return dict(r) if r else None
+
+    def set_invoice_file(self, iid, file_path):
+        with self.transaction() as c:
+            c.execute("UPDATE invoices SET file_path=? WHERE id=?", (file_path, iid))
+
+    def iter_invoices(self, date_from=None, date_to=None, batch=500, share=False):
+        """Rachunki (Invoice) od najnowszego z platformą sprzedaży – dobieraną dla partii `batch`
+        rachunków listą id (jak pozycje w iter_sales)"""
+        ranged = bool(date_from and date_to)
+        cur = self._records(None, f"""
+            SELECT id, invoice_number, sale_order_id, file_path, customer_name, customer_address,
+                   issue_date, total_amount, created_at
+            FROM {self._h['invoices']} {"WHERE issue_date BETWEEN ? AND ?" if ranged else ""}
+            ORDER BY created_at DESC, id DESC
+        """, (date_from,date_to) if ranged else ())
+        make = Invoice.factory(share)
+        while page := cur.fetchmany(batch):
+            ids  = sorted({i[2] for i in page if i[2] is not None})
+            plat = dict(self._records(None, f"SELECT id, platform FROM {self._h['sales_orders']} "
+                                            f"WHERE id IN ({','.join('?' * len(ids))})", ids)) if ids else {}
+            for i in page: yield make(None, (*i, plat.get(i[2])))
 
     def list_invoices(self, date_from=None, date_to=None):
-        if date_from and date_to:
-            return self.conn.execute("""
-                SELECT i.*, so.platform FROM invoices i
-                LEFT JOIN sales_orders so ON so.id=i.sale_order_id
-                WHERE i.issue_date BETWEEN ? AND ?
-                ORDER BY i.created_at DESC
-            """, (date_from,date_to)).fetchall()
-        return self.conn.execute("""
-            SELECT i.*, so.platform FROM invoices i
-            LEFT JOIN sales_orders so ON so.id=i.sale_order_id
-            ORDER BY i.created_at DESC
-        """).fetchall()
+        return list(self.iter_invoices(date_from, date_to, share=True))
 
     def delete_invoice(self, iid):
-        self.conn.execute("DELETE FROM invoices WHERE id=?", (iid,))
-        self.conn.commit()
+        with self.transaction() as c:
+            r = c.execute("SELECT issue_date FROM invoices WHERE id=?", (iid,)).fetchone()
+            if r: self._check_open(c, r[0])
+            c.execute("DELETE FROM invoices WHERE id=?", (iid,))
+
+    # ── IMPORT ──
+    def _next_id(self, c, table):
+        """Pierwsze wolne id tabeli AUTOINCREMENT (wywoływać w otwartej transakcji)"""
+        seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+        mx  = c.execute(f"SELECT COALESCE(MAX(id),0) FROM {table}").fetchone()[0]
+        return max(seq[0] if seq else 0, mx) + 1
+
+    def bulk_import(self, rows, dry_run=False):
+        """Import produktów, zakupów i sprzedaży z jednego pliku w jednej transakcji.
+
+        rows – iterowalne (nr_wiersza, słownik) z read_import_rows().
+        Wiersze z tym samym numerem zamówienia tworzą jedno zamówienie.
+        Przy jakimkolwiek błędzie (lub dry_run) cała transakcja jest wycofywana."""
+        rep = {"products": 0, "products_skipped": 0, "purchases": 0, "purchase_lines": 0,
+               "sales": 0, "sale_lines": 0, "errors": [], "dry_run": dry_run}
+        err = rep["errors"]
+
+        # ── walidacja wierszy ──
+        new_products, lines = {}, []
+        for n, r in rows:
+            kind = IMPORT_KINDS.get(str(r.get("kind") or "").strip().lower())
+            sku  = str(r.get("sku") or "").strip()
+            if not kind: err.append((n, f"nieznany typ wiersza: {r.get('kind')!r}")); continue
+            if not sku:  err.append((n, "brak SKU")); continue
+            if kind == "product":
+                title = str(r.get("title") or "").strip()
+                if not title: err.append((n, "brak nazwy produktu")); continue
+                if sku in new_products: err.append((n, f"SKU {sku} powtórzone w pliku")); continue
+                new_products[sku] = title; continue
+            try:
+                date   = _import_date(r.get("date"))
+                qty    = _import_num(r.get("qty"))
+                amount = _import_num(r.get("amount"), 0.0)
+                eur    = _import_num(r.get("eur"), None)
+            except ValueError as e:
+                err.append((n, str(e))); continue
+            if qty <= 0 or qty != int(qty): err.append((n, f"nieprawidłowa ilość: {r.get('qty')!r}")); continue
+            if amount < 0: err.append((n, "kwota nie może być ujemna")); continue
+            order    = str(r.get("order") or "").strip() or f"#{n}"
+            platform = str(r.get("platform") or "").strip() or "Inne"
+            lines.append((n, kind, order, date, sku, int(qty), amount, eur, platform))
+        # zamówienie bez EUR w żadnym wierszu dostaje kurs NBP – daty z zapasem (wiersze bez EUR)
+        rates = self._import_rates([l[3] for l in lines if l[1] == "sale" and l[7] is None], dry_run)
+
+        try:
+            with self.transaction() as c:
+                # ── jedno zbiorcze wyszukanie SKU ──
+                c.execute("CREATE TEMP TABLE IF NOT EXISTS import_sku(sku TEXT PRIMARY KEY)")
+                c.execute("DELETE FROM temp.import_sku")
+                c.executemany("INSERT OR IGNORE INTO temp.import_sku(sku) VALUES(?)",
+                              [(s,) for s in new_products] + [(l[4],) for l in lines])
+                lookup = "SELECT p.sku, p.id, p.stock FROM products p JOIN temp.import_sku s ON s.sku=p.sku"
+                known = {r["sku"] for r in c.execute(lookup)}
+                add = [(s, t) for s, t in new_products.items() if s not in known]
+                c.executemany("INSERT INTO products(sku,title,stock) VALUES(?,?,0)", add)
+                rep["products"] = len(add); rep["products_skipped"] = len(new_products) - len(add)
+                ids = {r["sku"]: r["id"] for r in c.execute(lookup)}
+
+                # ── grupowanie w zamówienia ──
+                purchases, sales, closed = {}, {}, self.closed_until()
+                for n, kind, order, date, sku, qty, amount, eur, platform in lines:
+                    pid = ids.get(sku)
+                    if pid is None: err.append((n, f"nieznane SKU: {sku}")); continue
+                    if date <= closed: err.append((n, f"data {date} w zamkniętym okresie (do {closed})")); continue
+                    o = (purchases if kind == "purchase" else sales).setdefault(
+                        order, {"date": date, "platform": platform, "eur": None, "lines": []})
+                    if o["date"] != date:
+                        err.append((n, f"zamówienie {order}: różne daty w pozycjach")); continue
+                    if eur is not None: o["eur"] = (o["eur"] or 0.0) + eur
+                    o["lines"].append((n, pid, qty, amount))
+
+                # ── zakupy ──
+                oid = self._next_id(c, "purchase_orders"); iid = self._next_id(c, "purchase_items")
+                po_rows, pi_rows, mv_rows = [], [], []
+                for o in purchases.values():
+                    po_rows.append((oid, sum(l[3] for l in o["lines"]), o["date"]))
+                    for _, pid, qty, amount in o["lines"]:
+                        pi_rows.append((iid, oid, pid, qty, amount / qty, qty))
+                        mv_rows.append((pid, o["date"], qty, "purchase", iid))
+                        iid += 1
+                    oid += 1
+                c.executemany("INSERT INTO purchase_orders(id,total_pln,date) VALUES(?,?,?)", po_rows)
+                c.executemany("INSERT INTO purchase_items(id,order_id,product_id,qty,unit_cost,available_qty) "
+                              "VALUES(?,?,?,?,?,?)", pi_rows)
+                self._moves(c, mv_rows)
+                rep["purchases"] = len(po_rows); rep["purchase_lines"] = len(pi_rows)
+
+                # ── sprzedaż: FIFO w kolejności dat ──
+                rep["sales"], rep["sale_lines"] = self._fifo_sales(c, sales, err, rates)
+                err.sort()
+                if err or dry_run: raise _Rollback
+        except _Rollback:
+            pass
+        return rep
+
+    @staticmethod
+    def _import_rates(dates, dry_run):
+        """Kursy EUR dla dat sprzedaży bez kwoty EUR – pobierane z NBP przed transakcją zapisu,
+        żeby blokada bazy nie trwała przez zapytania sieciowe"""
+        return get_eur_rates(min(dates), max(dates)) if dates and not dry_run else {}
+
+    def _fifo_sales(self, c, sales, err, rates):
+        """Zapis zamówień sprzedaży z pobraniem partii FIFO, w kolejności dat, w transakcji `c`.
+        sales – {klucz: {date, platform, eur, lines: [(nr_wiersza, pid, ilość, kwota)], ext?}};
+        rates – kursy EUR z _import_rates (brak kursu – 4.25);
+        zamówienie bez pokrycia w stanie trafia do err. Zwraca (zamówienia, pozycje)"""
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS import_pid(id INTEGER PRIMARY KEY)")
+        c.execute("DELETE FROM temp.import_pid")
+        c.executemany("INSERT OR IGNORE INTO temp.import_pid(id) VALUES(?)",
+                      [(l[1],) for o in sales.values() for l in o["lines"]])
+        stock = {r["id"]: r["stock"] for r in
+                 c.execute("SELECT p.id, p.stock FROM products p JOIN temp.import_pid t ON t.id=p.id")}
+        lots = {}
+        for b in c.execute("""
+            SELECT pi.id, pi.product_id, pi.unit_cost, pi.available_qty
+            FROM purchase_items pi
+            JOIN purchase_orders po ON po.id=pi.order_id
+            JOIN temp.import_pid t ON t.id=pi.product_id
+            WHERE pi.available_qty>0
+            ORDER BY po.date ASC, pi.id ASC
+        """):
+            lots.setdefault(b["product_id"], []).append([b["id"], b["unit_cost"], b["available_qty"]])
+        lot_pos, touched = {}, {}
+
+        oid = self._next_id(c, "sales_orders")
+        so_rows, si_rows, mv_rows, ph_rows = [], [], [], []
+        for key, o in sorted(sales.items(), key=lambda kv: kv[1]["date"]):
+            want = {}
+            for _, pid, qty, _ in o["lines"]: want[pid] = want.get(pid, 0) + qty
+            short = [pid for pid, q in want.items() if stock[pid] < q]
+            if short:
+                for n, pid, _, _ in o["lines"]:
+                    if pid in short: err.append((n, f"zamówienie {key}: niewystarczający stan (ID {pid})"))
+                continue
+            pid_cost = {}
+            for pid, q in want.items():
+                stock[pid] -= q; mv_rows.append((pid, o["date"], -q, "sale", oid))
+                pl = lots.get(pid, []); i = lot_pos.get(pid, 0); pc = 0.0
+                while q > 0 and i < len(pl):
+                    take = min(q, pl[i][2]); pl[i][2] -= take; q -= take
+                    pc += take * pl[i][1]; touched[pl[i][0]] = pl[i][2]
+                    if take: ph_rows.append((pl[i][0], pid, take, o["date"], oid))
+                    if pl[i][2] == 0: i += 1
+                lot_pos[pid] = i; pid_cost[pid] = pc
+            cost = sum(pid_cost.values())
+            pln = sum(l[3] for l in o["lines"])
+            eur = o["eur"] if o["eur"] is not None else pln / rates.get(o["date"], 4.25)
+            so_rows.append((oid, o["platform"], pln, eur, cost, o["date"], o.get("ext")))
+            # kilka wierszy tego samego produktu dzieli jego koszt FIFO wg ilości
+            si_rows += [(oid, pid, qty, amt, pid_cost[pid] * qty / want[pid]) for _, pid, qty, amt in o["lines"]]
+            oid += 1
+        c.executemany("INSERT INTO sales_orders(id,platform,total_pln,total_eur,purchase_cost,date,external_order_id) "
+                      "VALUES(?,?,?,?,?,?,?)", so_rows)
+        c.executemany("INSERT INTO sales_items(order_id,product_id,qty,revenue_pln,purchase_cost) "
+                      "VALUES(?,?,?,?,?)", si_rows)
+        c.executemany("UPDATE purchase_items SET available_qty=? WHERE id=?", [(a, i) for i, a in touched.items()])
+        self._moves(c, mv_rows)
+        self._record_lots(c, ph_rows)
+        return len(so_rows), len(si_rows)
+
+    def import_marketplace_orders(self, platform, rows, dry_run=False):
+        """Import zamówień z eksportu platformy (read_marketplace_rows) w jednej transakcji.
+
+        Wiersze z tym samym numerem zamówienia tworzą jedno zamówienie; numery już zapisane
+        dla tej platformy są pomijane (duplikaty), więc ponowny import nakładającego się
+        eksportu niczego nie zmienia. SKU z oferty jest szukane najpierw w listing_skus,
+        potem wśród SKU produktów. Przy błędzie (lub dry_run) nic nie zostaje zapisane."""
+        rep = {"orders": 0, "lines": 0, "duplicates": 0, "unknown_skus": [], "errors": [], "dry_run": dry_run}
+        err = rep["errors"]
+
+        # ── walidacja i grupowanie (strumieniowo, w pamięci tylko zamówienia) ──
+        orders = {}
+        for n, r in rows:
+            ext = str(r.get("order") or "").strip()
+            sku = str(r.get("sku") or "").strip()
+            if not ext: err.append((n, "brak numeru zamówienia")); continue
+            if not sku: err.append((n, "brak SKU")); continue
+            try:
+                date   = _import_date(r.get("date"))
+                qty    = _import_num(r.get("qty"), 1.0)
+                amount = _import_num(r.get("amount"))
+                eur    = _import_num(r.get("eur"), None)
+            except ValueError as e:
+                err.append((n, str(e))); continue
+            if qty <= 0 or qty != int(qty): err.append((n, f"nieprawidłowa ilość: {r.get('qty')!r}")); continue
+            if amount < 0: err.append((n, "kwota nie może być ujemna")); continue
+            o = orders.setdefault(ext, {"date": date, "platform": platform, "eur": None, "ext": ext, "lines": []})
+            if o["date"] != date: err.append((n, f"zamówienie {ext}: różne daty w pozycjach")); continue
+            if eur is not None: o["eur"] = (o["eur"] or 0.0) + eur
+            o["lines"].append((n, sku, int(qty), amount))
+        rates = self._import_rates([o["date"] for o in orders.values() if o["eur"] is None], dry_run)
+
+        try:
+            with self.transaction() as c:
+                # ── pominięcie zamówień już zaimportowanych (indeks idx_sales_external) ──
+                c.execute("CREATE TEMP TABLE IF NOT EXISTS import_ext(ext TEXT PRIMARY KEY)")
+                c.execute("DELETE FROM temp.import_ext")
+                c.executemany("INSERT INTO temp.import_ext(ext) VALUES(?)", [(k,) for k in orders])
+                # CROSS JOIN – pętla po numerach z pliku i wyszukiwanie w indeksie: O(n) względem pliku
+                for r in c.execute(f"SELECT e.ext FROM temp.import_ext e CROSS JOIN {self._h['sales_orders']} so "
+                                   "ON so.platform=? AND so.external_order_id=e.ext", (platform,)).fetchall():
+                    del orders[r[0]]; rep["duplicates"] += 1
+                if not orders and not err: return rep
+                closed = self.closed_until()
+                for o in orders.values():
+                    if o["date"] <= closed:
+                        err += [(n, f"data {o['date']} w zamkniętym okresie (do {closed})") for n, *_ in o["lines"]]
+
+                # ── SKU oferty -> produkt ──
+                c.execute("CREATE TEMP TABLE IF NOT EXISTS import_sku(sku TEXT PRIMARY KEY)")
+                c.execute("DELETE FROM temp.import_sku")
+                c.executemany("INSERT OR IGNORE INTO temp.import_sku(sku) VALUES(?)",
+                              [(l[1],) for o in orders.values() for l in o["lines"]])
+                ids = {r["sku"]: r["id"] for r in c.execute(
+                    "SELECT p.sku, p.id FROM products p JOIN temp.import_sku s ON s.sku=p.sku")}
+                ids.update((r["listing_sku"], r["product_id"]) for r in c.execute("""
+                    SELECT l.listing_sku, l.product_id FROM listing_skus l
+                    JOIN temp.import_sku s ON s.sku=l.listing_sku WHERE l.platform=?
+                """, (platform,)))
+                unknown = set()
+                for o in orders.values():
+                    for n, sku, qty, amount in o["lines"]:
+                        if sku not in ids: err.append((n, f"nieznane SKU: {sku}")); unknown.add(sku)
+                    o["lines"] = [(n, ids.get(sku), qty, amount) for n, sku, qty, amount in o["lines"]]
+                rep["unknown_skus"] = sorted(unknown)
+                if not err:
+                    rep["orders"], rep["lines"] = self._fifo_sales(c, orders, err, rates)
+                err.sort()
+                if err or dry_run: raise _Rollback
+        except _Rollback:
+            pass
+        return rep
+
+    def set_listing_sku(self, platform, listing_sku, pid):
+        """Przypisanie SKU/ID oferty z platformy do produktu (pid=None usuwa przypisanie)"""
+        with self.transaction() as c:
+            if pid is None:
+                c.execute("DELETE FROM listing_skus WHERE platform=? AND listing_sku=?", (platform, listing_sku))
+            else:
+                c.execute("INSERT OR REPLACE INTO listing_skus(platform,listing_sku,product_id) VALUES(?,?,?)",
+                          (platform, listing_sku, pid))
+
+    def list_listing_skus(self, platform=None):
+        return self.conn.execute("""
+            SELECT l.platform, l.listing_sku, l.product_id, p.sku, p.title FROM listing_skus l
+            JOIN products p ON p.id=l.product_id
+            WHERE ? IS NULL OR l.platform=? ORDER BY l.platform, l.listing_sku
+        """, (platform, platform)).fetchall()
+
+    # ── WYCENA ──
+    def inventory_valuation(self, as_of):
+        """Wycena zapasu metodą FIFO na koniec dnia `as_of`.
+        Jedno przejście zbiorowe: narastająca suma partii (wg daty zakupu) minus łączna
+        sprzedaż do dnia odcięcia – sprzedaż zdejmuje najpierw najstarsze partie. Po zamknięciu
+        roku liczone od bilansu otwarcia (FIFO_LEFT_SQL), bez partii i sprzedaży lat zamkniętych.
+        ledger_qty to stan z rejestru ruchów (z korektami) do porównania."""
+        y     = self.conn.execute("SELECT MAX(year) FROM closed_periods WHERE year||'-12-31'<=?",
+                                  (as_of,)).fetchone()[0]
+        since = f"{y}-12-31" if y is not None else ""
+        items = [dict(r) for r in self.conn.execute(f"""
+            WITH rem AS ({self.FIFO_LEFT_SQL.format(after="AND so.date>?2" if since else "", **self._h)}
+            ), ledger AS (
+                SELECT product_id, SUM(qty) AS q FROM stock_movements WHERE date<=?1 GROUP BY product_id
+            )
+            SELECT p.id AS product_id, p.sku, p.title, SUM(r.left) AS qty,
+                   ROUND(SUM(r.left*r.unit_cost),2) AS value, SUM(r.left>0) AS lots,
+                   COALESCE(g.q,0) AS ledger_qty
+            FROM rem r JOIN products p ON p.id=r.product_id
+            LEFT JOIN ledger g ON g.product_id=r.product_id
+            GROUP BY r.product_id HAVING SUM(r.left)>0 OR COALESCE(g.q,0)<>0
+            ORDER BY p.sku
+        """, (as_of, since))]
+        for it in items: it["avg_cost"] = it["value"] / it["qty"] if it["qty"] else 0.0
+        return {"as_of": as_of, "items": items,
+                "total_qty": sum(i["qty"] for i in items),
+                "total_value": round(sum(i["value"] for i in items), 2)}
+
+    def get_daily_sales(self, date_from, date_to):
+        """Sprzedane sztuki: jeden wiersz (product_id, date, qty) na produkt i dzień ze sprzedażą"""
+        return self.conn.execute(f"""
+            SELECT si.product_id, so.date, SUM(si.qty) AS qty
+            FROM {self._h['sales_orders']} so JOIN {self._h['sales_items']} si ON si.order_id=so.id
+            WHERE so.date BETWEEN ? AND ?
+            GROUP BY si.product_id, so.date
+        """, (date_from, date_to)).fetchall()
+
+    # ── ANALIZA ROTACJI ──
+    VELOCITY_DAYS   = 90   # okno tempa sprzedaży dla dni zapasu
+    DEAD_STOCK_DAYS = 90   # towar na stanie bez sprzedaży przez tyle dni = zalegający
+
+    def get_sku_velocity(self):
+        """Rotacja każdego produktu na dziś: sprzedane sztuki w oknach 30/90/365 dni, tempo
+        (szt./dzień z VELOCITY_DAYS), dni zapasu przy tym tempie (None – brak sprzedaży),
+        data i wiek najstarszej otwartej partii, zamrożony kapitał (otwarte partie x koszt)
+        i znacznik zalegania. Jedno przejście po sprzedaży z ostatniego roku (indeks daty)
+        i po otwartych partiach; wynik jest pamiętany do następnej zmiany danych."""
+        today = datetime.now().strftime("%Y-%m-%d")
+        key   = (self.data_version(), today)
+        hit   = self._cache.get("velocity")
+        if hit and hit[0] == key: return hit[1]
+        items = [dict(r) for r in self.conn.execute(f"""
+            WITH sold AS (
+                SELECT si.product_id,
+                       SUM(CASE WHEN so.date>date(?1,'-30 days') THEN si.qty ELSE 0 END) AS d30,
+                       SUM(CASE WHEN so.date>date(?1,'-90 days') THEN si.qty ELSE 0 END) AS d90,
+                       SUM(si.qty) AS d365,
+                       SUM(CASE WHEN so.date>date(?1,?2) THEN si.qty ELSE 0 END) AS dv,
+                       MAX(so.date) AS last_sale
+                FROM {self._h['sales_orders']} so JOIN {self._h['sales_items']} si ON si.order_id=so.id
+                WHERE so.date>date(?1,'-365 days') AND so.date<=?1
+                GROUP BY si.product_id
+            ), lots AS (
+                SELECT pi.product_id, MIN(COALESCE(pi.origin_date,po.date)) AS oldest,
+                       SUM(pi.available_qty*COALESCE(pi.unit_cost,0)) AS capital
+                FROM purchase_items pi JOIN purchase_orders po ON po.id=pi.order_id
+                WHERE pi.available_qty>0 GROUP BY pi.product_id
+            )
+            SELECT p.id AS product_id, p.sku, p.title, p.stock,
+                   COALESCE(s.d30,0) AS sold_30, COALESCE(s.d90,0) AS sold_90, COALESCE(s.d365,0) AS sold_365,
+                   COALESCE(s.dv,0)*1.0/?3 AS velocity, s.last_sale,
+                   l.oldest AS oldest_lot, CAST(julianday(?1)-julianday(l.oldest) AS INTEGER) AS oldest_lot_days,
+                   ROUND(COALESCE(l.capital,0),2) AS capital
+            FROM products p
+            LEFT JOIN sold s ON s.product_id=p.id
+            LEFT JOIN lots l ON l.product_id=p.id
+            ORDER BY capital DESC, p.sku
+        """, (today, f"-{self.VELOCITY_DAYS} days", self.VELOCITY_DAYS))]
+        dead_from = (datetime.now() - timedelta(days=self.DEAD_STOCK_DAYS)).strftime("%Y-%m-%d")
+        for it in items:
+            it["days_of_inventory"] = round(it["stock"] / it["velocity"], 1) if it["velocity"] > 0 else None
+            it["dead"] = it["stock"] > 0 and (it["last_sale"] or "") <= dead_from
+        self._cache["velocity"] = (key, items)
+        return items
 
     # ── STATS ──
-    def get_stats(self, year=None):
-        if year is None: year = datetime.now().year
-        r = self.conn.execute("""
-            SELECT COUNT(*) AS sc,
-                   COALESCE(SUM(total_pln),0) AS rev,
-                   COALESCE(SUM(total_pln-purchase_cost),0) AS profit,
-                   COALESCE(SUM(purchase_cost),0) AS cost
-            FROM sales_orders WHERE strftime('%Y',date)=?
-        """, (str(year),)).fetchone()
+    # odczyty z sales_period_totals; months=(od, do) – miesiące 'YYYY-MM' włącznie,
+    # domyślnie cały rok `year` (zob. period_months)
+    def get_stats(self, year=None, months=None):
+        m_from, m_to = months or period_months("year", year or datetime.now().year)
+        cp = None if months else self.closed_period(year or datetime.now().year)
+        r  = {"sc": cp["sale_count"], "rev": cp["revenue"], "profit": cp["revenue"] - cp["cost"],
+              "cost": cp["cost"]} if cp else self.conn.execute("""
+            SELECT COALESCE(SUM(sale_count),0) AS sc,
+                   COALESCE(SUM(revenue),0) AS rev,
+                   COALESCE(SUM(revenue-cost),0) AS profit,
+                   COALESCE(SUM(cost),0) AS cost
+            FROM sales_period_totals WHERE month BETWEEN ? AND ?
+        """, (m_from, m_to)).fetchone()
         pc = self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
         ts = self.conn.execute("SELECT COALESCE(SUM(stock),0) FROM products").fetchone()[0]
         return {"sale_count":r["sc"],"revenue":r["rev"],"profit":r["profit"],
                 "cost":r["cost"],"prod_count":pc,"total_stock":ts}
 
     def get_monthly_revenue(self, year=None):
-        if year is None: year = datetime.now().year
+        m_from, m_to = period_months("year", year or datetime.now().year)
         rows = self.conn.execute("""
-            SELECT strftime('%m',date) AS m,
-                   COALESCE(SUM(total_pln),0) AS rev,
-                   COALESCE(SUM(total_pln-purchase_cost),0) AS profit
-            FROM sales_orders WHERE strftime('%Y',date)=?
-            GROUP BY m ORDER BY m
-        """, (str(year),)).fetchall()
-        return {r["m"]:{"rev":r["rev"],"profit":r["profit"]} for r in rows}
-
-    def get_platform_breakdown(self, year=None):
-        if year is None: year = datetime.now().year
+            SELECT substr(month,6,2) AS m,
+                   SUM(revenue) AS rev, SUM(revenue-cost) AS profit, SUM(cost) AS cost
+            FROM sales_period_totals WHERE month BETWEEN ? AND ?
+            GROUP BY month HAVING SUM(sale_count)>0 ORDER BY month
+        """, (m_from, m_to)).fetchall()
+        return {r["m"]:{"rev":r["rev"],"profit":r["profit"],"cost":r["cost"]} for r in rows}
+
+    # klucz okresu: dzień, poniedziałek danego tygodnia, pierwszy dzień miesiąca
+    SERIES_STEPS = {"day":   "date(date)",
+                    "week":  "date(date,'weekday 0','-6 days')",
+                    "month": "strftime('%Y-%m-01',date)"}
+
+    def get_sales_series(self, date_from, date_to, step="day"):
+        """{początek okresu: (przychód, zysk netto, koszt)} – tylko okresy ze sprzedażą"""
+        if step == "month" and date_from.endswith("-01"):
+            return {f"{r[0]}-01": (r[1], r[2], r[3]) for r in self.conn.execute("""
+                SELECT month, SUM(revenue), SUM(revenue-cost), SUM(cost) FROM sales_period_totals
+                WHERE month BETWEEN ? AND ? GROUP BY month HAVING SUM(sale_count)>0 ORDER BY month
+            """, (date_from[:7], date_to[:7]))}
+        return {r[0]: (r[1], r[2], r[3]) for r in self.conn.execute(f"""
+            SELECT {self.SERIES_STEPS[step]} AS k, SUM(total_pln),
+                   SUM(total_pln-purchase_cost), SUM(purchase_cost)
+            FROM {self._h['sales_orders']} WHERE date BETWEEN ? AND ?
+            GROUP BY k ORDER BY k
+        """, (date_from, date_to))}
+
+    def get_period_revenue(self, months):
+        """Przychód w miesiącach (od, do) 'YYYY-MM' – zob. RevenueLimit"""
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(revenue),0) FROM sales_period_totals WHERE month BETWEEN ? AND ?",
+            months).fetchone()[0]
+
+    def get_platform_breakdown(self, year=None, months=None):
+        m_from, m_to = months or period_months("year", year or datetime.now().year)
         return self.conn.execute("""
-            SELECT platform,
-                   COUNT(*) AS cnt,
-                   COALESCE(SUM(total_pln),0) AS rev,
-                   COALESCE(SUM(total_pln-purchase_cost),0) AS profit
-            FROM sales_orders WHERE strftime('%Y',date)=?
-            GROUP BY platform ORDER BY rev DESC
-        """, (str(year),)).fetchall()
+            SELECT NULLIF(platform,'') AS platform,
+                   SUM(sale_count) AS cnt,
+                   SUM(revenue) AS rev,
+                   SUM(revenue-cost) AS profit
+            FROM sales_period_totals WHERE month BETWEEN ? AND ?
+            GROUP BY platform HAVING SUM(sale_count)>0 ORDER BY rev DESC
+        """, (m_from, m_to)).fetchall()
 
     def get_platform_sales_count(self, platform, year=None):
-        """Liczba sprzedaży na danej platformie w bieżącym roku"""
-        if year is None: year = datetime.now().year
-        r = self.conn.execute("""
-            SELECT COUNT(*) AS cnt FROM sales_orders
-            WHERE platform=? AND strftime('%Y',date)=?
-        """, (platform,str(year))).fetchone()
-        return r["cnt"] if r else 0
+        """Liczba sprzedaży na danej platformie w roku (domyślnie bieżącym) – odczyt po kluczu"""
+        r = self.conn.execute("SELECT sale_count FROM platform_year_counters WHERE year=? AND platform=?",
+                              (year or datetime.now().year, platform)).fetchone()
+        return r[0] if r else 0
+
+    def verify_platform_counters(self, fix=False):
+        """Porównuje platform_year_counters z sales_orders; fix=True przelicza liczniki od zera"""
+        bad = [dict(r) for r in self.conn.execute(f"""
+            SELECT year, platform, SUM(n) AS count, SUM(n_ok) AS actual FROM (
+                SELECT year, platform, sale_count AS n, 0 AS n_ok FROM platform_year_counters
+                UNION ALL
+                SELECT year, platform, 0, sale_count FROM ({self.PLATFORM_COUNTERS_SQL.format(**self._h)})
+            ) GROUP BY year, platform HAVING SUM(n)<>SUM(n_ok)
+        """)]
+        if fix and bad: self.rebuild_platform_counters()
+        return bad
+
+    def rebuild_platform_counters(self):
+        with self.transaction() as c: self._rebuild_platform_counters(c)
+
+    # ── DIAGNOSTYKA ──
+    def check_invariants(self, pids=None):
+        """Sprawdza spójność stanów i partii FIFO; zwraca listę opisów niezgodności.
+        Stan = suma dostępnych partii zakłada brak ręcznych korekt (InventoryDialog)"""
+        where = f"WHERE p.id IN ({','.join('?' * len(pids))})" if pids else ""
+        args  = tuple(pids or ())
+        h     = self._h   # partie i sprzedaż razem z archiwum
+        out   = []
+        for r in self.conn.execute(f"""
+            SELECT p.id, p.sku, p.stock,
+                   COALESCE(l.bought,0) AS bought, COALESCE(l.avail,0) AS avail,
+                   COALESCE(l.bad,0) AS bad, COALESCE(s.sold,0) AS sold, COALESCE(m.s,0) AS ledger
+            FROM products p
+            LEFT JOIN (SELECT product_id, SUM(CASE WHEN origin_item_id IS NULL THEN qty ELSE 0 END) AS bought,
+                              SUM(available_qty) AS avail,
+                              SUM(available_qty<0 OR available_qty>MAX(qty,0)) AS bad
+                       FROM {h['purchase_items']} GROUP BY product_id) l ON l.product_id=p.id
+            LEFT JOIN (SELECT product_id, SUM(qty) AS sold FROM {h['sales_items']} GROUP BY product_id) s
+                   ON s.product_id=p.id
+            LEFT JOIN (SELECT product_id, SUM(qty) AS s FROM stock_movements GROUP BY product_id) m
+                   ON m.product_id=p.id
+            {where}
+        """, args):
+            if r["stock"] < 0:              out.append(f"{r['sku']}: ujemny stan {r['stock']}")
+            if r["bad"]:                    out.append(f"{r['sku']}: {r['bad']} partii z dostępną ilością poza 0..qty")
+            if r["stock"] != r["ledger"]:   out.append(f"{r['sku']}: stan {r['stock']} ≠ rejestr ruchów {r['ledger']}")
+            if r["stock"] != r["avail"]:    out.append(f"{r['sku']}: stan {r['stock']} ≠ suma partii {r['avail']}")
+            if r["bought"] - r["avail"] != r["sold"]:
+                out.append(f"{r['sku']}: zdjęto z partii {r['bought']-r['avail']}, sprzedano {r['sold']}")
+        # FIFO: częściowo zdjęta partia nie może poprzedzać partii starszej z towarem
+        for r in self.conn.execute(f"""
+            SELECT p.sku, COUNT(*) AS n FROM (
+                SELECT pi.product_id, pi.qty, pi.available_qty,
+                       SUM(pi.available_qty>0) OVER (PARTITION BY pi.product_id ORDER BY po.date, pi.id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS open_before
+                FROM {h['purchase_items']} pi JOIN {h['purchase_orders']} po ON po.id=pi.order_id
+            ) x JOIN products p ON p.id=x.product_id
+            WHERE x.open_before>0 AND x.available_qty<x.qty {where.replace('WHERE','AND')}
+            GROUP BY p.sku
+        """, args):
+            out.append(f"{r['sku']}: {r['n']} partii zdjętych poza kolejnością FIFO")
+        if not pids:
+            for r in self.conn.execute(f"""
+                SELECT month, platform, SUM(n) AS n, SUM(n_ok) AS n_ok, SUM(rev) AS rev,
+                       SUM(rev_ok) AS rev_ok, SUM(cost) AS cost, SUM(cost_ok) AS cost_ok FROM (
+                    SELECT month, platform, sale_count AS n, 0 AS n_ok, revenue AS rev, 0 AS rev_ok,
+                           cost, 0 AS cost_ok FROM sales_period_totals
+                    UNION ALL
+                    SELECT month, platform, 0, sale_count, 0, revenue, 0, cost FROM ({self.PERIOD_TOTALS_SQL.format(**h)})
+                ) GROUP BY month, platform
+            """):
+                if r["n"] != r["n_ok"] or abs(r["rev"] - r["rev_ok"]) > 0.005 or abs(r["cost"] - r["cost_ok"]) > 0.005:
+                    out.append(f"sumy {r['month']} {r['platform']}: {r['n']} sprzedaży / {r['rev']:.2f} PLN, "
+                               f"w sales_orders {r['n_ok']} / {r['rev_ok']:.2f} PLN")
+            for b in self.verify_platform_counters():
+                out.append(f"licznik {b['year']} {b['platform']}: {b['count']}, w sales_orders {b['actual']}")
+            for r in self.conn.execute("""
+                SELECT cp.year, cp.sale_count, cp.revenue, COALESCE(SUM(t.sale_count),0) AS n_ok,
+                       COALESCE(SUM(t.revenue),0) AS rev_ok
+                FROM closed_periods cp
+                LEFT JOIN sales_period_totals t ON t.month BETWEEN cp.year||'-01' AND cp.year||'-12'
+                GROUP BY cp.year
+            """):
+                if r["sale_count"] != r["n_ok"] or abs(r["revenue"] - r["rev_ok"]) > 0.005:
+                    out.append(f"zamknięty rok {r['year']}: {r['sale_count']} sprzedaży / {r['revenue']:.2f} PLN, "
+                               f"w sumach okresów {r['n_ok']} / {r['rev_ok']:.2f} PLN")
+            for r in self.conn.execute(f"""
+                SELECT so.id, so.total_pln, so.purchase_cost, SUM(si.revenue_pln) AS rev, SUM(si.purchase_cost) AS cost
+                FROM {h['sales_orders']} so JOIN {h['sales_items']} si ON si.order_id=so.id GROUP BY so.id
+                HAVING rev IS NULL OR cost IS NULL
+                    OR ABS(rev-so.total_pln)>0.005 OR ABS(cost-so.purchase_cost)>0.005
+            """):
+                out.append(f"sprzedaż {r['id']}: pozycje {r['rev'] or 0:.2f} PLN / koszt {r['cost'] or 0:.2f}, "
+                           f"zamówienie {r['total_pln']:.2f} / {r['purchase_cost']:.2f}")
+        return out
+
+    def rebuild_period_totals(self):
+        """Przelicza sales_period_totals od zera (naprawa po niezgodności z check_invariants)"""
+        with self.transaction() as c: self._rebuild_period_totals(c)
+
+    def enable_profiling(self, slow_ms=50.0, log_path=None):
+        """Włącza pomiar: trace SQLite + opakowanie każdej publicznej metody DB"""
+        if self.profiler: return self.profiler
+        prof = DBProfiler(self.conn, slow_ms, log_path)
+        self.conn.set_trace_callback(prof.on_trace)
+        self.conn = _ProfiledConnection(prof, self.conn)
+        for name, _ in inspect.getmembers(type(self), inspect.isfunction):
+            if not name.startswith("_") and name not in ("enable_profiling", "disable_profiling"):
+                setattr(self, name, self._profiled(prof, name, getattr(self, name)))
+        self.profiler = prof
+        return prof
+
+    def disable_profiling(self):
+        if not self.profiler: return
+        for name in [n for n in vars(self) if callable(vars(self)[n]) and not n.startswith("_")]:
+            delattr(self, name)
+        self.conn = self.profiler.raw
+        self.conn.set_trace_callback(None)
+        self.profiler = None
+
+    @staticmethod
+    def _profiled(prof, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            t = time.perf_counter(); res = None
+            try:
+                res = fn(*a, **kw); return res
+            finally:
+                rows = len(res) if isinstance(res, (list, tuple)) else int(isinstance(res, (sqlite3.Row, dict)))
+                prof.record_method(name, (time.perf_counter() - t) * 1000, rows)
+        return wrapper
 
     def backup(self, dest_path):
-        self.conn.execute("PRAGMA wal_checkpoint(FULL)")
-        shutil.copy2(self.path, dest_path)
+        """Kopia przez API kopii SQLite – spójna także w trybie WAL (zawartość pliku -wal)"""
+        dst = sqlite3.connect(dest_path)
+        try: self.conn.backup(dst)
+        finally: dst.close()
         return dest_path
 
+    def restore(self, src_path):
+        """Nadpisuje bazę kopią przez API kopii SQLite – kopiowanie pliku przy otwartej bazie
+        w trybie WAL zostawiłoby stary plik -wal nałożony na przywróconą bazę"""
+        self.close_readers()
+        src = sqlite3.connect(src_path)
+        # backup() wymaga sqlite3.Connection – przy profilowaniu self.conn jest opakowaniem
+        try: src.backup(self.profiler.raw if self.profiler else self.conn)
+        finally: src.close()
+        self._writes += 1
+        self._sync_archives()
+
+    # ── ARCHIWUM LAT ──
+    def archive_dir(self):
+        """Katalog plików archive_YYYY.db – obok bazy, osobny dla każdego pliku bazy"""
+        return os.path.splitext(os.path.abspath(self.path))[0] + "_archiwum"
+
+    def list_archives(self):
+        return [dict(r) for r in self.conn.execute("SELECT * FROM main.archives ORDER BY year")]
+
+    def _attached(self):
+        return {r[1] for r in self.conn.execute("PRAGMA database_list")}
+
+    def _sync_archives(self):
+        """Dołącza (ATTACH) pliki lat z tabeli archives, których połączenie jeszcze nie ma, i odtwarza
+        widoki temp.all_* (tabela główna UNION ALL archiwa). Bez archiwów _h wskazuje same tabele"""
+        try: rows = self.conn.execute("SELECT year, file FROM main.archives ORDER BY year").fetchall()
+        except sqlite3.OperationalError: return   # baza sprzed archiwum (połączenie tylko do odczytu)
+        have = self._attached()
+        for year, f in rows:
+            path = os.path.join(self.archive_dir(), f)
+            if f"a{year}" in have or not os.path.exists(path): continue
+            if self.readonly: path = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+            try: self.conn.execute(f"ATTACH DATABASE ? AS a{year}", (path,))
+            except sqlite3.OperationalError as e:
+                if "too many" in str(e): raise ValueError(f"Za dużo lat w archiwum ({len(rows)}) dla SQLite.") from e
+                raise
+        have  = self._attached()
+        years = tuple(y for y, _ in rows if f"a{y}" in have)
+        if years == self._archives: return
+        self._archives, self._h = years, {t: t for t in self.ARCHIVE_TABLES}
+        if not years: return
+        for t in self.ARCHIVE_TABLES:
+            cols  = [r[1] for r in self.conn.execute(f"PRAGMA main.table_info({t})")]
+            parts = [f"SELECT {','.join(cols)} FROM main.{t}"]
+            for y in years:
+                # archiwum sprzed późniejszej migracji nie ma nowych kolumn
+                acols = {r[1] for r in self.conn.execute(f"PRAGMA a{y}.table_info({t})")}
+                parts.append(f"SELECT {','.join(c if c in acols else f'NULL AS {c}' for c in cols)} FROM a{y}.{t}")
+            self.conn.execute(f"DROP VIEW IF EXISTS temp.all_{t}")
+            self.conn.execute(f"CREATE TEMP VIEW all_{t} AS " + " UNION ALL ".join(parts))
+            self._h[t] = f"temp.all_{t}"
+
+    def _check_archived(self, table, row_id):
+        # usuwanie wpisu, którego nie ma w bazie głównej, ale jest w archiwum
+        if self._archives and self.conn.execute(f"SELECT 1 FROM {self._h[table]} WHERE id=?", (row_id,)).fetchone():
+            raise ValueError("Wpis z zarchiwizowanego roku – archiwum jest tylko do odczytu.")
+
+    def archive_year(self, year, vacuum=True):
+        """Przenosi zamknięty rok (close_year) do <baza>_archiwum/archive_YYYY.db: sprzedaże z datą w tym roku
+        (z pozycjami i rachunkami) oraz zakupy roku, których partie są już całkiem zdjęte.
+        Zakupy z towarem na stanie, rejestr ruchów i sumy okresów zostają w bazie głównej.
+
+        Najpierw kopia do archiwum (osobny COMMIT), potem usunięcie z bazy głównej – przerwanie
+        w połowie zostawia wiersze w obu plikach, a ponowne wywołanie kończy przeniesienie.
+        Sumy sales_period_totals i liczniki platform roku się nie zmieniają. vacuum=True
+        zmniejsza plik bazy po przeniesieniu. Zwraca liczby przeniesionych sprzedaży, zakupów, rachunków"""
+        year, end = int(year), self.closed_until()
+        # archiwum jest tylko do odczytu – rok musi być zamknięty, żeby nie przybyło w nim zapisów
+        if not end or year > int(end[:4]):
+            raise ValueError(f"Można archiwizować tylko zamknięty rok – zamknij najpierw rok {year}.")
+        d_from, d_to, a, f = f"{year}-01-01", f"{year}-12-31", f"a{year}", f"archive_{year}.db"
+        os.makedirs(self.archive_dir(), exist_ok=True)
+        if a not in self._attached():
+            self.conn.execute(f"ATTACH DATABASE ? AS {a}", (os.path.join(self.archive_dir(), f),))
+        sel = {"sales_orders":    "id IN (SELECT id FROM temp.arch_ids WHERE tbl='sales_orders')",
+               "sales_items":     "order_id IN (SELECT id FROM temp.arch_ids WHERE tbl='sales_orders')",
+               "invoices":        "sale_order_id IN (SELECT id FROM temp.arch_ids WHERE tbl='sales_orders')",
+               "purchase_orders": "id IN (SELECT id FROM temp.arch_ids WHERE tbl='purchase_orders')",
+               "purchase_items":  "order_id IN (SELECT id FROM temp.arch_ids WHERE tbl='purchase_orders')"}
+        with self.transaction() as c:
+            # schemat archiwum = tabele i indeksy bazy głównej (plus kolumny dodane migracją)
+            for name, sql in c.execute(f"""
+                SELECT name, sql FROM main.sqlite_master
+                WHERE tbl_name IN ({','.join('?' * len(self.ARCHIVE_TABLES))})
+                  AND type IN ('table','index') AND sql IS NOT NULL
+                ORDER BY type='index'""", self.ARCHIVE_TABLES).fetchall():
+                c.execute(re.sub(rf'^CREATE (UNIQUE )?(TABLE|INDEX) (IF NOT EXISTS )?"?{name}"?',
+                                 rf"CREATE \1\2 IF NOT EXISTS {a}.{name}", sql))
+            for t in self.ARCHIVE_TABLES:
+                acols = {r[1] for r in c.execute(f"PRAGMA {a}.table_info({t})")}
+                for r in c.execute(f"PRAGMA main.table_info({t})").fetchall():
+                    if r[1] not in acols: c.execute(f"ALTER TABLE {a}.{t} ADD COLUMN {r[1]} {r[2]}")
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS arch_ids(tbl TEXT, id INTEGER, PRIMARY KEY (tbl, id))")
+            c.execute("DELETE FROM temp.arch_ids")
+            c.execute("INSERT INTO temp.arch_ids SELECT 'sales_orders', id FROM main.sales_orders "
+                      "WHERE date BETWEEN ? AND ?", (d_from, d_to))
+            c.execute("""
+                INSERT INTO temp.arch_ids SELECT 'purchase_orders', po.id FROM main.purchase_orders po
+                WHERE po.date BETWEEN ? AND ? AND NOT EXISTS (
+                    SELECT 1 FROM main.purchase_items pi WHERE pi.order_id=po.id AND pi.available_qty<>0)
+            """, (d_from, d_to))
+            n = {}
+            for t, w in sel.items():
+                cols = ",".join(r[1] for r in c.execute(f"PRAGMA main.table_info({t})"))
+                c.execute(f"INSERT OR IGNORE INTO {a}.{t}({cols}) SELECT {cols} FROM main.{t} WHERE {w}")
+                n[t] = c.execute(f"SELECT COUNT(*) FROM main.{t} WHERE {w}").fetchone()[0]
+        with self.transaction() as c:
+            for t, w in sel.items():
+                if c.execute(f"SELECT COUNT(*) FROM {a}.{t} WHERE {w}").fetchone()[0] < n[t]:
+                    raise RuntimeError(f"{f}: niepełna kopia {t} – baza główna bez zmian")
+            # triggery usuwania zmniejszyłyby sumy okresów i liczniki roku – odtwarzane po usunięciu
+            totals   = c.execute("SELECT month,platform,sale_count,revenue,cost FROM sales_period_totals "
+                                 "WHERE month BETWEEN ? AND ?", (d_from[:7], d_to[:7])).fetchall()
+            counters = c.execute("SELECT year,platform,sale_count FROM platform_year_counters WHERE year=?",
+                                 (year,)).fetchall()
+            for t in ("invoices", "sales_items", "sales_orders", "purchase_items", "purchase_orders"):
+                c.execute(f"DELETE FROM main.{t} WHERE {sel[t]}")
+            c.execute("DELETE FROM purchase_stock_history WHERE sale_order_id IN "
+                      "(SELECT id FROM temp.arch_ids WHERE tbl='sales_orders')")
+            c.execute("DELETE FROM sales_period_totals WHERE month BETWEEN ? AND ?", (d_from[:7], d_to[:7]))
+            c.executemany("INSERT INTO sales_period_totals(month,platform,sale_count,revenue,cost) VALUES(?,?,?,?,?)",
+                          map(tuple, totals))
+            c.execute("DELETE FROM platform_year_counters WHERE year=?", (year,))
+            c.executemany("INSERT INTO platform_year_counters(year,platform,sale_count) VALUES(?,?,?)",
+                          map(tuple, counters))
+            c.execute("""
+                INSERT INTO archives(year,file,sales,purchases,invoices) VALUES(?,?,?,?,?)
+                ON CONFLICT(year) DO UPDATE SET sales=sales+excluded.sales, purchases=purchases+excluded.purchases,
+                    invoices=invoices+excluded.invoices, archived_at=CURRENT_TIMESTAMP
+            """, (year, f, n["sales_orders"], n["purchase_orders"], n["invoices"]))
+        self._archives = ()   # widoki odtwarzane z nowym rokiem
+        self.close_readers(); self._sync_archives()
+        if vacuum: self.conn.execute("VACUUM main")
+        return {"sales": n["sales_orders"], "purchases": n["purchase_orders"], "invoices": n["invoices"]}
+
+    # ── ZAMKNIĘCIE ROKU ──
+    def closed_until(self):
+        """Ostatni dzień zamkniętego okresu ('' – żaden rok nie jest zamknięty)"""
+        y = self.conn.execute("SELECT MAX(year) FROM closed_periods").fetchone()[0]
+        return f"{y}-12-31" if y is not None else ""
+
+    def _check_open(self, c, *dates):
+        # zapis z datą w zamkniętym roku zmieniłby sumy closed_periods i bilans otwarcia
+        end = self.closed_until()
+        bad = [d for d in dates if d and d <= end]
+        if bad: raise ValueError(f"Okres do {end} jest zamknięty – nie można zapisać zmian z datą {min(bad)}.")
+
+    def list_closed_periods(self):
+        return [dict(r) for r in self.conn.execute("SELECT * FROM closed_periods ORDER BY year")]
+
+    def closed_period(self, year):
+        """Sumy zamkniętego roku (dict) albo None – odczyt po kluczu zamiast sumowania sprzedaży"""
+        r = self.conn.execute("SELECT * FROM closed_periods WHERE year=?", (year,)).fetchone()
+        return dict(r) if r else None
+
+    def close_year(self, year):
+        """Zamknięcie roku: pozostałości partii FIFO na 31.12 (ilość, koszt jednostkowy, pierwotna
+        pozycja zakupu) stają się partiami bilansu otwarcia – jednym zamówieniem z datą 31.12,
+        więc w kolejności FIFO są przed zakupami nowego roku. Pierwotne partie dostają
+        available_qty=0, więc FIFO, wycena i archive_year czytają tylko wiersze bieżącego roku.
+        Sumy roku trafiają do closed_periods; późniejsze zapisy z datą ≤ 31.12 są odrzucane.
+
+        Rok musi być zakończony i późniejszy od ostatnio zamkniętego; sprzedaż nowego roku zapisana
+        przed zamknięciem zostaje w dostępnej ilości partii otwarcia. Zwraca wiersz closed_periods"""
+        year = int(year)
+        if year >= datetime.now().year: raise ValueError("Można zamknąć tylko zakończony rok.")
+        end = f"{year}-12-31"
+        with self.transaction() as c:
+            last = c.execute("SELECT MAX(year) FROM closed_periods").fetchone()[0]
+            if last is not None and year <= last: raise ValueError(f"Lata do {last} są już zamknięte.")
+            since = f"{last}-12-31" if last is not None else ""
+            lots  = c.execute(self.FIFO_LEFT_SQL.format(after="AND so.date>?2", **self._h) + " ORDER BY l.date, l.id",
+                              (end, since)).fetchall()
+            # dostępna ilość ponad pozostałość z 31.12 = partie zdjęte poza kolejnością dat
+            bad = sorted({l["product_id"] for l in lots if l["available_qty"] > l["left"]})
+            if bad:
+                skus = [r[0] for r in c.execute(f"SELECT sku FROM products WHERE id IN ({','.join('?' * len(bad[:10]))})",
+                                                bad[:10])]
+                raise ValueError(f"Partie niezgodne z FIFO na {end} ({', '.join(skus)}) – "
+                                 "sprawdź spójność danych przed zamknięciem roku.")
+            sc, rev, cost = c.execute("""
+                SELECT COALESCE(SUM(sale_count),0), COALESCE(SUM(revenue),0), COALESCE(SUM(cost),0)
+                FROM sales_period_totals WHERE month BETWEEN ? AND ?
+            """, (f"{year}-01", f"{year}-12")).fetchone()
+            pc, ppln = c.execute(f"SELECT COUNT(*), COALESCE(SUM(total_pln),0) FROM {self._h['purchase_orders']} "
+                                 "WHERE date BETWEEN ? AND ?", (f"{year}-01-01", end)).fetchone()
+            # sprzedaż z datą przed zakupem (więcej sprzedanych niż kupionych do 31.12) – przenoszona
+            # jako partia z ujemną ilością (origin_item_id=0), która pomniejsza partie następnego roku
+            short = c.execute(f"""
+                SELECT product_id, SUM(q) AS q FROM (
+                    SELECT pi.product_id, -pi.qty AS q
+                    FROM {self._h['purchase_items']} pi JOIN {self._h['purchase_orders']} po ON po.id=pi.order_id
+                    WHERE po.date BETWEEN ?2 AND ?1 AND (pi.origin_item_id IS NOT NULL)=(po.date=?2)
+                    UNION ALL
+                    SELECT si.product_id, si.qty
+                    FROM {self._h['sales_items']} si JOIN {self._h['sales_orders']} so ON so.id=si.order_id
+                    WHERE so.date>?2 AND so.date<=?1
+                ) GROUP BY product_id HAVING SUM(q)>0
+            """, (end, since)).fetchall()
+            left  = [l for l in lots if l["left"] > 0]
+            value = round(sum(l["left"] * l["unit_cost"] for l in left), 2)
+            c.execute("INSERT INTO purchase_orders(total_pln,date) VALUES(?,?)", (value, end))
+            oid = c.lastrowid
+            ins = """INSERT INTO purchase_items(order_id,product_id,qty,unit_cost,available_qty,origin_item_id,origin_date)
+                     VALUES(?,?,?,?,?,?,?)"""
+            c.executemany(ins, [(oid, r["product_id"], -r["q"], 0, 0, 0, end) for r in short])
+            for l in left:
+                c.execute(ins, (oid, l["product_id"], l["left"], l["unit_cost"], l["available_qty"], l["origin_item_id"],
+                                l["origin_date"]))
+                # pobrania sprzedaży nowego roku wskazują partię bilansu otwarcia – tam wraca delete_sale
+                c.execute("UPDATE purchase_stock_history SET purchase_item_id=? WHERE purchase_item_id=? AND date>?",
+                          (c.lastrowid, l["id"], end))
+            c.executemany("UPDATE purchase_items SET available_qty=0 WHERE id=?",
+                          [(l["id"],) for l in lots if l["available_qty"]])
+            c.execute("""
+                INSERT INTO closed_periods(year,sale_count,revenue,cost,purchase_count,purchases_pln,
+                                           stock_qty,stock_value,lots)
+                VALUES(?,?,?,?,?,?,?,?,?)
+            """, (year, sc, rev, cost, pc, ppln, sum(l["left"] for l in left), value, len(left)))
+            return dict(c.execute("SELECT * FROM closed_periods WHERE year=?", (year,)).fetchone())
+
     def export_csv(self, path, date_from, date_to):
-        sales = self.get_detailed_sales(date_from, date_to)
-        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        # pozycje zapisywane w trakcie czytania kursora – bez listy całego okresu w pamięci
+        with self.snapshot() as r, open(path, "w", newline="", encoding="utf-8-sig") as f:
             w = csv.writer(f, delimiter=";")
             w.writerow(["Data","Platforma","SKU","Nazwa","Ilość",
                         "Przychód PLN","Koszt PLN","Zysk PLN"])
-            for s in sales:
-                profit = s["order_total_pln"] - s["order_total_cost"]
-                w.writerow([s["date"],s["platform"],s["sku"],s["title"],
-                            s["qty"],f"{s['order_total_pln']:.2f}",
-                            f"{s['order_total_cost']:.2f}",f"{profit:.2f}"])
+            for s in r.iter_sale_lines(date_from, date_to):
+                w.writerow([s.date,s.platform,s.sku,s.title,
+                            s.qty,f"{s.item_revenue_pln:.2f}",
+                            f"{s.item_cost:.2f}",f"{s.item_profit:.2f}"])
         return True
 
 
+# ─────────────────────────────────────────────────────────
+#  IMPORT CSV / XLSX
+# ─────────────────────────────────────────────────────────
+IMPORT_COLUMNS = {
+    "typ": "kind", "rodzaj": "kind", "type": "kind",
+    "data": "date", "date": "date",
+    "sku": "sku",
+    "nazwa": "title", "title": "title", "name": "title",
+    "ilosc": "qty", "ilość": "qty", "qty": "qty",
+    "kwota": "amount", "kwota_pln": "amount", "pln": "amount", "amount": "amount",
+    "kwota_eur": "eur", "eur": "eur",
+    "platforma": "platform", "platform": "platform",
+    "zamowienie": "order", "zamówienie": "order", "order": "order",
+}
+IMPORT_KINDS = {
+    "produkt": "product", "product": "product",
+    "zakup": "purchase", "purchase": "purchase",
+    "sprzedaz": "sale", "sprzedaż": "sale", "sale": "sale",
+}
+
+
+def _import_num(v, default=...):
+    if v is None or str(v).strip() == "":
+        if default is ...: raise ValueError("brak wartości liczbowej")
+        return default
+    if isinstance(v, (int, float)): return float(v)
+    try: return float(str(v).replace("\xa0", "").replace(" ", "").replace(",", "."))
+    except ValueError: raise ValueError(f"nieprawidłowa liczba: {v!r}")
+
+
+def _import_date(v):
+    if isinstance(v, datetime): return v.strftime("%Y-%m-%d")
+    return _import_date_str(str(v or "").strip()[:10])
+
+
+@functools.lru_cache(maxsize=4096)
+def _import_date_str(s):
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y", "%Y/%m/%d"):
+        try: return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
+        except ValueError: pass
+    raise ValueError(f"nieprawidłowa data: {s!r}")
+
+
+def read_import_rows(path):
+    """Wiersze pliku CSV/XLSX jako lista (nr_wiersza, słownik) z ujednoliconymi kluczami"""
+    if os.path.splitext(path)[1].lower() == ".xlsx":
+        if not HAS_EXCEL:
+            raise ImportError("Zainstaluj openpyxl:  pip install openpyxl")
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try: raw = list(wb.active.iter_rows(values_only=True))
+        finally: wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            sample = f.read(4096); f.seek(0)
+            raw = list(csv.reader(f, delimiter=";" if sample.count(";") >= sample.count(",") else ","))
+    if not raw: return []
+    keys = [IMPORT_COLUMNS.get(str(h or "").strip().lower()) for h in raw[0]]
+    if "kind" not in keys or "sku" not in keys:
+        raise ValueError("Plik musi mieć kolumny 'typ' i 'sku'.")
+    return [(n, {k: v for k, v in zip(keys, row) if k})
+            for n, row in enumerate(raw[1:], 2)
+            if any(v not in (None, "") for v in row)]
+
+
+def format_import_report(rep):
+    head = "SPRAWDZENIE (dry-run) – nic nie zapisano" if rep["dry_run"] else (
+           "IMPORT PRZERWANY – nic nie zapisano" if rep["errors"] else "IMPORT ZAKOŃCZONY")
+    out = [head,
+           f"Produkty:  {rep['products']} nowych, {rep['products_skipped']} już istniało",
+           f"Zakupy:    {rep['purchases']} zamówień, {rep['purchase_lines']} pozycji",
+           f"Sprzedaż:  {rep['sales']} zamówień, {rep['sale_lines']} pozycji"]
+    if rep["errors"]:
+        out.append(f"\nBłędy ({len(rep['errors'])}):")
+        out += [f"  wiersz {n}: {msg}" for n, msg in rep["errors"]]
+    return "\n".join(out)
+
+
+# ── eksporty zamówień z platform (Vinted, OLX, Allegro Lokalnie, FB Marketplace) ──
+# nazwy kolumn/pól spotykane w eksportach; wielkość liter i spacje/podkreślenia bez znaczenia
+MARKETPLACE_COLUMNS = {
+    "order":  ("order_id", "order", "orderid", "id_zamowienia", "id_zamówienia", "numer_zamowienia",
+               "numer_zamówienia", "nr_zamowienia", "nr_zamówienia", "zamowienie", "zamówienie",
+               "transaction_id", "id_transakcji"),
+    "date":   ("date", "data", "created_at", "order_date", "data_zamowienia", "data_zamówienia",
+               "data_sprzedazy", "data_sprzedaży", "sold_at"),
+    "sku":    ("sku", "listing_sku", "offer_id", "listing_id", "item_id", "id_oferty", "sygnatura",
+               "kod", "external_id"),
+    "qty":    ("qty", "quantity", "ilosc", "ilość", "liczba_sztuk", "sztuk"),
+    "amount": ("amount", "total", "price", "kwota", "kwota_pln", "cena", "wartosc", "wartość", "pln"),
+    "eur":    ("eur", "kwota_eur", "amount_eur", "price_eur"),
+}
+_MARKETPLACE_KEYS = {a: k for k, names in MARKETPLACE_COLUMNS.items() for a in names}
+MARKETPLACE_ITEM_LISTS = ("items", "pozycje", "products", "produkty", "lines", "line_items")
+
+
+def _marketplace_key(k):
+    return _MARKETPLACE_KEYS.get(str(k or "").strip().lower().replace(" ", "_").replace("-", "_"))
+
+
+def _marketplace_rows_json(obj):
+    """Zamówienie JSON -> wiersze; zagnieżdżona lista pozycji dziedziczy pola zamówienia"""
+    head  = {_marketplace_key(k): v for k, v in obj.items() if not isinstance(v, (list, dict))}
+    items = next((obj[k] for k in obj if str(k).lower() in MARKETPLACE_ITEM_LISTS and isinstance(obj[k], list)), None)
+    head.pop(None, None)
+    if not items: yield head; return
+    for it in items:
+        row = dict(head)
+        row.update((_marketplace_key(k), v) for k, v in it.items() if not isinstance(v, (list, dict)))
+        row.pop(None, None)
+        yield row
+
+
+def _iter_json_values(f, chunk=1 << 16):
+    """Strumieniowe dekodowanie: elementy tablicy najwyższego poziomu albo kolejne wartości
+    (JSON Lines). Plik nie jest wczytywany w całości – w pamięci tylko bieżący fragment"""
+    dec, buf, pos, eof, in_array = json.JSONDecoder(), "", 0, False, None
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,": pos += 1
+        if in_array is None and pos < len(buf):
+            in_array = buf[pos] == "["
+            if in_array: pos += 1; continue
+        if pos < len(buf) and in_array and buf[pos] == "]": return
+        try:
+            if pos >= len(buf): raise ValueError
+            val, end = dec.raw_decode(buf, pos)
+            if end == len(buf) and not eof: raise ValueError   # liczba/wartość mogła zostać ucięta
+        except ValueError:
+            if eof:
+                if pos < len(buf): raise ValueError(f"niepoprawny JSON przy znaku {pos}")
+                return
+            more = f.read(chunk); eof = not more
+            buf = buf[pos:] + more; pos = 0; continue
+        yield val; pos = end
+
+
+def read_marketplace_rows(path):
+    """Strumień (nr, słownik) z eksportu zamówień platformy: CSV (; lub ,), JSON lub JSON Lines.
+    nr – wiersz pliku CSV lub numer zamówienia w pliku JSON"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if os.path.splitext(path)[1].lower() in (".json", ".jsonl", ".ndjson"):
+            for n, obj in enumerate(_iter_json_values(f), 1):
+                lst = next((v for v in obj.values() if isinstance(v, list)), None) if isinstance(obj, dict) else None
+                if lst and isinstance(lst[0], dict) and not any(_marketplace_key(k) == "order" for k in obj) \
+                        and any(_marketplace_key(k) == "order" for k in lst[0]):
+                    # {"orders": [...]} – opakowanie listy zamówień
+                    for m, o in enumerate(lst, 1):
+                        for row in _marketplace_rows_json(o): yield m, row
+                    continue
+                if not isinstance(obj, dict): raise ValueError(f"zamówienie {n}: oczekiwano obiektu JSON")
+                for row in _marketplace_rows_json(obj): yield n, row
+            return
+        sample = f.read(4096); f.seek(0)
+        rd   = csv.reader(f, delimiter=";" if sample.count(";") >= sample.count(",") else ",")
+        keys = [_marketplace_key(h) for h in next(rd, [])]
+        if "order" not in keys or "sku" not in keys:
+            raise ValueError("Eksport musi mieć kolumny z numerem zamówienia i SKU/ID oferty.")
+        for n, row in enumerate(rd, 2):
+            if any(v.strip() for v in row):
+                yield n, {k: v for k, v in zip(keys, row) if k}
+
+
+def format_marketplace_report(platform, rep):
+    head = "SPRAWDZENIE (dry-run) – nic nie zapisano" if rep["dry_run"] else (
+           "IMPORT PRZERWANY – nic nie zapisano" if rep["errors"] else "IMPORT ZAKOŃCZONY")
+    out = [f"{head}  ({platform})",
+           f"Zamówienia: {rep['orders']} nowych, {rep['lines']} pozycji",
+           f"Pominięte:  {rep['duplicates']} już zaimportowanych"]
+    if rep["unknown_skus"]:
+        out.append(f"\nNieznane SKU ({len(rep['unknown_skus'])}) – przypisz je do produktów: "
+                   + ", ".join(rep["unknown_skus"]))
+    if rep["errors"]:
+        out.append(f"\nBłędy ({len(rep['errors'])}):")
+        out += [f"  wiersz {n}: {msg}" for n, msg in rep["errors"]]
+    return "\n".join(out)
+
+
+# ─────────────────────────────────────────────────────────
+#  PROGNOZA ZAMÓWIEŃ
+# ─────────────────────────────────────────────────────────
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+class ReorderForecast:
+    """Propozycje zamówień dla całego katalogu. Historia sprzedaży to jedna macierz
+    SKU x dni; prognoza dziennego popytu to wygładzanie wykładnicze szeregu oczyszczonego
+    z profilu tygodnia (dla SKU z co najmniej SEASON_MIN sztukami) – wszystko operacjami
+    na macierzach, bez pętli po produktach.
+
+    Punkt zamówienia = popyt w czasie dostawy + zapas bezpieczeństwa (z odchylenia dziennej
+    sprzedaży od prognozy); zamówienie uzupełnia stan do popytu na czas dostawy i okres
+    pokrycia. Ustawienia: Config.get_reorder() – lead_days, cover_days, service_level."""
+    HISTORY_DAYS = 182    # 26 pełnych tygodni
+    ALPHA        = 0.05   # waga najnowszego dnia (pamięć ok. 20 dni)
+    SEASON_MIN   = 28
+    HORIZON      = 365    # dni, w których szukana jest data zamówienia i braku towaru
+    Z = {0.9: 1.28, 0.95: 1.65, 0.98: 2.05, 0.99: 2.33}
+
+    def __init__(self, db, config):
+        self.db     = db
+        self.config = config
+
+    def compute(self, as_of=None):
+        """Lista propozycji (tylko SKU z prognozowanym popytem), od najpilniejszej.
+        as_of – 'YYYY-MM-DD' pierwszego dnia prognozy (domyślnie dziś); historia kończy się dzień wcześniej"""
+        if not HAS_NUMPY:
+            raise ImportError("Zainstaluj numpy:  pip install numpy")
+        opt   = self.config.get_reorder()
+        lead  = int(opt["lead_days"]); cover = int(opt["cover_days"])
+        z     = self.Z.get(opt["service_level"], 1.65)
+        first = np.datetime64(as_of or datetime.now().strftime("%Y-%m-%d"), "D")
+        start = first - self.HISTORY_DAYS
+        with self.db.snapshot() as db:
+            prods = db.list_products()
+            sales = db.get_daily_sales(str(start), str(first - 1))
+        if not prods: return []
+
+        # ── macierz historii: SKU x dni ──
+        ids   = np.array([p.id for p in prods])
+        stock = np.array([p.stock for p in prods], dtype=float)
+        order = np.argsort(ids)
+        H     = np.zeros((len(prods), self.HISTORY_DAYS))
+        if sales:
+            pid = np.array([r[0] for r in sales]); qty = np.array([r[2] for r in sales], dtype=float)
+            day = (np.array([r[1][:10] for r in sales], dtype="datetime64[D]") - start).astype(int)
+            np.add.at(H, (order[np.searchsorted(ids[order], pid)], day), qty)
+
+        # ── profil tygodnia: średnia dnia tygodnia / średnia dzienna ──
+        dow   = ((start - np.datetime64("1970-01-05")).astype(int) + np.arange(self.HISTORY_DAYS)) % 7
+        mean  = H.mean(1)
+        prof  = np.stack([H[:, dow == d].mean(1) for d in range(7)], 1) / np.where(mean > 0, mean, 1)[:, None]
+        prof  = np.where((H.sum(1) >= self.SEASON_MIN)[:, None], prof, 1.0)
+
+        # ── wygładzanie wykładnicze szeregu bez sezonowości (dni z profilem 0 pomijane) ──
+        S     = prof[:, dow]
+        W     = (1 - self.ALPHA) ** np.arange(self.HISTORY_DAYS - 1, -1, -1) * (S > 0)
+        D     = np.divide(H, S, out=np.zeros_like(H), where=S > 0)
+        level = (D * W).sum(1) / np.maximum(W.sum(1), 1e-9)
+        sigma = (H - level[:, None] * S).std(1)
+
+        # ── prognoza na HORIZON dni, punkt zamówienia, daty ──
+        fdow  = (dow[-1] + 1 + np.arange(self.HORIZON)) % 7
+        fc    = level[:, None] * prof[:, fdow]
+        lead_d  = fc[:, :lead].sum(1)
+        cover_d = fc[:, lead:lead + cover].sum(1)
+        safety  = z * sigma * np.sqrt(lead)
+        rop     = lead_d + safety
+        left    = stock[:, None] - np.cumsum(fc, 1)        # stan na koniec każdego dnia prognozy
+        hit     = left <= rop[:, None];  out = left <= 0
+        r_day   = np.where(hit.any(1), hit.argmax(1), -1)
+        # ilość do zamówienia w dniu zamówienia (0 – poza horyzontem prognozy)
+        qty     = np.where(r_day >= 0, np.ceil(np.maximum(0, lead_d + cover_d + safety - np.minimum(stock, rop))), 0)
+        o_day   = np.where(stock <= 0, 0, np.where(out.any(1), out.argmax(1), -1))
+
+        res = []
+        for i in np.flatnonzero(level > 0):
+            p = prods[i]
+            res.append({"product_id": p["id"], "sku": p["sku"], "title": p["title"], "stock": int(stock[i]),
+                        "daily": float(level[i]), "lead_demand": float(lead_d[i]),
+                        "reorder_point": float(rop[i]), "order_qty": int(qty[i]),
+                        "reorder_date": str(first + int(r_day[i])) if r_day[i] >= 0 else None,
+                        "stockout_days": int(o_day[i]) if o_day[i] >= 0 else None})
+        res.sort(key=lambda r: (r["reorder_date"] or "9999", r["sku"]))
+        return res
+
+
 # ─────────────────────────────────────────────────────────
 #  POMOCNICZE
 # ─────────────────────────────────────────────────────────
+def view_version(db):
+    """Klucz aktualności widoku: wersja danych + motyw (kolory są zapisane w komórkach tabel)"""
+    return db.data_version(), CURRENT_THEME["name"]
+
+
 def product_combo(db):
     combo = QComboBox()
-    for p in db.list_products():
-        combo.addItem(f"{p['sku']} – {p['title']}  (stan: {p['stock']})", p["id"])
+    for p in db.iter_products():
+        combo.addItem(f"{p.sku} – {p.title}  (stan: {p.stock})", p.id)
     return combo
 
 
@@ -812,6 +2835,7 @@ class SortableTable(QTableWidget):
     def __init__(self, rows=0, cols=0, parent=None):
         super().__init__(rows, cols, parent)
         self._sort_asc = {}
+        self._stretch  = None
         self.setAlternatingRowColors(True)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
@@ -823,12 +2847,21 @@ class SortableTable(QTableWidget):
         self._sort_asc[col] = asc
         self.sortItems(col, Qt.AscendingOrder if asc else Qt.DescendingOrder)
 
+    def fit_columns(self, stretch=None):
+        """Szerokości kolumn według treści, liczone raz po wypełnieniu; stretch – kolumna zajmująca
+        resztę szerokości (zapamiętywana). Tryb ResizeToContents mierzyłby wiersze przy każdej
+        zmianie stylu – przełączenie motywu z tabelą 2000 produktów trwało pół sekundy"""
+        if stretch is not None: self._stretch = stretch
+        hdr = self.horizontalHeader()
+        for i in range(self.columnCount()):
+            hdr.setSectionResizeMode(i, QHeaderView.Stretch if i == self._stretch else QHeaderView.Interactive)
+        self.resizeColumnsToContents()
+
 
 def Separator(parent=None):
     f = QFrame(parent)
     f.setFrameShape(QFrame.HLine)
-    f.setStyleSheet(f"background:{T()['border']};max-height:1px;")
-    return f
+    return styled(f, "separator")
 
 
 def btn(text, style="primary", parent=None):
@@ -839,99 +2872,239 @@ def btn(text, style="primary", parent=None):
     return b
 
 
+def styled(w, role=None, tone=None):
+    """Rola i stan widżetu dla selektorów arkusza (QLabel[role="hint"], [tone="danger"]) –
+    kolory pochodzą z build_qss bieżącego motywu, więc zmiana motywu ich nie pomija"""
+    if role: w.setProperty("role", role)
+    if tone: w.setProperty("tone", tone)
+    return w
+
+
+def set_tone(w, tone):
+    """Zmiana stanu po wyświetleniu – Qt stosuje selektory właściwości dopiero po ponownym polish"""
+    if w.property("tone") == tone: return
+    w.setProperty("tone", tone)
+    w.style().unpolish(w); w.style().polish(w)
+
+
+# ─────────────────────────────────────────────────────────
+#  WYKRESY – wspólna warstwa pamięci podręcznej
+# ─────────────────────────────────────────────────────────
+class _CachedChart(QWidget):
+    """Statyczna warstwa wykresu rysowana raz do QPixmap – paintEvent tylko ją kopiuje.
+    Obraz jest odtwarzany po invalidate() (nowe dane) oraz przy zmianie rozmiaru lub motywu."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pix     = None
+        self._pix_key = None
+        self._rev     = 0
+
+    def invalidate(self):
+        self._rev += 1
+        self.update()
+
+    def _render(self, p, W, H):
+        raise NotImplementedError
+
+    def paintEvent(self, event):
+        W, H = self.width(), self.height()
+        if W <= 0 or H <= 0: return
+        dpr = self.devicePixelRatioF()
+        key = (self._rev, W, H, dpr, CURRENT_THEME["name"])
+        if key != self._pix_key:
+            pix = QPixmap(int(W * dpr), int(H * dpr))
+            pix.setDevicePixelRatio(dpr)
+            pix.fill(Qt.transparent)
+            p = QPainter(pix)
+            p.setRenderHint(QPainter.Antialiasing)
+            self._render(p, W, H)
+            p.end()
+            self._pix, self._pix_key = pix, key
+        p = QPainter(self)
+        p.drawPixmap(0, 0, self._pix)
+        p.end()
+
+
+def minmax_downsample(values, width):
+    """[(min, max)] serii w każdej z `width` kolumn pikseli. Kolumna obejmuje też pierwszą
+    wartość następnej, więc pionowe odcinki łączą się jak linia, a pojedyncze piki zostają."""
+    n = len(values)
+    out = []
+    for c in range(width):
+        seg = values[c * n // width : (c + 1) * n // width + 1]
+        out.append((min(seg), max(seg)) if seg else out[-1])
+    return out
+
+
+def period_buckets(date_from, date_to, step):
+    """Kolejne początki okresów (YYYY-MM-DD) zgodne z DB.get_sales_series"""
+    d  = datetime.strptime(date_from, "%Y-%m-%d")
+    to = datetime.strptime(date_to, "%Y-%m-%d")
+    if step == "week":  d -= timedelta(days=d.weekday())
+    if step == "month": d  = d.replace(day=1)
+    out = []
+    while d <= to:
+        out.append(d.strftime("%Y-%m-%d"))
+        if step == "month": d = (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:               d += timedelta(days=7 if step == "week" else 1)
+    return out
+
+
 # ─────────────────────────────────────────────────────────
-#  WYKRES SŁUPKOWY – miesięczne przychody / zysk
+#  WYKRES SŁUPKOWY / LINIOWY – przychód, zysk, koszt, rok poprzedni
 # ─────────────────────────────────────────────────────────
-class MonthlyBarChart(QWidget):
+class MonthlyBarChart(_CachedChart):
     MONTHS = ["Sty","Lut","Mar","Kwi","Maj","Cze","Lip","Sie","Wrz","Paź","Lis","Gru"]
+    # seria -> (etykieta legendy, kolor z motywu); kolejność = kolejność rysowania
+    SERIES = {"rev":    ("Przychód",      "chart_bar"),
+              "profit": ("Zysk netto",    "success"),
+              "cost":   ("Koszt zakupów", "warning"),
+              "prev":   ("Rok poprzedni", "text3")}
+    BARS   = ("rev", "profit")   # przy małej liczbie okresów rysowane jako słupki
+    MIN_BAR_PX = 6
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self._data   = {}
-        self._show   = "rev"   # "rev" lub "profit"
+        self._labels  = []
+        self._series  = {}
+        self._cols    = {}     # seria -> minmax_downsample dla szerokości _cols_w
+        self._cols_w  = 0
+        self._visible = {"rev"}
         self.setMinimumHeight(160)
 
-    def set_data(self, data):
-        self._data = data
-        self.update()
+    def set_data(self, data, prev=None):
+        """Dane miesięczne w formacie DB.get_monthly_revenue (opcjonalnie rok poprzedni)"""
+        ms = [f"{m:02d}" for m in range(1,13)]
+        series = {k: [data.get(m,{}).get(k,0) for m in ms] for k in ("rev","profit","cost")}
+        if prev is not None: series["prev"] = [prev.get(m,{}).get("rev",0) for m in ms]
+        self.set_series(self.MONTHS, series)
 
-    def set_mode(self, mode):
-        self._show = mode
-        self.update()
+    def set_series(self, labels, series):
+        """labels: etykiety osi X; series: {nazwa z SERIES: [wartości]} – tej samej długości"""
+        self._labels = list(labels)
+        self._series = {k: list(v) for k, v in series.items() if k in self.SERIES}
+        self._cols   = {}
+        self.invalidate()
 
-    def paintEvent(self, event):
-        t  = T()
-        p  = QPainter(self)
-        p.setRenderHint(QPainter.Antialiasing)
+    def set_mode(self, mode):
+        self._visible = {mode}
+        self.invalidate()
 
-        W, H = self.width(), self.height()
-        PL, PR, PT, PB = 48, 10, 10, 28
+    def set_visible(self, name, on):
+        (self._visible.add if on else self._visible.discard)(name)
+        self.invalidate()
 
+    def _render(self, p, W, H):
+        t = T()
+        N = len(self._labels)
+        vis = [k for k in self.SERIES if k in self._visible and k in self._series]
+        PL, PR, PT, PB = 48, 10, 22, 28
         chart_w = W - PL - PR
         chart_h = H - PT - PB
+        if N == 0 or chart_w <= 0 or chart_h <= 0: return
+
+        vals   = [v for k in vis for v in (min(self._series[k]), max(self._series[k]))]
+        max_v  = max(vals + [1])
+        min_v  = min(vals + [0])
+        span   = max_v - min_v
+        y_of   = lambda v: PT + chart_h - (v - min_v) / span * chart_h
+        slot   = chart_w / N
+        x_of   = lambda i: PL + (i + 0.5) * slot
+        as_bar = slot >= self.MIN_BAR_PX
+        bars   = [k for k in vis if as_bar and k in self.BARS]
 
-        rev_vals    = [self._data.get(f"{m:02d}",{}).get("rev",0) for m in range(1,13)]
-        profit_vals = [self._data.get(f"{m:02d}",{}).get("profit",0) for m in range(1,13)]
-        vals        = profit_vals if self._show == "profit" else rev_vals
-        max_val     = max(max(vals), 1)
-
-        bar_col   = QColor(t["chart_bar"])
-        prof_col  = QColor(t["success"])
         label_col = QColor(t["chart_label"])
         grid_col  = QColor(t["chart_grid"])
         text_col  = QColor(t["text"])
+        small     = QFont("Segoe UI", 7)
+        fmt       = lambda v: f"{int(v/1000)}k" if abs(v) >= 1000 else str(int(v))
 
-        # siatka pozioma
-        p.setPen(QPen(grid_col, 1, Qt.DotLine))
+        # siatka pozioma + etykiety osi Y
+        p.setFont(small)
         for i in range(5):
-            y = PT + chart_h - (i * chart_h / 4)
-            p.drawLine(PL, int(y), W - PR, int(y))
-            # etykieta osi Y
-            val_label = f"{int(max_val * i / 4)}"
-            p.setPen(QPen(label_col))
-            p.setFont(QFont("Segoe UI", 7))
-            p.drawText(0, int(y) - 8, PL - 4, 16, Qt.AlignRight | Qt.AlignVCenter, val_label)
+            v = min_v + span * i / 4
+            y = int(y_of(v))
             p.setPen(QPen(grid_col, 1, Qt.DotLine))
+            p.drawLine(PL, y, W - PR, y)
+            p.setPen(QPen(label_col))
+            p.drawText(0, y - 8, PL - 4, 16, Qt.AlignRight | Qt.AlignVCenter, str(int(v)))
 
-        # słupki
-        bar_w = chart_w / 12
-        gap   = bar_w * 0.18
-        for i, (rv, pv) in enumerate(zip(rev_vals, profit_vals)):
-            val = pv if self._show == "profit" else rv
-            x   = PL + i * bar_w + gap / 2
-            bw  = bar_w - gap
-
-            # tło (max)
-            p.setBrush(QBrush(QColor(t["chart_grid"])))
+        # słupki: pierwsza seria na całą szerokość, kolejne węższe, nałożone na nią
+        y0 = y_of(0)
+        if bars:
+            gap = slot * 0.18
+            bw  = slot - gap
             p.setPen(Qt.NoPen)
-            p.drawRoundedRect(int(x), PT, int(bw), chart_h, 3, 3)
-
-            # wartość
-            bh = max(int(val / max_val * chart_h), 0)
-            by = PT + chart_h - bh
-            col = prof_col if self._show == "profit" else bar_col
-            p.setBrush(QBrush(col))
-            p.drawRoundedRect(int(x), int(by), int(bw), bh, 3, 3)
-
-            # wartość nad słupkiem
-            if val > 0:
+            p.setBrush(QBrush(grid_col))
+            for i in range(N):
+                p.drawRoundedRect(int(PL + i * slot + gap / 2), PT, int(bw), chart_h, 3, 3)
+            for j, k in enumerate(bars):
+                w = bw * (1.0 if j == 0 else 0.5)
+                p.setBrush(QBrush(QColor(t[self.SERIES[k][1]])))
+                for i, v in enumerate(self._series[k]):
+                    top, bot = sorted((y_of(v), y0))
+                    p.drawRoundedRect(int(x_of(i) - w / 2), int(top), int(w), int(bot - top), 3, 3)
+            # wartości nad słupkami pierwszej serii
+            if N <= 31:
                 p.setPen(QPen(text_col))
-                p.setFont(QFont("Segoe UI", 7))
-                label = f"{int(val/1000)}k" if val >= 1000 else str(int(val))
-                p.drawText(int(x) - 4, int(by) - 14, int(bw) + 8, 13, Qt.AlignCenter, label)
+                for i, v in enumerate(self._series[bars[0]]):
+                    if v > 0:
+                        p.drawText(int(x_of(i) - slot / 2), int(y_of(v)) - 14, int(slot), 13,
+                                   Qt.AlignCenter, fmt(v))
+
+        # linie: pozostałe serie; gdy punktów jest więcej niż pikseli – pionowy odcinek
+        # min–max na kolumnę (bez antyaliasingu, koszt zależy od szerokości, nie od danych)
+        dense = N > chart_w
+        if self._cols_w != chart_w: self._cols, self._cols_w = {}, chart_w
+        ay, by = -chart_h / span, PT + chart_h + min_v * chart_h / span
+        p.setBrush(Qt.NoBrush)
+        for k in vis:
+            if k in bars: continue
+            col = QColor(t[self.SERIES[k][1]])
+            pen = QPen(col, 2)
+            if k == "prev": pen.setStyle(Qt.DashLine)
+            if dense:
+                if k not in self._cols: self._cols[k] = minmax_downsample(self._series[k], chart_w)
+                if k == "prev": col.setAlpha(150)
+                p.setRenderHint(QPainter.Antialiasing, False)
+                p.setPen(QPen(col, 1))
+                p.drawLines([QLineF(PL + c + 0.5, ay * hi + by, PL + c + 0.5, ay * lo + by)
+                             for c, (lo, hi) in enumerate(self._cols[k])])
+                p.setRenderHint(QPainter.Antialiasing)
+                continue
+            p.setPen(pen)
+            pts = [QPointF(x_of(i), ay * v + by) for i, v in enumerate(self._series[k])]
+            p.drawPolyline(QPolygonF(pts))
+            if as_bar and N <= 31:
+                p.setBrush(QBrush(pen.color()))
+                for pt in pts: p.drawEllipse(pt, 2.5, 2.5)
+                p.setBrush(Qt.NoBrush)
+
+        # etykiety osi X – co któraś, żeby się nie nakładały
+        p.setPen(QPen(label_col))
+        p.setFont(QFont("Segoe UI", 8))
+        lw     = max(len(self._labels[0]) * 7, 24)
+        stride = max(1, -(-N * lw // chart_w))
+        for i in range(0, N, stride):
+            p.drawText(int(x_of(i) - lw / 2), H - PB + 4, lw, 20, Qt.AlignCenter, self._labels[i])
 
-            # miesiąc
+        # legenda
+        x = W - PR
+        p.setFont(small)
+        for k in reversed(vis):
+            name, col = self.SERIES[k]
+            tw = p.fontMetrics().horizontalAdvance(name)
+            x -= tw + 18
+            p.setPen(Qt.NoPen); p.setBrush(QBrush(QColor(t[col])))
+            p.drawRoundedRect(x, 4, 10, 10, 2, 2)
             p.setPen(QPen(label_col))
-            p.setFont(QFont("Segoe UI", 8))
-            p.drawText(int(x), H - PB + 4, int(bw), 20, Qt.AlignCenter, self.MONTHS[i])
-
-        p.end()
+            p.drawText(x + 13, 0, tw + 4, 18, Qt.AlignLeft | Qt.AlignVCenter, name)
 
 
 # ─────────────────────────────────────────────────────────
 #  WYKRES – limit platform (kołowy / pasek)
 # ─────────────────────────────────────────────────────────
-class PlatformLimitChart(QWidget):
+class PlatformLimitChart(_CachedChart):
     """Pasek postępu z etykietami dla każdej platformy"""
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -942,16 +3115,12 @@ class PlatformLimitChart(QWidget):
         self._platforms = platforms
         h = max(len(platforms) * 48 + 20, 60)
         self.setMinimumHeight(h)
-        self.update()
+        self.invalidate()
 
-    def paintEvent(self, event):
+    def _render(self, p, W, H):
         if not self._platforms:
             return
-        t  = T()
-        p  = QPainter(self)
-        p.setRenderHint(QPainter.Antialiasing)
-
-        W, H   = self.width(), self.height()
+        t = T()
         row_h  = H / len(self._platforms)
         bar_h  = 14
         PL     = 130   # lewa kolumna – nazwa
@@ -1001,64 +3170,67 @@ class PlatformLimitChart(QWidget):
             p.drawText(bx, by + bar_h + 2, int(bar_w), 14, Qt.AlignLeft,
                        f"Przychód: {rev:,.2f} PLN   Zysk netto: {profit:,.2f} PLN")
 
-        p.end()
 
 
 # ─────────────────────────────────────────────────────────
 #  KARTA KPI
 # ─────────────────────────────────────────────────────────
 class KpiCard(QFrame):
-    def __init__(self, label, value, unit="", color=None, parent=None):
+    """Karta wskaźnika; kpi – klucz koloru z motywu (kpi_rev, kpi_profit, …), kolory w build_qss"""
+    def __init__(self, label, value, unit="", kpi=None, parent=None):
         super().__init__(parent)
         self.setFrameShape(QFrame.StyledPanel)
-        self._color = color or T()["accent"]
+        styled(self, "kpi"); self.setProperty("kpi", kpi)
         self.setMinimumWidth(150)
 
         v = QVBoxLayout(self)
         v.setContentsMargins(14, 12, 14, 12)
         v.setSpacing(3)
 
-        self._lbl = QLabel(label)
-        self._lbl.setStyleSheet(f"color:{T()['text3']};font-size:10px;font-weight:700;"
-                                 "text-transform:uppercase;letter-spacing:0.5px;")
+        self._lbl = styled(QLabel(label), "kpi_label")
         v.addWidget(self._lbl)
 
-        self._val = QLabel(str(value))
-        self._val.setStyleSheet(f"color:{self._color};font-size:21px;font-weight:800;")
+        self._val = styled(QLabel(str(value)), "kpi_value"); self._val.setProperty("kpi", kpi)
         v.addWidget(self._val)
 
         if unit:
-            self._unit = QLabel(unit)
-            self._unit.setStyleSheet(f"color:{T()['text3']};font-size:10px;")
+            self._unit = styled(QLabel(unit), "kpi_note")
             v.addWidget(self._unit)
 
-        self._update_bg()
-
-    def _update_bg(self):
-        t = T()
-        self.setStyleSheet(
-            f"QFrame{{background:{t['card_bg']};border:1px solid {t['border']};"
-            f"border-radius:8px;border-left:4px solid {self._color};}}"
-        )
+        self._delta = styled(QLabel(""), "kpi_note")
+        v.addWidget(self._delta)
 
     def set_value(self, v):
         self._val.setText(str(v))
 
-    def refresh_theme(self, color=None):
-        if color: self._color = color
-        self._lbl.setStyleSheet(f"color:{T()['text3']};font-size:10px;font-weight:700;")
-        self._val.setStyleSheet(f"color:{self._color};font-size:21px;font-weight:800;")
-        self._update_bg()
+    def set_delta(self, cur, prev, invert=False):
+        """Zmiana względem tego samego okresu rok wcześniej; invert – wzrost jest niekorzystny"""
+        if not prev:
+            self._delta.setText("r/r: brak danych" if cur else "")
+            set_tone(self._delta, None)
+            return
+        pct  = (cur - prev) / abs(prev) * 100
+        good = (pct >= 0) != invert
+        self._delta.setText(f"{'▲' if pct >= 0 else '▼'} {abs(pct):.1f}% r/r")
+        set_tone(self._delta, "success" if good else "danger")
 
 
 # ─────────────────────────────────────────────────────────
 #  DASHBOARD
 # ─────────────────────────────────────────────────────────
 class DashboardWidget(QWidget):
+    # (etykieta, krok, liczba dni wstecz – None: rok z nagłówka, 0: cała historia)
+    CHART_RANGES = [("Wybrany rok – miesiące",      "month", None),
+                    ("Ostatnie 12 mies. – tygodnie", "week",  364),
+                    ("Ostatnie 90 dni – dni",        "day",   89),
+                    ("Cała historia – dni",          "day",   0)]
+
     def __init__(self, db, config, parent=None):
         super().__init__(parent)
-        self.db     = db
-        self.config = config
+        self.db         = db
+        self.config     = config
+        self._version   = None
+        self._chart_key = None   # (wersja danych, rok, zakres) ostatnio wczytanego wykresu
         self._build()
 
     def _build(self):
@@ -1073,13 +3245,25 @@ class DashboardWidget(QWidget):
 
         # ── nagłówek ──
         hdr = QHBoxLayout()
-        yr_lbl = QLabel(f"Dashboard – rok {datetime.now().year}")
-        yr_lbl.setStyleSheet(f"font-size:16px;font-weight:800;color:{T()['text']};")
+        yr_lbl = styled(QLabel("Dashboard"), "heading")
         hdr.addWidget(yr_lbl)
+        hdr.addSpacing(16)
+
+        # okres: rok + cały rok / kwartał / miesiąc / ostatnie 12 miesięcy
+        hdr.addWidget(QLabel("Okres:"))
+        self.period_cb = QComboBox()
+        self.period_cb.addItems([p[0] for p in PERIODS])
+        self.year_sp = QSpinBox()
+        self.year_sp.setRange(2000, 2100)
+        self.year_sp.setValue(datetime.now().year)
+        self.period_cb.currentIndexChanged.connect(self._period_changed)
+        self.year_sp.valueChanged.connect(self._period_changed)
+        hdr.addWidget(self.period_cb)
+        hdr.addWidget(self.year_sp)
         hdr.addStretch()
 
         # przełącznik motywu
-        self.theme_btn = btn("🌙 Motyw nocny", "secondary")
+        self.theme_btn = btn("☀️ Motyw dzienny" if CURRENT_THEME is THEME_NIGHT else "🌙 Motyw nocny", "secondary")
         self.theme_btn.clicked.connect(self._toggle_theme)
         hdr.addWidget(self.theme_btn)
         ref_btn = btn("⟳ Odśwież", "secondary")
@@ -1089,24 +3273,22 @@ class DashboardWidget(QWidget):
 
         # ── KPI cards ──
         kpi_row = QHBoxLayout(); kpi_row.setSpacing(10)
-        t = T()
-        self.kpi_rev   = KpiCard("Przychód roczny",       "—", "PLN",       t["kpi_rev"])
-        self.kpi_prof  = KpiCard("Zysk netto roczny",     "—", "PLN",       t["kpi_profit"])
-        self.kpi_cost  = KpiCard("Koszt zakupów",         "—", "PLN",       t["kpi_stock"])
-        self.kpi_cnt   = KpiCard("Liczba sprzedaży",      "—", "transakcji",t["kpi_sales"])
-        self.kpi_prod  = KpiCard("Produkty w magazynie",  "—", "SKU",       t["kpi_prod"])
+        self.kpi_rev   = KpiCard("Przychód",              "—", "PLN",       "rev")
+        self.kpi_prof  = KpiCard("Zysk netto",            "—", "PLN",       "profit")
+        self.kpi_cost  = KpiCard("Koszt zakupów",         "—", "PLN",       "stock")
+        self.kpi_cnt   = KpiCard("Liczba sprzedaży",      "—", "transakcji","sales")
+        self.kpi_prod  = KpiCard("Produkty w magazynie",  "—", "SKU",       "prod")
         for k in [self.kpi_rev, self.kpi_prof, self.kpi_cost, self.kpi_cnt, self.kpi_prod]:
             kpi_row.addWidget(k)
         v.addLayout(kpi_row)
 
         # ── limit US ──
-        lim_grp = QGroupBox("Limit działalności nierejestrowanej (bieżący rok)")
+        lim_grp = QGroupBox("Limit działalności nierejestrowanej (bieżący okres)")
         ll = QVBoxLayout()
         self.lim_bar  = QProgressBar()
         self.lim_bar.setFormat("")
         self.lim_bar.setFixedHeight(16)
-        self.lim_info = QLabel()
-        self.lim_info.setStyleSheet(f"color:{T()['text2']};font-size:11px;")
+        self.lim_info = styled(QLabel(), "info")
         ll.addWidget(self.lim_bar)
         ll.addWidget(self.lim_info)
         lim_grp.setLayout(ll)
@@ -1115,18 +3297,22 @@ class DashboardWidget(QWidget):
         # ── wykresy ──
         charts = QHBoxLayout(); charts.setSpacing(12)
 
-        # miesięczny wykres
-        chart_grp = QGroupBox("Miesięczne wyniki (bieżący rok)")
+        # wykres wyników
+        chart_grp = QGroupBox("Wyniki sprzedaży")
         cl = QVBoxLayout()
         mode_row = QHBoxLayout()
         mode_row.addWidget(QLabel("Pokaż:"))
-        self.mode_rev  = QRadioButton("Przychód"); self.mode_rev.setChecked(True)
-        self.mode_prof = QRadioButton("Zysk netto")
-        self.mode_rev.toggled.connect(lambda c: self.chart.set_mode("rev") if c else None)
-        self.mode_prof.toggled.connect(lambda c: self.chart.set_mode("profit") if c else None)
-        mode_row.addWidget(self.mode_rev)
-        mode_row.addWidget(self.mode_prof)
+        self.series_cb = {}
+        for key, (label, _) in MonthlyBarChart.SERIES.items():
+            cb = QCheckBox(label); cb.setChecked(key == "rev")
+            cb.toggled.connect(lambda c, k=key: self.chart.set_visible(k, c))
+            mode_row.addWidget(cb); self.series_cb[key] = cb
         mode_row.addStretch()
+        mode_row.addWidget(QLabel("Zakres:"))
+        self.range_cb = QComboBox()
+        self.range_cb.addItems([r[0] for r in self.CHART_RANGES])
+        self.range_cb.currentIndexChanged.connect(lambda _: self._load_chart())
+        mode_row.addWidget(self.range_cb)
         cl.addLayout(mode_row)
         self.chart = MonthlyBarChart()
         self.chart.setMinimumHeight(170)
@@ -1137,14 +3323,13 @@ class DashboardWidget(QWidget):
         v.addLayout(charts)
 
         # ── platformy z limitem 29 sprzedaży ──
-        plat_grp = QGroupBox(f"Sprzedaż wg platform – limit {PLATFORM_LIMIT} szt./rok/platforma")
+        plat_grp = self.plat_grp = QGroupBox()
         pl = QVBoxLayout()
 
         # legenda
         leg = QHBoxLayout()
-        for color, txt in [(T()["success"],"≤70% limitu"), (T()["warning"],"70–90%"), (T()["danger"],"≥90% – uwaga!")]:
-            dot = QLabel("●")
-            dot.setStyleSheet(f"color:{color};font-size:16px;")
+        for tone, txt in [("success","≤70% limitu"), ("warning","70–90%"), ("danger","≥90% – uwaga!")]:
+            dot = styled(QLabel("●"), "dot", tone)
             leg.addWidget(dot)
             leg.addWidget(QLabel(txt))
             leg.addSpacing(16)
@@ -1181,72 +3366,105 @@ class DashboardWidget(QWidget):
         self.refresh()
 
     def _toggle_theme(self):
-        global CURRENT_THEME
-        app = QApplication.instance()
-        if CURRENT_THEME is THEME_DAY:
-            apply_theme(app, THEME_NIGHT)
-            self.theme_btn.setText("☀️ Motyw dzienny")
-        else:
-            apply_theme(app, THEME_DAY)
-            self.theme_btn.setText("🌙 Motyw nocny")
+        key = "night" if CURRENT_THEME is THEME_DAY else "day"
+        apply_theme(QApplication.instance(), THEMES[key])
+        self.config.set_theme(key)   # motyw zostaje po ponownym uruchomieniu
+        self.theme_btn.setText("☀️ Motyw dzienny" if key == "night" else "🌙 Motyw nocny")
         # odśwież wykres
         self.chart.update()
         self.plat_chart.update()
 
+    def _load_chart(self):
+        """Serie wykresu dla wybranego zakresu; rok poprzedni – ten sam zakres przesunięty o rok"""
+        key = (self._version, self.year_sp.value(), self.range_cb.currentIndex())
+        if key == self._chart_key: return
+        self._chart_key = key
+        _, step, back = self.CHART_RANGES[self.range_cb.currentIndex()]
+        now = datetime.now()
+        dt  = f"{self.year_sp.value()}-12-31" if back is None else now.strftime("%Y-%m-%d")
+        if step == "week":
+            shift = lambda k: (datetime.strptime(k, "%Y-%m-%d") - timedelta(days=364)).strftime("%Y-%m-%d")
+        else:
+            shift = lambda k: f"{int(k[:4])-1}{k[4:]}".replace("-02-29", "-02-28")
+        with self.db.snapshot() as db:
+            if back is None: df = f"{self.year_sp.value()}-01-01"
+            elif back:       df = (now - timedelta(days=back)).strftime("%Y-%m-%d")
+            else:            df = min(db.get_sales_series("0001-01-01", dt, step), default=dt)
+            keys = period_buckets(df, dt, step)
+            cur  = db.get_sales_series(keys[0], dt, step)
+            prev = db.get_sales_series(shift(keys[0]), shift(dt), step)
+        zero = (0, 0, 0)
+        series = {k: [cur.get(d, zero)[j] for d in keys] for j, k in enumerate(("rev","profit","cost"))}
+        series["prev"] = [prev.get(shift(d), zero)[0] for d in keys]
+        if step == "month":  labels = [MonthlyBarChart.MONTHS[int(d[5:7])-1] for d in keys]
+        elif back == 0:      labels = [f"{d[5:7]}.{d[:4]}" for d in keys]
+        else:                labels = [f"{d[8:]}.{d[5:7]}" for d in keys]
+        self.chart.set_series(labels, series)
+
+    def _period_changed(self, *_):
+        self.year_sp.setEnabled(PERIODS[self.period_cb.currentIndex()][1] != "ttm")
+        self.refresh()
+
+    def period(self):
+        """Wybrany okres jako (pierwszy, ostatni) miesiąc 'YYYY-MM'"""
+        _, kind, n = PERIODS[self.period_cb.currentIndex()]
+        return period_months(kind, self.year_sp.value(), n)
+
+    def refresh_if_changed(self):
+        if view_version(self.db) == self._version: return False
+        self.refresh(); return True
+
     def refresh(self):
-        t     = T()
-        stats = self.db.get_stats()
+        self._version = view_version(self.db)
+        with self.db.snapshot() as db:   # KPI, limit, wykres i platformy z jednej chwili
+            self._fill(db)
+
+    def _fill(self, db):
+        t      = T()
+        months = self.period()
+        stats  = db.get_stats(months=months)
+        prev   = db.get_stats(months=period_shift(months))
         self.kpi_rev.set_value(f"{stats['revenue']:,.2f}")
         self.kpi_prof.set_value(f"{stats['profit']:,.2f}")
         self.kpi_cost.set_value(f"{stats['cost']:,.2f}")
         self.kpi_cnt.set_value(str(stats['sale_count']))
         self.kpi_prod.set_value(str(stats['prod_count']))
-
-        # limit bar
-        wage  = self.config.get_minimal_wage()
-        lim   = self.config.get_limits()
-        if lim.get("use_quarterly", True):
-            limit = wage * lim.get("quarterly_multiplier", 2.25)
-            now   = datetime.now()
-            q     = (now.month - 1) // 3 + 1
-            label = f"Limit kwartalny Q{q}/{now.year}"
-        else:
-            limit = wage * 0.75
-            label = f"Limit miesięczny {datetime.now().month}/{datetime.now().year}"
-
-        rev = stats["revenue"]
-        pct = min(int(rev / limit * 100), 100) if limit > 0 else 0
+        self.kpi_rev.set_delta(stats["revenue"], prev["revenue"])
+        self.kpi_prof.set_delta(stats["profit"], prev["profit"])
+        self.kpi_cost.set_delta(stats["cost"], prev["cost"], invert=True)
+        self.kpi_cnt.set_delta(stats["sale_count"], prev["sale_count"])
+
+        # limit bar – przychód okresu rozliczeniowego zawierającego dzisiejszy dzień
+        st    = RevenueLimit(db, self.config).status()
+        label, limit, rev = st["label"], st["limit"], st["used"]
+        pct   = min(int(st["pct"]), 100)
         self.lim_bar.setValue(pct)
-        bar_color = t["success"] if pct < 70 else (t["warning"] if pct < 90 else t["danger"])
-        self.lim_bar.setStyleSheet(
-            f"QProgressBar::chunk{{background-color:{bar_color};border-radius:5px;}}"
-            f"QProgressBar{{background:{t['progress_bg']};border:1px solid {t['border']};border-radius:5px;}}"
-        )
-        warn = "  ⚠️  Zbliżasz się do limitu!" if pct >= 80 else ""
+        set_tone(self.lim_bar, "success" if pct < 70 else ("warning" if pct < 90 else "danger"))
+        warn = ("  ⛔  Limit przekroczony!" if st["over"] else
+                "  ⚠️  Zbliżasz się do limitu!" if st["warn"] else "")
         self.lim_info.setText(
             f"{label}: {rev:,.2f} PLN / {limit:,.2f} PLN  ({pct}%){warn}"
         )
-        self.lim_info.setStyleSheet(f"color:{t['text2']};font-size:11px;")
 
-        # wykres miesięczny
-        monthly = self.db.get_monthly_revenue()
-        self.chart.set_data(monthly)
+        self._load_chart()
 
         # platformy
-        platforms = self.db.get_platform_breakdown()
-        year = datetime.now().year
+        platforms = db.get_platform_breakdown(months=months)
+        year = int(months[1][:4])
+        plim = self.config.get_platform_limit(year)
+        self.plat_grp.setTitle(f"Sprzedaż wg platform – limit {plim} szt./rok/platforma ({year})")
 
         plat_data = []
         self.plat_tbl.setRowCount(len(platforms))
         for i, pd in enumerate(platforms):
             name   = pd["platform"]
-            used   = self.db.get_platform_sales_count(name, year)
-            remain = max(PLATFORM_LIMIT - used, 0)
+            used   = db.get_platform_sales_count(name, year)
+            remain = max(plim - used, 0)
             rev_p  = pd["rev"]
             profit_p = pd["profit"]
-            pct_p  = min(int(used / PLATFORM_LIMIT * 100), 100)
+            pct_p  = min(int(used / plim * 100), 100) if plim > 0 else 0
 
-            plat_data.append((name, used, PLATFORM_LIMIT, rev_p, profit_p))
+            plat_data.append((name, used, plim, rev_p, profit_p))
 
             vals = [name, str(used), str(remain),
                     f"{rev_p:,.2f}", f"{profit_p:,.2f}", f"{pct_p}%"]
@@ -1272,8 +3490,9 @@ class DashboardWidget(QWidget):
 class ProductsWidget(QWidget):
     def __init__(self, db, config, parent=None):
         super().__init__(parent)
-        self.db     = db
-        self.config = config
+        self.db       = db
+        self.config   = config
+        self._version = None
         self._build()
         self.refresh()
 
@@ -1296,32 +3515,34 @@ class ProductsWidget(QWidget):
 
         self.tbl = SortableTable(0,5)
         self.tbl.setHorizontalHeaderLabels(["ID","SKU","Nazwa","Stan",""])
-        hdr = self.tbl.horizontalHeader()
-        for i,m in enumerate([QHeaderView.ResizeToContents, QHeaderView.ResizeToContents,
-                               QHeaderView.Stretch, QHeaderView.ResizeToContents,
-                               QHeaderView.ResizeToContents]):
-            hdr.setSectionResizeMode(i,m)
+        self.tbl.fit_columns(2)
+        self.tbl.cellClicked.connect(lambda r, c: c == 4 and self._quick_del(int(self.tbl.item(r,0).text())))
         v.addWidget(self.tbl)
 
-        self.status = QLabel()
-        self.status.setStyleSheet(f"color:{T()['text3']};font-size:11px;")
+        self.status = styled(QLabel(), "hint")
         v.addWidget(self.status)
 
+    def refresh_if_changed(self):
+        if view_version(self.db) == self._version: return False
+        self.refresh(); return True
+
     def refresh(self):
+        self._version = view_version(self.db)
         t = T()
         prods = self.db.list_products()
         self.tbl.setRowCount(len(prods))
         for i, p in enumerate(prods):
-            for j, val in enumerate([p["id"],p["sku"],p["title"],p["stock"]]):
+            for j, val in enumerate(p):
                 item = QTableWidgetItem(str(val))
                 if j in [0,3]: item.setTextAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-                if j == 3 and p["stock"] == 0:
+                if j == 3 and p.stock == 0:
                     item.setForeground(QColor(t["danger"]))
                 self.tbl.setItem(i,j,item)
-            xb = QPushButton("✕"); xb.setFixedSize(26,26)
-            xb.setStyleSheet(f"background:{t['bg2']};color:{t['text3']};border-radius:4px;padding:0;font-size:11px;")
-            xb.clicked.connect(lambda _, pid=p["id"]: self._quick_del(pid))
-            self.tbl.setCellWidget(i,4,xb)
+            # ✕ jako komórka, nie przycisk w każdym wierszu – tysiące widżetów spowalniały
+            # przebudowę tabeli i każde przełączenie motywu (polish każdego widżetu)
+            xb = QTableWidgetItem("✕"); xb.setTextAlignment(Qt.AlignCenter); xb.setToolTip("Usuń produkt")
+            self.tbl.setItem(i,4,xb)
+        self.tbl.fit_columns()
         self._filter(self.search.text())
         self.status.setText(f"Produktów: {len(prods)}")
 
@@ -1341,7 +3562,7 @@ class ProductsWidget(QWidget):
         pid = int(self.tbl.item(row,0).text())
         p   = self.db.get_product_info(pid)
         if p:
-            if ProductDialog(self.db, dict(p), parent=self).exec(): self.refresh()
+            if ProductDialog(self.db, p, parent=self).exec(): self.refresh()
 
     def _delete(self):
         row = self.tbl.currentRow()
@@ -1353,12 +3574,190 @@ class ProductsWidget(QWidget):
         if not p: return
         if QMessageBox.question(self,"Usuń",f"Usunąć: {p['sku']} – {p['title']}?",
                                 QMessageBox.Yes|QMessageBox.No) == QMessageBox.Yes:
-            if not self.db.delete_product(pid):
+            try: ok = self.db.delete_product(pid)
+            except ValueError as e: QMessageBox.warning(self,"Okres zamknięty",str(e)); return
+            if not ok:
                 QMessageBox.warning(self,"Błąd","Nie można usunąć produktu z dodatnim stanem.")
             else: self.refresh()
 
     def _inventory(self):
-        InventoryDialog(self.db,self).exec(); self.refresh()
+        InventoryDialog(self.db,self).exec(); self.refresh_if_changed()
+
+
+class _NumItem(QTableWidgetItem):
+    """Komórka sortowana po wartości liczbowej (None na końcu), nie po tekście"""
+    def __init__(self, value, text=None):
+        super().__init__(text if text is not None else f"{value:,.2f}" if isinstance(value, float) else str(value))
+        self.value = value
+        self.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+
+    def __lt__(self, other):
+        a, b = self.value, getattr(other, "value", None)
+        if a is None or b is None: return a is not None and b is None
+        return a < b
+
+
+class ReorderWidget(QWidget):
+    """Propozycje zamówień (ReorderForecast) z ustawieniami czasu dostawy i okresu pokrycia"""
+    COLS = ["SKU", "Nazwa", "Stan", "Prognoza / dzień", "Popyt w czasie dostawy", "Punkt zamówienia",
+            "Zamówić (szt.)", "Data zamówienia", "Brak towaru za (dni)"]
+    LEVELS = [0.9, 0.95, 0.98, 0.99]
+
+    def __init__(self, db, config, parent=None):
+        super().__init__(parent)
+        self.db       = db
+        self.config   = config
+        self._version = None
+        self._build()
+        self.refresh()
+
+    def _build(self):
+        v = QVBoxLayout(self)
+        v.setContentsMargins(12,12,12,12)
+        v.setSpacing(8)
+
+        opt = self.config.get_reorder()
+        tb  = QHBoxLayout()
+        self.lead_sp  = QSpinBox(); self.lead_sp.setRange(1, 180);  self.lead_sp.setValue(int(opt["lead_days"]))
+        self.cover_sp = QSpinBox(); self.cover_sp.setRange(1, 365); self.cover_sp.setValue(int(opt["cover_days"]))
+        self.level_cb = QComboBox()
+        for lv in self.LEVELS: self.level_cb.addItem(f"{lv:.0%}", lv)
+        self.level_cb.setCurrentIndex(self.LEVELS.index(opt["service_level"]) if opt["service_level"] in self.LEVELS else 1)
+        for lbl, w in [("Czas dostawy (dni):", self.lead_sp), ("Zapas na (dni):", self.cover_sp),
+                       ("Poziom obsługi:", self.level_cb)]:
+            tb.addWidget(QLabel(lbl)); tb.addWidget(w); tb.addSpacing(12)
+        self.lead_sp.valueChanged.connect(self._save_opts); self.cover_sp.valueChanged.connect(self._save_opts)
+        self.level_cb.currentIndexChanged.connect(self._save_opts)
+        self.cb_now = QCheckBox("Tylko do zamówienia w czasie dostawy")
+        self.cb_now.toggled.connect(lambda _: self._filter())
+        tb.addWidget(self.cb_now); tb.addStretch()
+        v.addLayout(tb)
+
+        self.tbl = SortableTable(0, len(self.COLS))
+        self.tbl.setHorizontalHeaderLabels(self.COLS)
+        self.tbl.fit_columns(1)
+        v.addWidget(self.tbl)
+
+        self.status = styled(QLabel(), "hint")
+        v.addWidget(self.status)
+
+    def _save_opts(self):
+        self.config.update_reorder({"lead_days": self.lead_sp.value(), "cover_days": self.cover_sp.value(),
+                                    "service_level": self.level_cb.currentData()})
+        self.refresh()
+
+    def refresh_if_changed(self):
+        if view_version(self.db) == self._version: return False
+        self.refresh(); return True
+
+    def refresh(self):
+        self._version = view_version(self.db)
+        t  = T()
+        t0 = time.perf_counter()
+        try:
+            rows = ReorderForecast(self.db, self.config).compute()
+        except ImportError as e:
+            self.tbl.setRowCount(0); self.status.setText(str(e)); return
+        ms    = (time.perf_counter() - t0) * 1000
+        today = datetime.now().strftime("%Y-%m-%d")
+        soon  = (datetime.now() + timedelta(days=self.lead_sp.value())).strftime("%Y-%m-%d")
+        self.tbl.setUpdatesEnabled(False)
+        self.tbl.setRowCount(len(rows))
+        for i, r in enumerate(rows):
+            so = r["stockout_days"]
+            items = [QTableWidgetItem(r["sku"]), QTableWidgetItem(r["title"]), _NumItem(r["stock"]),
+                     _NumItem(r["daily"], f"{r['daily']:.2f}"), _NumItem(r["lead_demand"], f"{r['lead_demand']:.1f}"),
+                     _NumItem(r["reorder_point"], f"{r['reorder_point']:.1f}"), _NumItem(r["order_qty"]),
+                     QTableWidgetItem(r["reorder_date"] or "–"), _NumItem(so, "–" if so is None else None)]
+            due = r["reorder_date"] is not None and r["reorder_date"] <= soon
+            items[0].due = due
+            color = t["danger"] if r["reorder_date"] == today else t["warning"] if due else None
+            for j, item in enumerate(items):
+                if color: item.setForeground(QColor(color))
+                self.tbl.setItem(i, j, item)
+        self.tbl.setUpdatesEnabled(True); self.tbl.fit_columns()
+        now = sum(r["reorder_date"] == today for r in rows)
+        self.status.setText(f"SKU z prognozą: {len(rows)}  |  do zamówienia dziś: {now}, "
+                            f"w czasie dostawy: {sum(1 for r in rows if r['reorder_date'] and r['reorder_date'] <= soon)}"
+                            f"  |  prognoza policzona w {ms:.0f} ms")
+        self._filter()
+
+    def _filter(self):
+        only = self.cb_now.isChecked()
+        for r in range(self.tbl.rowCount()):
+            self.tbl.setRowHidden(r, only and not self.tbl.item(r, 0).due)
+
+
+class VelocityWidget(QWidget):
+    """Rotacja towaru: tempo sprzedaży, dni zapasu, wiek partii i zamrożony kapitał (DB.get_sku_velocity)"""
+    COLS = ["SKU", "Nazwa", "Stan", "30 dni", "90 dni", "365 dni", "Dni zapasu", "Najstarsza partia (dni)", "Kapitał PLN"]
+
+    def __init__(self, db, config, parent=None):
+        super().__init__(parent)
+        self.db       = db
+        self.config   = config
+        self._version = None
+        self._build()
+        self.refresh()
+
+    def _build(self):
+        v = QVBoxLayout(self)
+        v.setContentsMargins(12,12,12,12)
+        v.setSpacing(8)
+
+        tb = QHBoxLayout()
+        self.cb_dead = QCheckBox(f"Tylko zalegające (bez sprzedaży {DB.DEAD_STOCK_DAYS} dni)")
+        self.cb_dead.toggled.connect(lambda _: self._filter())
+        tb.addWidget(self.cb_dead); tb.addStretch()
+        self.search = QLineEdit(); self.search.setPlaceholderText("🔍 Szukaj...")
+        self.search.setFixedWidth(220); self.search.textChanged.connect(lambda _: self._filter())
+        tb.addWidget(self.search)
+        v.addLayout(tb)
+
+        self.tbl = SortableTable(0, len(self.COLS))
+        self.tbl.setHorizontalHeaderLabels(self.COLS)
+        self.tbl.fit_columns(1)
+        v.addWidget(self.tbl)
+
+        self.status = styled(QLabel(), "hint")
+        v.addWidget(self.status)
+
+    def refresh_if_changed(self):
+        if view_version(self.db) == self._version: return False
+        self.refresh(); return True
+
+    def refresh(self):
+        self._version = view_version(self.db)
+        t = T()
+        with self.db.snapshot() as db: self._rows = db.get_sku_velocity()
+        self.tbl.setUpdatesEnabled(False)
+        self.tbl.setRowCount(len(self._rows))
+        for i, r in enumerate(self._rows):
+            doi = r["days_of_inventory"]
+            items = [QTableWidgetItem(r["sku"]), QTableWidgetItem(r["title"]),
+                     _NumItem(r["stock"]), _NumItem(r["sold_30"]), _NumItem(r["sold_90"]), _NumItem(r["sold_365"]),
+                     _NumItem(doi, "∞" if doi is None and r["stock"] > 0 else "" if doi is None else f"{doi:.0f}"),
+                     _NumItem(r["oldest_lot_days"], "" if r["oldest_lot_days"] is None else None),
+                     _NumItem(r["capital"])]
+            items[0].dead = r["dead"]   # filtr działa też po sortowaniu tabeli
+            for j, item in enumerate(items):
+                if r["dead"]: item.setForeground(QColor(t["danger"]))
+                self.tbl.setItem(i, j, item)
+        self.tbl.setUpdatesEnabled(True); self.tbl.fit_columns()
+        dead = [r for r in self._rows if r["dead"]]
+        self.status.setText(
+            f"Produktów: {len(self._rows)}  |  zalegające: {len(dead)}, kapitał {sum(r['capital'] for r in dead):,.2f} PLN"
+            f"  |  kapitał w magazynie: {sum(r['capital'] for r in self._rows):,.2f} PLN")
+        self._filter()
+
+    def _filter(self):
+        text, dead = self.search.text().lower(), self.cb_dead.isChecked()
+        for r in range(self.tbl.rowCount()):
+            it = self.tbl.item(r, 0)
+            hide = dead and not it.dead
+            if not hide and text:
+                hide = text not in it.text().lower() and text not in self.tbl.item(r, 1).text().lower()
+            self.tbl.setRowHidden(r, hide)
 
 
 # ─────────────────────────────────────────────────────────
@@ -1371,8 +3770,7 @@ class ProductDialog(QDialog):
         self.setWindowTitle("Edytuj produkt" if product else "Nowy produkt")
         self.setFixedSize(420,260)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("📦  " + ("Edytuj produkt" if product else "Dodaj nowy produkt"),
-                           styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("📦  " + ("Edytuj produkt" if product else "Dodaj nowy produkt")), "title"))
         v.addWidget(Separator(self))
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
         self.sku   = QLineEdit(product["sku"] if product else ""); self.sku.setPlaceholderText("np. PROD-001")
@@ -1408,13 +3806,13 @@ class PurchaseDialog(QDialog):
         super().__init__(parent)
         self.db = db; self.setWindowTitle("Nowy zakup"); self.resize(620,480)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("📦  Rejestruj zakup", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("📦  Rejestruj zakup"), "title"))
         v.addWidget(Separator(self))
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
         self.cost = QDoubleSpinBox(); self.cost.setMaximum(1_000_000); self.cost.setDecimals(2); self.cost.setSuffix(" PLN")
         self.date_e = QDateEdit(QDate.currentDate()); self.date_e.setCalendarPopup(True)
         form.addRow("Koszt łączny:",self.cost); form.addRow("Data:",self.date_e); v.addLayout(form)
-        v.addWidget(QLabel("Pozycje zamówienia", styleSheet=f"color:{T()['text3']};font-size:11px;font-weight:600;"))
+        v.addWidget(styled(QLabel("Pozycje zamówienia"), "section"))
         self.items_tbl = SortableTable(0,2)
         self.items_tbl.setHorizontalHeaderLabels(["Produkt","Ilość"])
         self.items_tbl.horizontalHeader().setSectionResizeMode(0,QHeaderView.Stretch)
@@ -1447,8 +3845,11 @@ class PurchaseDialog(QDialog):
                  for r in range(self.items_tbl.rowCount())
                  if self.items_tbl.cellWidget(r,0) and self.items_tbl.cellWidget(r,1)]
         if not items: QMessageBox.warning(self,"Błąd","Dodaj przynajmniej jedną pozycję."); return
+        date = self.date_e.date().toString("yyyy-MM-dd")
+        if date <= self.db.closed_until():
+            QMessageBox.warning(self,"Okres zamknięty",f"Lata do {self.db.closed_until()} są zamknięte – zmień datę."); return
         self.result_items = items; self.result_cost = self.cost.value()
-        self.result_date  = self.date_e.date().toString("yyyy-MM-dd")
+        self.result_date  = date
         self.accept()
 
 
@@ -1462,7 +3863,7 @@ class SaleDialog(QDialog):
 
     def _build(self):
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("💰  Rejestruj sprzedaż", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("💰  Rejestruj sprzedaż"), "title"))
         v.addWidget(Separator(self))
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
         self.platform = QComboBox(); self.platform.addItems(PLATFORMS)
@@ -1474,16 +3875,24 @@ class SaleDialog(QDialog):
         form.addRow("Cena sprzedaży:",self.pln)
         self.date_e = QDateEdit(QDate.currentDate()); self.date_e.setCalendarPopup(True)
         form.addRow("Data:",self.date_e)
-        self.fifo_lbl = QLabel("Koszt FIFO: 0.00 PLN"); self.fifo_lbl.setStyleSheet(f"color:{T()['accent']};font-weight:700;")
+        self.fifo_lbl = styled(QLabel("Koszt FIFO: 0.00 PLN"), "accent")
         form.addRow("",self.fifo_lbl)
 
         # ostrzeżenie limitu
-        self.limit_warn = QLabel("")
-        self.limit_warn.setStyleSheet(f"color:{T()['danger']};font-weight:700;font-size:11px;")
+        self.limit_warn = styled(QLabel(""), "alert", "danger")
         form.addRow("",self.limit_warn)
         self.platform.currentTextChanged.connect(self._check_limit)
+        self.date_e.dateChanged.connect(lambda _: self._check_limit(self.platform.currentText()))
         self._check_limit(self.platform.currentText())
 
+        # limit przychodu w okresie (kwartał / miesiąc) – liczony na bieżąco z ceną i datą
+        self.rev_limit = RevenueLimit(self.db, self.config)
+        self.rev_warn  = styled(QLabel(""), "alert"); self.rev_warn.setWordWrap(True)
+        form.addRow("",self.rev_warn)
+        self.pln.valueChanged.connect(self._check_revenue)
+        self.date_e.dateChanged.connect(self._check_revenue)
+        self._check_revenue()
+
         v.addLayout(form)
         self.inv_cb = QCheckBox("Wygeneruj rachunek PDF"); v.addWidget(self.inv_cb)
         self.inv_cb.stateChanged.connect(self._toggle_inv)
@@ -1493,7 +3902,7 @@ class SaleDialog(QDialog):
         self.client_addr = QLineEdit(); self.client_addr.setPlaceholderText("Adres")
         cl.addRow("Nabywca:",self.client_name); cl.addRow("Adres:",self.client_addr)
         self.client_grp.setLayout(cl); v.addWidget(self.client_grp)
-        v.addWidget(QLabel("Pozycje sprzedaży", styleSheet=f"color:{T()['text3']};font-size:11px;font-weight:600;"))
+        v.addWidget(styled(QLabel("Pozycje sprzedaży"), "section"))
         self.items_tbl = SortableTable(0,2); self.items_tbl.setHorizontalHeaderLabels(["Produkt","Ilość"])
         self.items_tbl.horizontalHeader().setSectionResizeMode(0,QHeaderView.Stretch)
         self.items_tbl.horizontalHeader().setSectionResizeMode(1,QHeaderView.Fixed)
@@ -1516,16 +3925,33 @@ class SaleDialog(QDialog):
 
     def _check_limit(self, platform_txt):
         if platform_txt == "Inne": platform_txt = "Inne"
-        used = self.db.get_platform_sales_count(platform_txt)
-        remaining = PLATFORM_LIMIT - used
+        year  = self.date_e.date().year()
+        limit = self.config.get_platform_limit(year)
+        used  = self.db.get_platform_sales_count(platform_txt, year)
+        remaining = limit - used
         if remaining <= 0:
-            self.limit_warn.setText(f"⛔  LIMIT {PLATFORM_LIMIT} SPRZEDAŻY NA PLATFORMIE OSIĄGNIĘTY!")
+            self.limit_warn.setText(f"⛔  LIMIT {limit} SPRZEDAŻY NA PLATFORMIE W {year} OSIĄGNIĘTY!")
+            set_tone(self.limit_warn, "danger")
         elif remaining <= 5:
-            self.limit_warn.setText(f"⚠️  Pozostało tylko {remaining} sprzedaży z {PLATFORM_LIMIT} na tej platformie!")
-            self.limit_warn.setStyleSheet(f"color:{T()['warning']};font-weight:700;font-size:11px;")
+            self.limit_warn.setText(f"⚠️  Pozostało tylko {remaining} sprzedaży z {limit} na tej platformie!")
+            set_tone(self.limit_warn, "warning")
         else:
-            self.limit_warn.setText(f"✓  Wykorzystano: {used}/{PLATFORM_LIMIT}  (pozostało: {remaining})")
-            self.limit_warn.setStyleSheet(f"color:{T()['success']};font-size:11px;")
+            self.limit_warn.setText(f"✓  Wykorzystano: {used}/{limit}  (pozostało: {remaining})")
+            set_tone(self.limit_warn, "success")
+
+    def _check_revenue(self, *_):
+        st = self.rev_limit.status(self.date_e.date().toString("yyyy-MM-dd"), self.pln.value())
+        txt = f"{st['label']}: {st['after']:,.2f} / {st['limit']:,.2f} PLN po tej sprzedaży ({st['pct_after']:.0f}%)"
+        if st["over"]:
+            self.rev_warn.setText(f"⛔  Sprzedaż przekroczy limit przychodu! {txt}")
+            set_tone(self.rev_warn, "danger")
+        elif st["warn"]:
+            self.rev_warn.setText(f"⚠️  Zbliżasz się do limitu przychodu. {txt}")
+            set_tone(self.rev_warn, "warning")
+        else:
+            self.rev_warn.setText(f"✓  {txt}")
+            set_tone(self.rev_warn, "muted")
+        return st
 
     def _toggle_inv(self, state): self.client_grp.setVisible(bool(state))
 
@@ -1564,14 +3990,25 @@ class SaleDialog(QDialog):
     def _do_save(self, with_invoice):
         items = self._get_items()
         if not items: QMessageBox.warning(self,"Błąd","Dodaj przynajmniej jedną pozycję."); return
-        for pid, qty in items:
+        want = collections.Counter()
+        for pid, qty in items: want[pid] += qty
+        for pid, qty in want.items():
             if not self.db.check_stock(pid,qty):
                 QMessageBox.warning(self,"Brak towaru",f"Niewystarczający stan produktu ID {pid}."); return
         self._update_fifo()
+        st = self._check_revenue()
+        if st["over"] and QMessageBox.question(self, "Limit przychodu",
+                f"Ta sprzedaż przekroczy {st['label'].lower()} ({st['limit']:,.2f} PLN):\n"
+                f"przychód w okresie {st['used']:,.2f} → {st['after']:,.2f} PLN.\n\n"
+                "Przekroczenie limitu oznacza obowiązek rejestracji działalności.\nZapisać mimo to?",
+                QMessageBox.Yes|QMessageBox.No) != QMessageBox.Yes: return
         pln  = self.pln.value()
         date = self.date_e.date().toString("yyyy-MM-dd")
         eur  = pln / get_eur_rate(date)
-        sale_id = self.db.add_sale_order(self._plat_name(),pln,eur,items,self._fifo,date)
+        inv  = {"prefix": self.config.get("invoice_prefix","R"), "customer_name": self.client_name.text(),
+                "customer_address": self.client_addr.text()} if with_invoice else None
+        try: sale_id = self.db.add_sale_order(self._plat_name(),pln,eur,items,self._fifo,date,invoice=inv)
+        except ValueError as e: QMessageBox.warning(self,"Nie zapisano",str(e)); return
         if with_invoice:
             try: self._gen_invoice(sale_id,items,pln,date)
             except Exception as e:
@@ -1600,7 +4037,8 @@ class SaleDialog(QDialog):
 
         biz    = self.config.get_business_info()
         cfg    = self.config.get_invoice_config()
-        inv_no = self.config.get_next_invoice_number()
+        inv    = self.db.get_sale_invoice(sale_id)
+        inv_no = inv["invoice_number"]
         pdf_dir = os.path.join(os.getcwd(),"rachunki")
         os.makedirs(pdf_dir,exist_ok=True)
         path = os.path.join(pdf_dir,f"rachunek_{inv_no.replace('/','_')}.pdf")
@@ -1642,7 +4080,7 @@ class SaleDialog(QDialog):
         if cfg.get("footer_text"):
             story.append(Paragraph(cfg["footer_text"],ps("F",fontSize=9,alignment=1)))
         doc.build(story)
-        self.db.add_invoice(inv_no,sale_id,path,self.client_name.text(),self.client_addr.text(),total_pln)
+        self.db.set_invoice_file(inv["id"],path)
 
         if QMessageBox.question(self,"Rachunek",f"Rachunek {inv_no} zapisany.\nCzy otworzyć PDF?",
                                 QMessageBox.Yes|QMessageBox.No) == QMessageBox.Yes:
@@ -1653,10 +4091,12 @@ class SaleDialog(QDialog):
 
 
 class HistoryDialog(QDialog):
-    def __init__(self, title, headers, rows, delete_cb, parent=None):
+    """rows – lista rekordów (Sale, PurchaseLot, …), cells(r) – wartości kolumn wiersza; tabela
+    powstaje wprost z rekordów, bez drugiej listy sformatowanych krotek"""
+    def __init__(self, title, headers, rows, delete_cb, parent=None, cells=tuple):
         super().__init__(parent)
         self.setWindowTitle(title); self.resize(1000,550)
-        self.rows = rows; self.delete_cb = delete_cb
+        self.delete_cb = delete_cb; self.cells = cells
         v = QVBoxLayout(self); v.setSpacing(8)
         row = QHBoxLayout()
         self.search = QLineEdit(); self.search.setPlaceholderText("🔍  Szukaj...")
@@ -1676,7 +4116,7 @@ class HistoryDialog(QDialog):
     def _load(self, rows):
         self.tbl.setRowCount(len(rows))
         for i, r in enumerate(rows):
-            for j, val in enumerate(r):
+            for j, val in enumerate(self.cells(r)):
                 item = QTableWidgetItem(str(val) if val is not None else "")
                 if isinstance(val,(int,float)): item.setTextAlignment(Qt.AlignRight|Qt.AlignVCenter)
                 self.tbl.setItem(i,j,item)
@@ -1692,7 +4132,9 @@ class HistoryDialog(QDialog):
         if row < 0: QMessageBox.warning(self,"Brak wyboru","Kliknij wiersz."); return
         oid = int(self.tbl.item(row,0).text())
         if QMessageBox.question(self,"Usuń","Usunąć ten wpis?",QMessageBox.Yes|QMessageBox.No)==QMessageBox.Yes:
-            self.delete_cb(oid); self.accept()
+            try: self.delete_cb(oid)
+            except ValueError as e: QMessageBox.warning(self,"Nie można usunąć",str(e)); return
+            self.accept()
 
 
 class InventoryDialog(QDialog):
@@ -1701,7 +4143,7 @@ class InventoryDialog(QDialog):
         self.db = db; self.setWindowTitle("Inwentaryzacja"); self.resize(700,450)
         v = QVBoxLayout(self)
         info = QLabel("Zmień wartości w kolumnie 'Stan rzeczywisty' i kliknij Zapisz.")
-        info.setStyleSheet(f"color:{T()['text3']};font-size:11px;"); v.addWidget(info)
+        styled(info, "hint"); v.addWidget(info)
         self.tbl = QTableWidget(0,5)
         self.tbl.setHorizontalHeaderLabels(["ID","SKU","Nazwa","Stan sys.","Stan rzecz."])
         self.tbl.horizontalHeader().setSectionResizeMode(2,QHeaderView.Stretch)
@@ -1715,19 +4157,19 @@ class InventoryDialog(QDialog):
     def _load(self):
         prods = self.db.list_products(); self.tbl.setRowCount(len(prods))
         for i, p in enumerate(prods):
-            for j, val in enumerate([p["id"],p["sku"],p["title"],p["stock"]]):
+            for j, val in enumerate(p):
                 item = QTableWidgetItem(str(val)); item.setFlags(item.flags()&~Qt.ItemIsEditable)
                 self.tbl.setItem(i,j,item)
-            self.tbl.setItem(i,4,QTableWidgetItem(str(p["stock"])))
+            self.tbl.setItem(i,4,QTableWidgetItem(str(p.stock)))
 
     def _apply(self):
-        ch = 0
+        corr = []
         for r in range(self.tbl.rowCount()):
             pid = int(self.tbl.item(r,0).text()); sys_s = int(self.tbl.item(r,3).text())
             try: real_s = int(self.tbl.item(r,4).text())
             except: continue
-            delta = real_s - sys_s
-            if delta != 0: self.db.update_stock(pid,delta); ch += 1
+            corr.append((pid,real_s-sys_s))
+        ch = self.db.apply_stock_corrections(corr)
         QMessageBox.information(self,"OK",f"Zapisano korekty dla {ch} produktów."); self.accept()
 
 
@@ -1764,15 +4206,15 @@ class InvoicesDialog(QDialog):
         df = self.df.date().toString("yyyy-MM-dd"); dt = self.dt.date().toString("yyyy-MM-dd")
         invs = self.db.list_invoices(df,dt); self.tbl.setRowCount(len(invs))
         for i, inv in enumerate(invs):
-            vals = [inv["id"],inv["invoice_number"],inv.get("platform","—"),
-                    inv["customer_name"] or "—",f"{inv['total_amount']:.2f} PLN",
-                    inv["issue_date"],os.path.basename(inv["file_path"] or ""),""]
+            vals = [inv.id,inv.invoice_number,inv.platform or "—",
+                    inv.customer_name or "—",f"{inv.total_amount:.2f} PLN",
+                    inv.issue_date,os.path.basename(inv.file_path or ""),""]
             for j, v2 in enumerate(vals):
                 item = QTableWidgetItem(str(v2))
                 if "PLN" in str(v2): item.setTextAlignment(Qt.AlignRight|Qt.AlignVCenter)
                 self.tbl.setItem(i,j,item)
             ob = QPushButton("📂 Otwórz"); ob.setFixedHeight(26)
-            fp = inv["file_path"]
+            fp = inv.file_path
             ob.clicked.connect(lambda _,f=fp: self._open(f))
             self.tbl.setCellWidget(i,7,ob)
 
@@ -1795,11 +4237,31 @@ class InvoicesDialog(QDialog):
         if row < 0: QMessageBox.warning(self,"Brak wyboru","Kliknij wiersz."); return
         iid = int(self.tbl.item(row,0).text())
         if QMessageBox.question(self,"Usuń","Usunąć rachunek?",QMessageBox.Yes|QMessageBox.No)==QMessageBox.Yes:
-            self.db.delete_invoice(iid); self._load()
+            try: self.db.delete_invoice(iid)
+            except ValueError as e: QMessageBox.warning(self,"Nie można usunąć",str(e)); return
+            self._load()
 
     def _reset(self):
         if QMessageBox.question(self,"Reset","Resetować licznik numeracji?",QMessageBox.Yes|QMessageBox.No)==QMessageBox.Yes:
-            self.config.reset_invoice_counter(); QMessageBox.information(self,"OK","Licznik zresetowany.")
+            try: self.db.reset_invoice_sequence(self.config.get("invoice_prefix","R"))
+            except ValueError as e: QMessageBox.warning(self,"Okres zamknięty",str(e)); return
+            QMessageBox.information(self,"OK","Licznik zresetowany.")
+
+
+class ReportDataset:
+    """Dane raportu za okres – liczone raz (agregaty i złączenie pozycji w SQL, jedna migawka)
+    i wspólne dla generatorów CSV, XLSX i PDF"""
+    def __init__(self, db, df, dt, sales=True, purchases=False, valuation=False, skus=False):
+        self.df, self.dt = df, dt
+        with db.snapshot() as r:
+            t = r.get_sales_totals(df, dt)
+            self.orders    = r.get_report_orders(df, dt) if sales else []
+            # zakupy tylko z okresu raportu; lista, bo dane są wspólne dla kilku formatów
+            self.purchases = r.list_purchases(df, dt) if purchases else []
+            self.valuation = r.inventory_valuation(dt) if valuation else None
+            self.skus      = r.get_sku_profitability(df, dt) if skus else []
+        self.count, self.revenue, self.cost = t["count"], t["revenue"], t["cost"]
+        self.profit = self.revenue - self.cost
 
 
 class ReportDialog(QDialog):
@@ -1809,6 +4271,7 @@ class ReportDialog(QDialog):
     def __init__(self, db, config, parent=None, report_type="monthly"):
         super().__init__(parent)
         self.db = db; self.config = config; self.report_type = report_type
+        self._datasets = {}   # (zakres, zawartość, wersja danych) -> ReportDataset
         titles = {"monthly": "Raport miesięczny", "quarterly": "Raport kwartalny",
                   "yearly": "Raport roczny", "custom": "Raport za okres"}
         self.setWindowTitle(titles.get(report_type, "Raport"))
@@ -1817,8 +4280,7 @@ class ReportDialog(QDialog):
 
     def _build_ui(self):
         v = QVBoxLayout(self); v.setSpacing(12)
-        v.addWidget(QLabel(f"📊  {self.windowTitle()}",
-                           styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel(f"📊  {self.windowTitle()}"), "title"))
         v.addWidget(Separator(self))
 
         # ── zakres ──
@@ -1863,10 +4325,12 @@ class ReportDialog(QDialog):
         self.cb_sales     = QCheckBox("Sprzedaz (szczegolowa ewidencja)"); self.cb_sales.setChecked(True)
         self.cb_purchases = QCheckBox("Zakupy")
         self.cb_summary   = QCheckBox("Podsumowanie finansowe (przychod / zysk / koszty)"); self.cb_summary.setChecked(True)
+        self.cb_valuation = QCheckBox("Wycena magazynu FIFO na koniec okresu")
+        self.cb_skus      = QCheckBox("Rentownosc SKU (sztuki, przychod, koszt, marza)")
         self.cb_us        = QCheckBox("Dane podatkowe US – imie, nazwisko, adres, PESEL, analiza limitu")
         self.cb_us.setChecked(True)   # domyślnie włączone
-        self.cb_us.setStyleSheet(f"color:{T()['accent']};font-weight:600;")
-        for cb in [self.cb_sales, self.cb_purchases, self.cb_summary, self.cb_us]:
+        styled(self.cb_us, "accent")
+        for cb in [self.cb_sales, self.cb_purchases, self.cb_summary, self.cb_valuation, self.cb_skus, self.cb_us]:
             ol.addWidget(cb)
         og.setLayout(ol); v.addWidget(og)
 
@@ -1874,12 +4338,11 @@ class ReportDialog(QDialog):
         biz = self.config.get_business_info()
         if biz.get("name") and biz.get("pesel"):
             biz_status = f"✅  Dane osobowe: {biz['name']}  |  PESEL: {biz['pesel']}"
-            biz_color  = T()["success"]
+            biz_tone   = "success"
         else:
             biz_status = "⚠️  Brak danych osobowych – uzupełnij w Konfiguracja → Dane osobiste"
-            biz_color  = T()["warning"]
-        biz_lbl = QLabel(biz_status)
-        biz_lbl.setStyleSheet(f"color:{biz_color};font-size:11px;font-weight:600;")
+            biz_tone   = "warning"
+        biz_lbl = styled(QLabel(biz_status), "section", biz_tone)
         biz_lbl.setWordWrap(True)
         v.addWidget(biz_lbl)
 
@@ -1889,14 +4352,14 @@ class ReportDialog(QDialog):
             f"Limit miesieczny: {wage*0.75:.2f} PLN  |  "
             f"Limit kwartalny: {wage*self.config.get_quarterly_multiplier():.2f} PLN  "
             f"(min. wynagrodzenie: {wage:.2f} PLN)")
-        lim_lbl.setStyleSheet(f"color:{T()['text3']};font-size:11px;")
+        styled(lim_lbl, "hint")
         v.addWidget(lim_lbl)
 
         v.addStretch()
         v.addWidget(Separator(self))
         btns = QHBoxLayout()
         gb = btn("📊 Generuj raport", "success"); gb.clicked.connect(self._generate)
-        ca = btn("Anuluj", "secondary");           ca.clicked.connect(self.reject)
+        ca = btn("Zamknij", "secondary");          ca.clicked.connect(self.reject)
         btns.addWidget(gb); btns.addStretch(); btns.addWidget(ca)
         v.addLayout(btns)
 
@@ -1950,6 +4413,17 @@ class ReportDialog(QDialog):
             label = "Limit miesieczny (75% min. wynagrodzenia)"
         return {"wage": wage, "limit": limit, "label": label, "year": year}
 
+    def dataset(self):
+        """ReportDataset dla bieżącego zakresu i zawartości – budowany raz na czas życia okna
+        (kolejne formaty / ponowny eksport korzystają z gotowych danych, o ile baza się nie zmieniła)"""
+        df, dt = self._get_range()
+        opts = (self.cb_sales.isChecked(), self.cb_purchases.isChecked(), self.cb_valuation.isChecked(),
+                self.cb_skus.isChecked())
+        key  = (df, dt, opts, self.db.data_version())
+        if key not in self._datasets:
+            self._datasets[key] = ReportDataset(self.db, df, dt, *opts)
+        return self._datasets[key]
+
     # ── generowanie ──────────────────────────────────────
     def _generate(self):
         df, dt = self._get_range()
@@ -1965,12 +4439,13 @@ class ReportDialog(QDialog):
                                               os.path.join(os.getcwd(), suggested), flt)
         if not path: return
         try:
-            if ext == ".csv":   ok = self._gen_csv(path, df, dt)
-            elif ext == ".xlsx": ok = self._gen_xlsx(path, df, dt)
-            else:               ok = self._gen_pdf(path, df, dt)
+            ds = self.dataset()
+            if ext == ".csv":   ok = self._gen_csv(ds, path)
+            elif ext == ".xlsx": ok = self._gen_xlsx(ds, path)
+            else:               ok = self._gen_pdf(ds, path)
             if ok:
+                # okno zostaje otwarte – eksport w innym formacie użyje tych samych danych
                 QMessageBox.information(self, "Sukces", f"Raport zapisany:\n{path}")
-                self.accept()
             else:
                 QMessageBox.warning(self, "Blad", "Nie udalo sie wygenerowac raportu.")
         except Exception as e:
@@ -1979,26 +4454,12 @@ class ReportDialog(QDialog):
     # ──────────────────────────────────────────────────────
     #  CSV
     # ──────────────────────────────────────────────────────
-    def _gen_csv(self, path, df, dt):
+    def _gen_csv(self, ds, path):
+        df, dt = ds.df, ds.dt
         biz   = self._get_biz()
         linfo = self._get_limit_info(df)
-        sales = self.db.get_detailed_sales(df, dt) if self.cb_sales.isChecked() else []
-        purch = self.db.list_purchases()            if self.cb_purchases.isChecked() else []
-
-        # grupuj sprzedaż po zamówieniu
-        orders = {}
-        for s in sales:
-            oid = s["order_id"]
-            if oid not in orders:
-                orders[oid] = {"date": s["date"], "platform": s["platform"],
-                               "pln": s["order_total_pln"], "cost": s["order_total_cost"],
-                               "products": []}
-            orders[oid]["products"].append(f"{s['sku']} x{s['qty']}")
-        order_list = list(orders.values())
-
-        total_rev    = sum(o["pln"]  for o in order_list)
-        total_cost   = sum(o["cost"] for o in order_list)
-        total_profit = total_rev - total_cost
+        purch, order_list = ds.purchases, ds.orders
+        total_rev, total_cost, total_profit = ds.revenue, ds.cost, ds.profit
 
         with open(path, "w", newline="", encoding="utf-8-sig") as f:
             w = csv.writer(f, delimiter=";")
@@ -2025,7 +4486,7 @@ class ReportDialog(QDialog):
                 w.writerow(["Przychod calkowity PLN:", f"{total_rev:.2f}"])
                 w.writerow(["Koszt zakupow PLN:",      f"{total_cost:.2f}"])
                 w.writerow(["Zysk netto PLN:",         f"{total_profit:.2f}"])
-                w.writerow(["Liczba transakcji:",       len(order_list)])
+                w.writerow(["Liczba transakcji:",       ds.count])
                 w.writerow([])
 
             # analiza limitu US
@@ -2047,7 +4508,7 @@ class ReportDialog(QDialog):
                 w.writerow(["Data", "Platforma", "Produkty (SKU x ilosc)", "Przychod PLN",
                             "Koszt PLN", "Zysk netto PLN"])
                 for o in order_list:
-                    w.writerow([o["date"], o["platform"], ", ".join(o["products"]),
+                    w.writerow([o["date"], o["platform"], o["products"],
                                 f"{o['pln']:.2f}", f"{o['cost']:.2f}",
                                 f"{o['pln']-o['cost']:.2f}"])
                 w.writerow([])
@@ -2057,14 +4518,35 @@ class ReportDialog(QDialog):
                 w.writerow(["=== EWIDENCJA ZAKUPOW ==="])
                 w.writerow(["ID", "SKU", "Nazwa", "Ilosc", "Koszt PLN", "Data"])
                 for p in purch:
-                    w.writerow([p["id"], p["sku"], p["title"], p["qty"],
-                                f"{p['total_pln']:.2f}", p["date"]])
+                    w.writerow([p.id, p.sku, p.title, p.qty, f"{p.total_pln:.2f}", p.date])
+                w.writerow([])
+
+            # wycena magazynu
+            if self.cb_valuation.isChecked():
+                val = ds.valuation
+                w.writerow([f"=== WYCENA MAGAZYNU FIFO NA {dt} ==="])
+                w.writerow(["SKU", "Nazwa", "Ilosc", "Partie", "Sr. koszt PLN", "Wartosc PLN", "Stan wg rejestru"])
+                for it in val["items"]:
+                    w.writerow([it["sku"], it["title"], it["qty"], it["lots"], f"{it['avg_cost']:.2f}",
+                                f"{it['value']:.2f}", it["ledger_qty"]])
+                w.writerow(["SUMA", "", val["total_qty"], "", "", f"{val['total_value']:.2f}", ""])
+                w.writerow([])
+
+            # rentowność SKU
+            if self.cb_skus.isChecked():
+                w.writerow(["=== RENTOWNOSC SKU ==="])
+                w.writerow(["SKU", "Nazwa", "Sztuki", "Zamowienia", "Przychod PLN", "Koszt PLN",
+                            "Zysk PLN", "Marza %"])
+                for it in ds.skus:
+                    w.writerow([it["sku"], it["title"], it["units"], it["orders"], f"{it['revenue']:.2f}",
+                                f"{it['cost']:.2f}", f"{it['profit']:.2f}", f"{it['margin']:.1f}"])
         return True
 
     # ──────────────────────────────────────────────────────
     #  XLSX
     # ──────────────────────────────────────────────────────
-    def _gen_xlsx(self, path, df, dt):
+    def _gen_xlsx(self, ds, path):
+        df, dt = ds.df, ds.dt
         if not HAS_EXCEL:
             raise ImportError("Zainstaluj openpyxl:  pip install openpyxl")
         import openpyxl
@@ -2073,23 +4555,8 @@ class ReportDialog(QDialog):
 
         biz   = self._get_biz()
         linfo = self._get_limit_info(df)
-        sales = self.db.get_detailed_sales(df, dt) if self.cb_sales.isChecked() else []
-        purch = self.db.list_purchases()            if self.cb_purchases.isChecked() else []
-
-        # grupuj zamówienia
-        orders = {}
-        for s in sales:
-            oid = s["order_id"]
-            if oid not in orders:
-                orders[oid] = {"date": s["date"], "platform": s["platform"],
-                               "pln": s["order_total_pln"], "cost": s["order_total_cost"],
-                               "products": []}
-            orders[oid]["products"].append(f"{s['sku']} x{s['qty']}")
-        order_list = list(orders.values())
-
-        total_rev    = sum(o["pln"]  for o in order_list)
-        total_cost   = sum(o["cost"] for o in order_list)
-        total_profit = total_rev - total_cost
+        purch, order_list = ds.purchases, ds.orders
+        total_rev, total_cost, total_profit = ds.revenue, ds.cost, ds.profit
 
         wb = openpyxl.Workbook()
 
@@ -2156,7 +4623,7 @@ class ReportDialog(QDialog):
                 ("Przychod calkowity",  total_rev,    GRNG),
                 ("Koszt zakupow",       total_cost,   ORNG),
                 ("Zysk netto",          total_profit, GRNG if total_profit >= 0 else "C62828"),
-                ("Liczba transakcji",   len(order_list), None),
+                ("Liczba transakcji",   ds.count, None),
             ]
             for label, value, color in summary:
                 ws.cell(row=row, column=1, value=label).font = F(name="Calibri", bold=True, size=10)
@@ -2201,7 +4668,7 @@ class ReportDialog(QDialog):
             for oi, o in enumerate(order_list):
                 margin = (o["pln"] - o["cost"]) / o["pln"] * 100 if o["pln"] > 0 else 0
                 fill = hdr_fill("FFFFFF") if oi % 2 == 0 else hdr_fill(GRY)
-                vals = [o["date"], o["platform"], ", ".join(o["products"]),
+                vals = [o["date"], o["platform"], o["products"],
                         o["pln"], o["cost"], o["pln"] - o["cost"], margin / 100]
                 for ci, val in enumerate(vals, 1):
                     c = ws.cell(row=row, column=ci, value=val)
@@ -2237,7 +4704,7 @@ class ReportDialog(QDialog):
                 c.font = F(name="Calibri", bold=True, color=WHT)
                 c.fill = hdr_fill("1565C0"); c.alignment = centered(); c.border = border()
             for ri, p in enumerate(purch, 3):
-                vals = [p["id"], p["sku"], p["title"], p["qty"], p["total_pln"], p["date"]]
+                vals = [p.id, p.sku, p.title, p.qty, p.total_pln, p.date]
                 for ci, val in enumerate(vals, 1):
                     c = ws2.cell(row=ri, column=ci, value=val)
                     c.font = F(name="Calibri", size=9); c.border = border()
@@ -2246,6 +4713,57 @@ class ReportDialog(QDialog):
             for col in ws2.columns:
                 ws2.column_dimensions[get_column_letter(col[0].column)].width = 16
 
+        # arkusz wyceny magazynu
+        if self.cb_valuation.isChecked():
+            val = ds.valuation
+            ws3 = wb.create_sheet("Wycena FIFO"); ws3.sheet_properties.tabColor = "2E7D32"
+            ws3.merge_cells("A1:G1")
+            c = ws3.cell(row=1, column=1, value=f"Wycena magazynu FIFO na {dt}")
+            c.font = F(name="Calibri", bold=True, size=12, color="2E7D32")
+            hdrs3 = ["SKU", "Nazwa", "Ilosc", "Partie", "Sr. koszt PLN", "Wartosc PLN", "Stan wg rejestru"]
+            for ci, h in enumerate(hdrs3, 1):
+                c = ws3.cell(row=2, column=ci, value=h)
+                c.font = F(name="Calibri", bold=True, color=WHT)
+                c.fill = hdr_fill("2E7D32"); c.alignment = centered(); c.border = border()
+            ri = 2
+            for ri, it in enumerate(val["items"], 3):
+                vals = [it["sku"], it["title"], it["qty"], it["lots"], it["avg_cost"], it["value"], it["ledger_qty"]]
+                for ci, v2 in enumerate(vals, 1):
+                    c = ws3.cell(row=ri, column=ci, value=v2)
+                    c.font = F(name="Calibri", size=9); c.border = border()
+                    if ci in (5, 6): c.number_format = money_fmt()
+                    c.fill = hdr_fill("FFFFFF") if ri % 2 == 0 else hdr_fill(GRY)
+            for ci, v2 in enumerate(["SUMA", "", val["total_qty"], "", "", val["total_value"], ""], 1):
+                c = ws3.cell(row=ri + 1, column=ci, value=v2)
+                c.font = F(name="Calibri", bold=True, size=9); c.border = border()
+                if ci == 6: c.number_format = money_fmt()
+            for ci, w in enumerate([16, 40, 10, 8, 14, 16, 14], 1):
+                ws3.column_dimensions[get_column_letter(ci)].width = w
+
+        # arkusz rentowności SKU
+        if self.cb_skus.isChecked():
+            ws4 = wb.create_sheet("Rentownosc SKU"); ws4.sheet_properties.tabColor = ORNG
+            ws4.merge_cells("A1:H1")
+            c = ws4.cell(row=1, column=1, value=f"Rentownosc SKU – {df} do {dt}")
+            c.font = F(name="Calibri", bold=True, size=12, color=ORNG)
+            hdrs4 = ["SKU", "Nazwa", "Sztuki", "Zamowienia", "Przychod PLN", "Koszt PLN", "Zysk PLN", "Marza %"]
+            for ci, h in enumerate(hdrs4, 1):
+                c = ws4.cell(row=2, column=ci, value=h)
+                c.font = F(name="Calibri", bold=True, color=WHT)
+                c.fill = hdr_fill(ORNG); c.alignment = centered(); c.border = border()
+            for ri, it in enumerate(ds.skus, 3):
+                vals = [it["sku"], it["title"], it["units"], it["orders"], it["revenue"], it["cost"],
+                        it["profit"], it["margin"]]
+                for ci, v2 in enumerate(vals, 1):
+                    c = ws4.cell(row=ri, column=ci, value=v2)
+                    c.font = F(name="Calibri", size=9); c.border = border()
+                    if ci in (5, 6, 7): c.number_format = money_fmt()
+                    if ci == 7: c.font = F(name="Calibri", bold=True, size=9, color=GRNG if v2 >= 0 else RED)
+                    if ci == 8: c.number_format = pct_fmt()
+                    c.fill = hdr_fill("FFFFFF") if ri % 2 == 0 else hdr_fill(GRY)
+            for ci, w in enumerate([16, 40, 10, 12, 16, 16, 16, 10], 1):
+                ws4.column_dimensions[get_column_letter(ci)].width = w
+
         # szerokości kolumn arkusza głównego
         col_widths = [12, 14, 40, 16, 16, 16, 10]
         for ci, w in enumerate(col_widths, 1):
@@ -2258,7 +4776,8 @@ class ReportDialog(QDialog):
     # ──────────────────────────────────────────────────────
     #  PDF  – polskie znaki przez encoding lub DejaVu
     # ──────────────────────────────────────────────────────
-    def _gen_pdf(self, path, df, dt):
+    def _gen_pdf(self, ds, path):
+        df, dt = ds.df, ds.dt
         try:
             from reportlab.lib.pagesizes import A4, landscape
             from reportlab.lib import colors
@@ -2317,22 +4836,8 @@ class ReportDialog(QDialog):
         # ── dane ────────────────────────────────────────
         biz   = self._get_biz()
         linfo = self._get_limit_info(df)
-        sales = self.db.get_detailed_sales(df, dt) if self.cb_sales.isChecked() else []
-        purch = self.db.list_purchases()            if self.cb_purchases.isChecked() else []
-
-        orders = {}
-        for s in sales:
-            oid = s["order_id"]
-            if oid not in orders:
-                orders[oid] = {"date": s["date"], "platform": s["platform"],
-                               "pln": s["order_total_pln"], "cost": s["order_total_cost"],
-                               "products": []}
-            orders[oid]["products"].append(f"{s['sku']} x{s['qty']}")
-        order_list = list(orders.values())
-
-        total_rev    = sum(o["pln"]  for o in order_list)
-        total_cost   = sum(o["cost"] for o in order_list)
-        total_profit = total_rev - total_cost
+        purch, order_list = ds.purchases, ds.orders
+        total_rev, total_cost, total_profit = ds.revenue, ds.cost, ds.profit
 
         # ── kolory ──────────────────────────────────────
         C_RED   = colors.HexColor("#C62828")
@@ -2426,7 +4931,7 @@ class ReportDialog(QDialog):
                 ["Przychod calkowity",  f"{total_rev:,.2f} PLN",    ""],
                 ["Koszt zakupow",       f"{total_cost:,.2f} PLN",   ""],
                 ["Zysk netto",          f"{total_profit:,.2f} PLN", ""],
-                ["Liczba transakcji",   str(len(order_list)),       ""],
+                ["Liczba transakcji",   str(ds.count),       ""],
             ]
             margin_pct = (total_profit / total_rev * 100) if total_rev > 0 else 0
             sum_data[2][2] = f"marza: {margin_pct:.1f}%"
@@ -2508,7 +5013,7 @@ class ReportDialog(QDialog):
             for o in order_list:
                 tbl_data.append([
                     o["date"], o["platform"],
-                    ", ".join(o["products"]),
+                    o["products"],
                     f"{o['pln']:,.2f}", f"{o['cost']:,.2f}",
                     f"{o['pln']-o['cost']:,.2f}"
                 ])
@@ -2572,9 +5077,8 @@ class ReportDialog(QDialog):
             p_data = [p_hdr]
             p_total = 0.0
             for p in purch:
-                p_data.append([str(p["id"]), p["sku"], p["title"],
-                                str(p["qty"]), f"{p['total_pln']:,.2f}", p["date"]])
-                p_total += p["total_pln"]
+                p_data.append([str(p.id), p.sku, p.title, str(p.qty), f"{p.total_pln:,.2f}", p.date])
+                p_total += p.total_pln
             p_data.append(["", "", "SUMA", "", f"{p_total:,.2f}", ""])
             pn = len(p_data)
             pts = TableStyle([
@@ -2598,6 +5102,60 @@ class ReportDialog(QDialog):
             p_tbl = Table(p_data, colWidths=pcol_w, repeatRows=1)
             p_tbl.setStyle(pts)
             story.append(p_tbl)
+            story.append(Spacer(1, 10))
+
+        # ── wycena magazynu ──
+        if self.cb_valuation.isChecked():
+            val = ds.valuation
+            story.append(Paragraph(f"WYCENA MAGAZYNU FIFO NA {dt}", sSecHdr))
+            vcol_w = [2.8*cm, 0, 1.6*cm, 1.4*cm, 2.4*cm, 2.8*cm]
+            vcol_w[1] = W - sum(vcol_w)
+            v_data = [["SKU", "Nazwa", "Ilosc", "Partie", "Sr. koszt", "Wartosc PLN"]]
+            for it in val["items"]:
+                v_data.append([it["sku"], it["title"], str(it["qty"]), str(it["lots"]),
+                               f"{it['avg_cost']:,.2f}", f"{it['value']:,.2f}"])
+            v_data.append(["", "SUMA", str(val["total_qty"]), "", "", f"{val['total_value']:,.2f}"])
+            vn = len(v_data)
+            v_tbl = Table(v_data, colWidths=vcol_w, repeatRows=1)
+            v_tbl.setStyle(TableStyle([
+                ("FONTNAME",  (0,0), (-1,0),  font_bold),
+                ("FONTSIZE",  (0,0), (-1,-1), 8),
+                ("BACKGROUND",(0,0), (-1,0),  colors.HexColor("#2E7D32")),
+                ("TEXTCOLOR", (0,0), (-1,0),  colors.white),
+                ("ALIGN",     (0,0), (-1,0),  "CENTER"),
+                ("VALIGN",    (0,0), (-1,-1), "MIDDLE"),
+                ("FONTNAME",  (0,1), (-1,-1), font_name),
+                ("ROWBACKGROUNDS",(0,1),(-1,vn-2),[colors.white, C_GRY]),
+                ("FONTNAME",  (0,vn-1),(-1,vn-1), font_bold),
+                ("GRID",      (0,0), (-1,-1), 0.3, colors.HexColor("#DDDDDD")),
+                ("ALIGN",     (2,1), (-1,-1), "RIGHT"),
+            ]))
+            story.append(v_tbl)
+            story.append(Spacer(1, 10))
+
+        # ── rentowność SKU ──
+        if self.cb_skus.isChecked():
+            story.append(Paragraph("RENTOWNOSC SKU", sSecHdr))
+            kcol_w = [2.8*cm, 0, 1.5*cm, 2.4*cm, 2.4*cm, 2.4*cm, 1.6*cm]
+            kcol_w[1] = W - sum(kcol_w)
+            k_data = [["SKU", "Nazwa", "Sztuki", "Przychod", "Koszt", "Zysk", "Marza"]]
+            for it in ds.skus:
+                k_data.append([it["sku"], it["title"], str(it["units"]), f"{it['revenue']:,.2f}",
+                               f"{it['cost']:,.2f}", f"{it['profit']:,.2f}", f"{it['margin']:.1f}%"])
+            k_tbl = Table(k_data, colWidths=kcol_w, repeatRows=1)
+            k_tbl.setStyle(TableStyle([
+                ("FONTNAME",  (0,0), (-1,0),  font_bold),
+                ("FONTSIZE",  (0,0), (-1,-1), 8),
+                ("BACKGROUND",(0,0), (-1,0),  colors.HexColor("#E65100")),
+                ("TEXTCOLOR", (0,0), (-1,0),  colors.white),
+                ("ALIGN",     (0,0), (-1,0),  "CENTER"),
+                ("VALIGN",    (0,0), (-1,-1), "MIDDLE"),
+                ("FONTNAME",  (0,1), (-1,-1), font_name),
+                ("ROWBACKGROUNDS",(0,1),(-1,-1),[colors.white, C_GRY]),
+                ("GRID",      (0,0), (-1,-1), 0.3, colors.HexColor("#DDDDDD")),
+                ("ALIGN",     (2,1), (-1,-1), "RIGHT"),
+            ]))
+            story.append(k_tbl)
 
         # stopka
         story.append(Spacer(1, 12))
@@ -2617,13 +5175,13 @@ class BackupDialog(QDialog):
         super().__init__(parent)
         self.db = db; self.setWindowTitle("Archiwizacja danych"); self.resize(560,380)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("🗄  Archiwizacja bazy danych", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("🗄  Archiwizacja bazy danych"), "title"))
         v.addWidget(Separator(self))
         dir_row = QHBoxLayout()
         dir_row.addWidget(QLabel("Katalog:"))
         self.dir_edit = QLineEdit(os.path.join(os.getcwd(),"backup")); dir_row.addWidget(self.dir_edit)
         br = btn("📁 Przeglądaj","secondary"); br.clicked.connect(self._browse); dir_row.addWidget(br); v.addLayout(dir_row)
-        v.addWidget(QLabel("Istniejące kopie:", styleSheet=f"color:{T()['text2']};"))
+        v.addWidget(styled(QLabel("Istniejące kopie:"), "muted"))
         self.lst = QListWidget(); v.addWidget(self.lst)
         btns = QHBoxLayout()
         cb = btn("💾 Utwórz kopię","success"); cb.clicked.connect(self._create)
@@ -2632,6 +5190,15 @@ class BackupDialog(QDialog):
         cl = btn("Zamknij","secondary"); cl.clicked.connect(self.accept)
         for b2 in [cb,rb,db2]: btns.addWidget(b2)
         btns.addStretch(); btns.addWidget(cl); v.addLayout(btns)
+        v.addWidget(Separator(self))
+        arow = QHBoxLayout()
+        self.arch_lbl = styled(QLabel(), "muted"); arow.addWidget(self.arch_lbl,1)
+        ab = btn("📚 Przenieś rok do archiwum…","secondary"); ab.clicked.connect(self._archive_year); arow.addWidget(ab)
+        v.addLayout(arow)
+        crow = QHBoxLayout()
+        self.closed_lbl = styled(QLabel(), "muted"); crow.addWidget(self.closed_lbl,1)
+        zb = btn("🔒 Zamknij rok…","secondary"); zb.clicked.connect(self._close_year); crow.addWidget(zb)
+        v.addLayout(crow)
         self._reload()
 
     def _browse(self):
@@ -2645,6 +5212,53 @@ class BackupDialog(QDialog):
                 fp = os.path.join(bdir,f); sz = os.path.getsize(fp)//1024
                 mt = datetime.fromtimestamp(os.path.getmtime(fp)).strftime("%Y-%m-%d %H:%M")
                 self.lst.addItem(f"  {f}  ({sz} KB)  –  {mt}")
+        years = [str(a["year"]) for a in self.db.list_archives()]
+        self.arch_lbl.setText(f"Lata w archiwum: {', '.join(years)}  ({self.db.archive_dir()})" if years
+                              else "Lata w archiwum: brak – zamknięte lata są w bazie głównej")
+        end = self.db.closed_until()
+        self.closed_lbl.setText(f"Okres zamknięty do {end} – zapisy z wcześniejszą datą są odrzucane" if end
+                                else "Żaden rok nie jest zamknięty")
+
+    def _close_year(self):
+        end  = self.db.closed_until()
+        if end and int(end[:4]) >= datetime.now().year-1:
+            QMessageBox.information(self,"Zamknięcie roku",f"Lata do {end[:4]} są już zamknięte."); return
+        year, ok = QInputDialog.getInt(self,"Zamknięcie roku","Rok do zamknięcia:",datetime.now().year-1,
+                                       int(end[:4])+1 if end else 2000,datetime.now().year-1)
+        if not ok: return
+        if QMessageBox.question(self,"Zamknięcie roku",
+                                f"Zamknąć rok {year}?\n\nPozostałe partie przejdą do bilansu otwarcia, a sumy roku "
+                                f"zostaną zapisane.\nPo zamknięciu nie można dodawać ani usuwać zakupów i sprzedaży "
+                                f"z datą do {year}-12-31.",QMessageBox.Yes|QMessageBox.No)!=QMessageBox.Yes: return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try: cp = self.db.close_year(year)
+        except Exception as e: QMessageBox.critical(self,"Błąd",str(e)); return
+        finally: QApplication.restoreOverrideCursor()
+        self._reload()
+        QMessageBox.information(self,"Zamknięcie roku",f"Rok {year}: {cp['sale_count']} sprzedaży, przychód "
+                                f"{cp['revenue']:.2f} PLN.\nBilans otwarcia: {cp['lots']} partii, {cp['stock_qty']} szt., "
+                                f"{cp['stock_value']:.2f} PLN.")
+
+    def _archive_year(self):
+        end = self.db.closed_until()
+        if not end:
+            QMessageBox.information(self,"Archiwum lat","Do archiwum można przenieść tylko zamknięty rok – "
+                                    "najpierw zamknij rok."); return
+        year, ok = QInputDialog.getInt(self,"Archiwum lat","Rok do przeniesienia (zamknięty):",
+                                       int(end[:4]),2000,int(end[:4]))
+        if not ok: return
+        if QMessageBox.question(self,"Archiwum",
+                                f"Przenieść sprzedaże, rachunki i rozliczone zakupy z {year} r. do\n"
+                                f"{os.path.join(self.db.archive_dir(),f'archive_{year}.db')}?\n\n"
+                                "Raporty i historia nadal je pokażą, ale nie będzie można ich usuwać.\n"
+                                "Zrób najpierw kopię zapasową.",QMessageBox.Yes|QMessageBox.No)!=QMessageBox.Yes: return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try: n = self.db.archive_year(year)
+        except Exception as e: QMessageBox.critical(self,"Błąd",str(e)); return
+        finally: QApplication.restoreOverrideCursor()
+        self._reload()
+        QMessageBox.information(self,"Archiwum",f"Rok {year}: przeniesiono {n['sales']} sprzedaży, "
+                                f"{n['invoices']} rachunków i {n['purchases']} zakupów.")
 
     def _create(self):
         bdir = self.dir_edit.text(); os.makedirs(bdir,exist_ok=True)
@@ -2661,7 +5275,7 @@ class BackupDialog(QDialog):
         src = os.path.join(self.dir_edit.text(),fname)
         if QMessageBox.question(self,"Przywróć",f"Przywrócić z:\n{src}\n\nAktualna baza zostanie nadpisana!",
                                 QMessageBox.Yes|QMessageBox.No)==QMessageBox.Yes:
-            try: shutil.copy2(src,self.db.path); QMessageBox.information(self,"OK","Przywrócono. Uruchom program ponownie.")
+            try: self.db.restore(src); QMessageBox.information(self,"OK","Przywrócono. Uruchom program ponownie.")
             except Exception as e: QMessageBox.critical(self,"Błąd",str(e))
 
     def _delete(self):
@@ -2674,12 +5288,115 @@ class BackupDialog(QDialog):
             except Exception as e: QMessageBox.critical(self,"Błąd",str(e))
 
 
+class ImportDialog(QDialog):
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db; self.imported = False
+        self.setWindowTitle("Import danych"); self.resize(640,480)
+        v = QVBoxLayout(self); v.setSpacing(10)
+        v.addWidget(styled(QLabel("📥  Import produktów, zakupów i sprzedaży"), "title"))
+        v.addWidget(Separator(self))
+        info = QLabel("Kolumny: typ (produkt / zakup / sprzedaz), data, sku, nazwa, ilosc, kwota, "
+                      "kwota_eur, platforma, zamowienie. Cały plik zapisywany jest w jednej transakcji – "
+                      "przy błędzie nic nie zostaje zapisane.")
+        info.setWordWrap(True); styled(info, "hint"); v.addWidget(info)
+        row = QHBoxLayout()
+        self.path_edit = QLineEdit(); self.path_edit.setPlaceholderText("Plik CSV lub XLSX"); row.addWidget(self.path_edit)
+        br = btn("📁 Przeglądaj","secondary"); br.clicked.connect(self._browse); row.addWidget(br); v.addLayout(row)
+        self.dry = QCheckBox("Tylko sprawdź (bez zapisu)"); self.dry.setChecked(True); v.addWidget(self.dry)
+        self.out = QPlainTextEdit(); self.out.setReadOnly(True); v.addWidget(self.out)
+        btns = QHBoxLayout()
+        ib = btn("📥 Importuj","success"); ib.clicked.connect(self._run)
+        cl = btn("Zamknij","secondary"); cl.clicked.connect(self.accept)
+        btns.addWidget(ib); btns.addStretch(); btns.addWidget(cl); v.addLayout(btns)
+
+    def _browse(self):
+        path,_ = QFileDialog.getOpenFileName(self,"Plik importu","","Arkusze (*.csv *.xlsx)")
+        if path: self.path_edit.setText(path)
+
+    def _run(self):
+        path = self.path_edit.text().strip()
+        if not path or not os.path.exists(path): QMessageBox.warning(self,"Brak pliku","Wskaż plik do importu."); return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            rep = self.db.bulk_import(read_import_rows(path), dry_run=self.dry.isChecked())
+            self.out.setPlainText(format_import_report(rep))
+            if not rep["dry_run"] and not rep["errors"]: self.imported = True
+        except Exception as e:
+            self.out.setPlainText(f"{type(e).__name__}: {e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+
+
+class MarketplaceImportDialog(QDialog):
+    """Import zamówień z eksportu platformy; nieznane SKU ofert można od razu przypisać do produktów"""
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db; self.imported = False
+        self.setWindowTitle("Import zamówień z platformy"); self.resize(680,560)
+        v = QVBoxLayout(self); v.setSpacing(10)
+        v.addWidget(styled(QLabel("🛒  Import zamówień z platformy"), "title"))
+        v.addWidget(Separator(self))
+        info = QLabel("Eksport zamówień (CSV, JSON lub JSON Lines) z kolumnami: numer zamówienia, data, "
+                      "SKU / ID oferty, ilość, kwota. Zamówienia już zaimportowane są pomijane, a cały "
+                      "plik zapisywany jest w jednej transakcji z rozliczeniem FIFO.")
+        info.setWordWrap(True); styled(info, "hint"); v.addWidget(info)
+        row = QHBoxLayout()
+        self.platform = QComboBox(); self.platform.addItems(PLATFORMS); row.addWidget(self.platform)
+        self.path_edit = QLineEdit(); self.path_edit.setPlaceholderText("Plik eksportu"); row.addWidget(self.path_edit)
+        br = btn("📁 Przeglądaj","secondary"); br.clicked.connect(self._browse); row.addWidget(br); v.addLayout(row)
+        self.dry = QCheckBox("Tylko sprawdź (bez zapisu)"); self.dry.setChecked(True); v.addWidget(self.dry)
+        self.out = QPlainTextEdit(); self.out.setReadOnly(True); v.addWidget(self.out)
+        self.map_tbl = QTableWidget(0,2); self.map_tbl.setHorizontalHeaderLabels(["SKU z oferty","Produkt"])
+        self.map_tbl.horizontalHeader().setSectionResizeMode(1,QHeaderView.Stretch)
+        self.map_tbl.verticalHeader().setVisible(False); self.map_tbl.hide(); v.addWidget(self.map_tbl)
+        btns = QHBoxLayout()
+        ib = btn("📥 Importuj","success"); ib.clicked.connect(self._run)
+        self.map_btn = btn("💾 Zapisz przypisania","primary"); self.map_btn.clicked.connect(self._save_map); self.map_btn.hide()
+        cl = btn("Zamknij","secondary"); cl.clicked.connect(self.accept)
+        btns.addWidget(ib); btns.addWidget(self.map_btn); btns.addStretch(); btns.addWidget(cl); v.addLayout(btns)
+
+    def _browse(self):
+        path,_ = QFileDialog.getOpenFileName(self,"Eksport zamówień","","Eksport (*.csv *.json *.jsonl *.ndjson)")
+        if path: self.path_edit.setText(path)
+
+    def _run(self):
+        path = self.path_edit.text().strip()
+        if not path or not os.path.exists(path): QMessageBox.warning(self,"Brak pliku","Wskaż plik eksportu."); return
+        plat = self.platform.currentText()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            rep = self.db.import_marketplace_orders(plat, read_marketplace_rows(path), dry_run=self.dry.isChecked())
+            self.out.setPlainText(format_marketplace_report(plat, rep))
+            if not rep["dry_run"] and not rep["errors"] and rep["orders"]: self.imported = True
+            self._fill_map(rep["unknown_skus"])
+        except Exception as e:
+            self.out.setPlainText(f"{type(e).__name__}: {e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+
+    def _fill_map(self, skus):
+        self.map_tbl.setRowCount(len(skus))
+        for i, sku in enumerate(skus):
+            self.map_tbl.setItem(i,0,QTableWidgetItem(sku))
+            combo = product_combo(self.db); combo.insertItem(0,"— pomiń —",None); combo.setCurrentIndex(0)
+            self.map_tbl.setCellWidget(i,1,combo)
+        self.map_tbl.setVisible(bool(skus)); self.map_btn.setVisible(bool(skus))
+
+    def _save_map(self):
+        plat, n = self.platform.currentText(), 0
+        for i in range(self.map_tbl.rowCount()):
+            pid = self.map_tbl.cellWidget(i,1).currentData()
+            if pid is not None: self.db.set_listing_sku(plat, self.map_tbl.item(i,0).text(), pid); n += 1
+        QMessageBox.information(self,"OK",f"Zapisano przypisań: {n}. Uruchom import ponownie.")
+
+
 class BusinessInfoDialog(QDialog):
     def __init__(self, config, parent=None):
         super().__init__(parent)
         self.config = config; self.setWindowTitle("Dane osobiste"); self.setFixedSize(460,380)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("👤  Dane sprzedawcy", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("👤  Dane sprzedawcy"), "title"))
         v.addWidget(Separator(self))
         info = self.config.get_business_info()
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
@@ -2716,7 +5433,7 @@ class InvoiceConfigDialog(QDialog):
         super().__init__(parent)
         self.config = config; self.setWindowTitle("Konfiguracja rachunków"); self.setFixedSize(460,300)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("🧾  Konfiguracja rachunków", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("🧾  Konfiguracja rachunków"), "title"))
         v.addWidget(Separator(self))
         cfg = self.config.get_invoice_config()
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
@@ -2742,9 +5459,9 @@ class InvoiceConfigDialog(QDialog):
 class LimitsConfigDialog(QDialog):
     def __init__(self, config, parent=None):
         super().__init__(parent)
-        self.config = config; self.setWindowTitle("Limity US"); self.setFixedSize(500,380)
+        self.config = config; self.setWindowTitle("Limity US"); self.setFixedSize(500,410)
         v = QVBoxLayout(self); v.setSpacing(10)
-        v.addWidget(QLabel("⚖️  Limity działalności nierejestrowanej", styleSheet=f"font-size:15px;font-weight:700;color:{T()['text']};"))
+        v.addWidget(styled(QLabel("⚖️  Limity działalności nierejestrowanej"), "title"))
         v.addWidget(Separator(self))
         lim = self.config.get_limits()
         form = QFormLayout(); form.setSpacing(8); form.setLabelAlignment(Qt.AlignRight)
@@ -2753,14 +5470,18 @@ class LimitsConfigDialog(QDialog):
         self.qmult = QDoubleSpinBox(); self.qmult.setRange(0,10); self.qmult.setDecimals(2)
         self.qmult.setValue(lim.get("quarterly_multiplier",2.25))
         self.use_q = QCheckBox("Używaj limitów kwartalnych (od 2026)"); self.use_q.setChecked(lim.get("use_quarterly",True))
+        year = str(datetime.now().year)
+        self.plim = QSpinBox(); self.plim.setRange(0,9999); self.plim.setSuffix(" szt./rok")
+        self.plim.setValue(self.config.get_platform_limit(int(year)))
         form.addRow("Minimalne wynagrodzenie:",self.wage)
         form.addRow("Mnożnik kwartalny:",self.qmult)
+        form.addRow(f"Limit sprzedaży/platforma {year}:",self.plim)
         form.addRow("",self.use_q); v.addLayout(form)
         info = QLabel("Od 2026 roku obowiązują limity kwartalne.\n"
                       "Limit mies. = 75% min. wynagrodzenia\n"
                       "Limit kw. = mnożnik × min. wynagrodzenie (domyślnie 2.25)")
-        info.setStyleSheet(f"color:{T()['text3']};font-size:11px;"); v.addWidget(info)
-        self.calc = QLabel(); self.calc.setStyleSheet(f"color:{T()['accent']};font-weight:700;"); v.addWidget(self.calc)
+        styled(info, "hint"); v.addWidget(info)
+        self.calc = styled(QLabel(), "accent"); v.addWidget(self.calc)
         self.wage.valueChanged.connect(self._recalc); self.qmult.valueChanged.connect(self._recalc); self._recalc()
         v.addStretch()
         btns = QHBoxLayout()
@@ -2776,6 +5497,8 @@ class LimitsConfigDialog(QDialog):
         lim = self.config.get_limits()
         lim["minimal_wage"] = self.wage.value(); lim["quarterly_multiplier"] = self.qmult.value()
         lim["use_quarterly"] = self.use_q.isChecked()
+        # limit platform zapisywany dla bieżącego roku – poprzednie lata zachowują swój
+        lim.setdefault("year_limits", {}).setdefault(str(datetime.now().year), {})["platform_limit"] = self.plim.value()
         self.config.update_limits(lim); QMessageBox.information(self,"OK","Limity zapisane."); self.accept()
 
 
@@ -2784,10 +5507,10 @@ class AboutDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("O programie"); self.setFixedSize(480,360)
         v = QVBoxLayout(self); v.setSpacing(12)
-        logo = QLabel(APP_NAME); logo.setStyleSheet(f"font-size:20px;font-weight:800;color:{T()['accent']};")
+        logo = styled(QLabel(APP_NAME), "logo")
         logo.setAlignment(Qt.AlignCenter); v.addWidget(logo)
         ver = QLabel(f"Wersja {APP_VERSION}  •  {BUILD_DATE}")
-        ver.setStyleSheet(f"color:{T()['text3']};font-size:12px;"); ver.setAlignment(Qt.AlignCenter); v.addWidget(ver)
+        styled(ver, "caption"); ver.setAlignment(Qt.AlignCenter); v.addWidget(ver)
         v.addWidget(Separator(self))
         features = QLabel(
             "<ul>"
@@ -2800,41 +5523,115 @@ class AboutDialog(QDialog):
             "<li>Archiwizacja z przywracaniem kopii</li>"
             "</ul>")
         features.setTextFormat(Qt.RichText)
-        features.setStyleSheet(f"color:{T()['text2']};font-size:12px;"); v.addWidget(features)
+        styled(features, "body"); v.addWidget(features)
         v.addStretch()
         author = QLabel(f"Autor: {APP_AUTHOR}  •  Licencja: {APP_LICENSE}")
-        author.setStyleSheet(f"color:{T()['text3']};font-size:11px;"); author.setAlignment(Qt.AlignCenter); v.addWidget(author)
+        styled(author, "hint"); author.setAlignment(Qt.AlignCenter); v.addWidget(author)
         ok = btn("Zamknij","secondary"); ok.clicked.connect(self.accept); v.addWidget(ok)
 
 
+class DiagnosticsDialog(QDialog):
+    """Panel deweloperski – statystyki DBProfiler"""
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db; self.setWindowTitle("Diagnostyka bazy danych"); self.resize(1100,700)
+        v = QVBoxLayout(self); v.setSpacing(8)
+        row = QHBoxLayout()
+        self.toggle_b = btn("", "secondary"); self.toggle_b.clicked.connect(self._toggle); row.addWidget(self.toggle_b)
+        row.addWidget(QLabel("Wolne zapytania od:"))
+        self.slow_ms = QDoubleSpinBox(); self.slow_ms.setRange(0.1,60000); self.slow_ms.setSuffix(" ms")
+        self.slow_ms.setValue(db.profiler.slow_ms if db.profiler else 50.0)
+        self.slow_ms.valueChanged.connect(lambda x: setattr(self.db.profiler,"slow_ms",x) if self.db.profiler else None)
+        row.addWidget(self.slow_ms); row.addStretch()
+        for text, slot in [("⟳ Odśwież",self._load),("🧹 Wyczyść",self._reset),("💾 Zapisz JSON…",self._dump)]:
+            b2 = btn(text,"secondary"); b2.clicked.connect(slot); row.addWidget(b2)
+        v.addLayout(row)
+        tabs = QTabWidget(); v.addWidget(tabs)
+        cols = ["Wywołań","Pomiarów","Suma ms","Śr. ms","Maks. ms","Wierszy","Histogram"]
+        self.m_tbl = SortableTable(0,len(cols)+1); self.m_tbl.setHorizontalHeaderLabels(["Metoda"]+cols)
+        self.s_tbl = SortableTable(0,len(cols)+1); self.s_tbl.setHorizontalHeaderLabels(["Zapytanie"]+cols)
+        for t2 in (self.m_tbl, self.s_tbl):
+            t2.horizontalHeader().setSectionResizeMode(0,QHeaderView.Stretch)
+            t2.horizontalHeader().setSectionResizeMode(len(cols),QHeaderView.ResizeToContents)
+        self.slow_txt = QPlainTextEdit(); self.slow_txt.setReadOnly(True)
+        tabs.addTab(self.m_tbl,"Metody DB"); tabs.addTab(self.s_tbl,"Zapytania SQL"); tabs.addTab(self.slow_txt,"Wolne zapytania")
+        cl = btn("Zamknij","secondary"); cl.clicked.connect(self.accept); v.addWidget(cl, alignment=Qt.AlignRight)
+        self._load()
+
+    def _toggle(self):
+        if self.db.profiler: self.db.disable_profiling()
+        else: self.db.enable_profiling(self.slow_ms.value(), os.path.join(os.path.dirname(os.path.abspath(self.db.path)),"slow_queries.log"))
+        self._load()
+
+    def _reset(self):
+        if self.db.profiler: self.db.profiler.reset()
+        self._load()
+
+    def _dump(self):
+        if not self.db.profiler: QMessageBox.warning(self,"Brak danych","Pomiar jest wyłączony."); return
+        path,_ = QFileDialog.getSaveFileName(self,"Zapisz statystyki",f"diagnostyka_{datetime.now():%Y%m%d_%H%M%S}.json","JSON (*.json)")
+        if path:
+            try: self.db.profiler.dump(path); QMessageBox.information(self,"OK",f"Zapisano:\n{path}")
+            except Exception as e: QMessageBox.critical(self,"Błąd",str(e))
+
+    def _fill(self, tbl, data):
+        tbl.setSortingEnabled(False); tbl.setRowCount(len(data))
+        for i, (name, e) in enumerate(data.items()):
+            hist = "  ".join(f"{k}:{n}" for k, n in e["hist"].items())
+            vals = [name, e["calls"], e["timed"], e["total_ms"], e["avg_ms"] or 0, e["max_ms"], e["rows"], hist]
+            for j, val in enumerate(vals):
+                item = QTableWidgetItem()
+                if isinstance(val,(int,float)): item.setData(Qt.DisplayRole, val); item.setTextAlignment(Qt.AlignRight|Qt.AlignVCenter)
+                else: item.setText(str(val)); item.setToolTip(str(val))
+                tbl.setItem(i,j,item)
+
+    def _load(self):
+        prof = self.db.profiler
+        self.toggle_b.setText("⏹ Wyłącz pomiar" if prof else "▶ Włącz pomiar")
+        d = prof.to_dict() if prof else {"methods":{}, "statements":{}, "slow_queries":[]}
+        self._fill(self.m_tbl, d["methods"]); self._fill(self.s_tbl, d["statements"])
+        self.slow_txt.setPlainText("\n\n".join(
+            f"[{q['at']}] {q['ms']} ms, {q['rows']} wierszy\n{q['sql']}\nparametry: {q['params']}\n"
+            + "\n".join(f"  PLAN: {p}" for p in q["plan"]) for q in reversed(d["slow_queries"]))
+            or ("Brak wolnych zapytań." if prof else "Pomiar wyłączony – kliknij „Włącz pomiar”."))
+
+
 # ─────────────────────────────────────────────────────────
 #  GŁÓWNE OKNO
 # ─────────────────────────────────────────────────────────
 class MainWindow(QMainWindow):
+    POLL_MS = 2000   # sprawdzanie zmian z innych instancji (PRAGMA data_version)
+
     def __init__(self):
         super().__init__()
         self.config   = Config()
         self.db_path  = self.config.get_db_path()
-        self.db       = DB(self.db_path)
+        self.db       = DB(self.db_path,**self.config.get_db_options())
+        self.config.migrate_invoice_counter(self.db)
         self.setWindowTitle(f"{APP_NAME}  v{APP_VERSION}  –  {os.path.basename(self.db_path)}")
         self.resize(1320,820)
         self._build_ui()
         self._build_menu()
         self._build_toolbar()
+        self._poll = QTimer(self); self._poll.timeout.connect(self._refresh); self._poll.start(self.POLL_MS)
 
     def _build_ui(self):
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
         self.dashboard    = DashboardWidget(self.db,self.config)
         self.products_tab = ProductsWidget(self.db,self.config)
+        self.velocity_tab = VelocityWidget(self.db,self.config)
+        self.reorder_tab  = ReorderWidget(self.db,self.config)
         self.tabs.addTab(self.dashboard,    "📊  Dashboard")
         self.tabs.addTab(self.products_tab, "📦  Magazyn")
+        self.tabs.addTab(self.velocity_tab, "🔄  Rotacja")
+        self.tabs.addTab(self.reorder_tab,  "🛒  Zamówienia")
         self.tabs.currentChanged.connect(self._tab_changed)
         self.status_bar = QStatusBar(); self.setStatusBar(self.status_bar); self._upd_status()
 
     def _tab_changed(self, idx):
-        if idx==0: self.dashboard.refresh()
-        elif idx==1: self.products_tab.refresh()
+        w = self.tabs.widget(idx)
+        if w is not None: w.refresh_if_changed()
 
     def _upd_status(self):
         self.status_bar.showMessage(
@@ -2854,6 +5651,8 @@ class MainWindow(QMainWindow):
         mf.addSeparator()
         self._act(mf,"🗄 Archiwizacja…",self._backup,"Ctrl+B")
         mf.addSeparator()
+        self._act(mf,"📥 Import CSV/XLSX…",self._import)
+        self._act(mf,"🛒 Import zamówień z platformy…",self._import_marketplace)
         self._act(mf,"📤 Eksport CSV…",self._quick_export)
         mf.addSeparator()
         self._act(mf,"❌ Zakończ",self.close,"Ctrl+Q")
@@ -2883,7 +5682,8 @@ class MainWindow(QMainWindow):
         self._act(mc,"⚖️ Limity US…",             self._lim_cfg)
 
         mh = mb.addMenu("&Pomoc")
-        self._act(mh,"⟳ Odśwież",self._refresh,"F5")
+        self._act(mh,"⟳ Odśwież",self._reload,"F5")
+        self._act(mh,"🩺 Diagnostyka…",self._diagnostics)
         mh.addSeparator()
         self._act(mh,"ℹ️ O programie…",self._about)
 
@@ -2899,31 +5699,34 @@ class MainWindow(QMainWindow):
         ta("📆 Kw.",    lambda: self._report("quarterly"), "Raport kwartalny")
         tb.addSeparator()
         ta("🗄 Backup",     self._backup,         "Archiwizacja (Ctrl+B)")
-        ta("⟳ Odśwież",    self._refresh,        "Odśwież (F5)")
+        ta("⟳ Odśwież",    self._reload,         "Odśwież (F5)")
 
     # ── akcje ──
-    def _refresh(self): self.dashboard.refresh(); self.products_tab.refresh(); self._upd_status()
+    def _refresh(self):
+        # tylko widoczna zakładka i tylko gdy dane się zmieniły; ukryta – przy przełączeniu
+        self.tabs.currentWidget().refresh_if_changed(); self._upd_status()
+    def _reload(self):
+        for w in (self.dashboard, self.products_tab, self.velocity_tab, self.reorder_tab): w.refresh()
+        self._upd_status()
     def _add_product(self):
-        if ProductDialog(self.db,parent=self).exec(): self.products_tab.refresh(); self.dashboard.refresh()
+        if ProductDialog(self.db,parent=self).exec(): self._refresh()
     def _add_purchase(self):
         d = PurchaseDialog(self.db,parent=self)
         if d.exec():
             self.db.add_purchase_order(d.result_cost,d.result_date,d.result_items)
-            self.products_tab.refresh(); self.dashboard.refresh()
+            self._refresh()
     def _add_sale(self):
-        if SaleDialog(self.db,self.config,parent=self).exec():
-            self.products_tab.refresh(); self.dashboard.refresh()
+        if SaleDialog(self.db,self.config,parent=self).exec(): self._refresh()
     def _show_purchases(self):
-        rows = self.db.list_purchases()
-        data = [(r["id"],r["sku"],r["title"],r["qty"],f"{r['total_pln']:.2f}",r["date"]) for r in rows]
-        HistoryDialog("Historia zakupów",["ID","SKU","Nazwa","Ilość","Koszt PLN","Data"],data,self.db.delete_purchase,self).exec()
+        HistoryDialog("Historia zakupów",["ID","SKU","Nazwa","Ilość","Koszt PLN","Data"],self.db.list_purchases(),
+                      self.db.delete_purchase,self,
+                      lambda r: (r.id,r.sku,r.title,r.qty,f"{r.total_pln:.2f}",r.date)).exec()
         self._refresh()
     def _show_sales(self):
-        rows = self.db.list_sales()
-        data = [(r["id"],r["platform"],f"{r['total_pln']:.2f}",f"{r['total_eur']:.2f}",
-                 f"{r['purchase_cost']:.2f}",f"{r['profit']:.2f}",r["date"],r["items"]) for r in rows]
         HistoryDialog("Historia sprzedaży",["ID","Platforma","PLN","EUR","Koszt","Zysk netto","Data","Pozycje"],
-                      data,self.db.delete_sale,self).exec()
+                      self.db.list_sales(),self.db.delete_sale,self,
+                      lambda r: (r.id,r.platform,f"{r.total_pln:.2f}",f"{r.total_eur:.2f}",
+                                 f"{r.purchase_cost:.2f}",f"{r.profit:.2f}",r.date,r.items)).exec()
         self._refresh()
     def _show_invoices(self): InvoicesDialog(self.db,self.config,self).exec()
     def _inventory(self): InventoryDialog(self.db,self).exec(); self._refresh()
@@ -2932,7 +5735,14 @@ class MainWindow(QMainWindow):
     def _inv_cfg(self): InvoiceConfigDialog(self.config,self).exec()
     def _lim_cfg(self): LimitsConfigDialog(self.config,self).exec()
     def _about(self): AboutDialog(self).exec()
+    def _diagnostics(self): DiagnosticsDialog(self.db,self).exec()
     def _backup(self): BackupDialog(self.db,self).exec()
+    def _import(self):
+        d = ImportDialog(self.db,self); d.exec()
+        if d.imported: self._refresh()
+    def _import_marketplace(self):
+        d = MarketplaceImportDialog(self.db,self); d.exec()
+        if d.imported: self._refresh()
 
     def _open_db(self):
         path,_ = QFileDialog.getOpenFileName(self,"Otwórz bazę","","SQLite Database (*.db)")
@@ -2942,11 +5752,13 @@ class MainWindow(QMainWindow):
         if path: self._switch(path)
     def _switch(self, path):
         try:
-            if hasattr(self.db,"conn"): self.db.conn.close()
-            self.config.set_db_path(path); self.db_path = path; self.db = DB(path)
-            self.dashboard.db = self.db; self.products_tab.db = self.db
+            prof = self.db.profiler
+            if hasattr(self.db,"conn"): self.db.close()
+            self.config.set_db_path(path); self.db_path = path; self.db = DB(path,**self.config.get_db_options())
+            if prof: self.db.enable_profiling(prof.slow_ms, prof.log_path)
+            for w in (self.dashboard, self.products_tab, self.velocity_tab, self.reorder_tab): w.db = self.db
             self.setWindowTitle(f"{APP_NAME}  v{APP_VERSION}  –  {os.path.basename(path)}")
-            self._refresh(); QMessageBox.information(self,"OK",f"Załadowano bazę:\n{path}")
+            self._reload(); QMessageBox.information(self,"OK",f"Załadowano bazę:\n{path}")
         except Exception as e: QMessageBox.critical(self,"Błąd",str(e))
     def _quick_export(self):
         now = datetime.now(); df=f"{now.year}-01-01"; dt=now.strftime("%Y-%m-%d")
@@ -2956,20 +5768,389 @@ class MainWindow(QMainWindow):
             except Exception as e: QMessageBox.critical(self,"Błąd",str(e))
     def closeEvent(self, event):
         try:
-            if hasattr(self.db,"conn"): self.db.conn.close()
+            if hasattr(self.db,"conn"): self.db.close()
         except: pass
+        self.config.flush()
         event.accept()
 
 
+# ─────────────────────────────────────────────────────────
+#  API HTTP (JSON) – python magazyn.py --api [HOST:]PORT
+# ─────────────────────────────────────────────────────────
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _DBWriter(threading.Thread):
+    """Jedyny wątek zapisujący: operacje z kolejki wykonywane po kolei na jednym połączeniu"""
+    def __init__(self, db):
+        super().__init__(name="db-writer", daemon=True)
+        self.db = db
+        self.q  = queue.Queue()
+        self.start()
+
+    def run(self):
+        for fn, fut in iter(self.q.get, None):
+            if not fut.set_running_or_notify_cancel(): continue
+            try: fut.set_result(fn(self.db))
+            except BaseException as e: fut.set_exception(e)
+        self.db.close()
+
+    def call(self, fn, timeout=30):
+        """Wykonuje fn(db) w wątku zapisu i czeka na wynik (wyjątki są przekazywane dalej)"""
+        fut = concurrent.futures.Future()
+        self.q.put((fn, fut))
+        return fut.result(timeout)
+
+    def stop(self):
+        self.q.put(None)
+        self.join()
+
+
+class _PoolHTTPServer(http.server.HTTPServer):
+    """HTTPServer obsługujący żądania w stałej puli wątków (zamiast wątku na żądanie)"""
+    request_queue_size = 128
+
+    def __init__(self, addr, handler, workers):
+        super().__init__(addr, handler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="api")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try: self.finish_request(request, client_address)
+        except Exception: self.handle_error(request, client_address)
+        finally: self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class _ApiHandler(http.server.BaseHTTPRequestHandler):
+    api = None   # ApiServer – ustawiany w podklasie tworzonej przez ApiServer
+    server_version = f"magazyn/{APP_VERSION}"
+
+    def do_GET(self):    self._dispatch("GET")
+    def do_POST(self):   self._dispatch("POST")
+    def do_DELETE(self): self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            status, body = self.api.handle(method, url.path, dict(urllib.parse.parse_qsl(url.query)), self._body())
+        except ApiError as e:               status, body = e.status, {"error": str(e)}
+        except (ValueError, TypeError) as e: status, body = 400, {"error": str(e)}
+        except sqlite3.IntegrityError as e:  status, body = 409, {"error": str(e)}
+        except Exception as e:               status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n: return {}
+        try: body = json.loads(self.rfile.read(n))
+        except json.JSONDecodeError as e: raise ApiError(400, f"niepoprawny JSON: {e}")
+        if not isinstance(body, dict): raise ApiError(400, "oczekiwano obiektu JSON")
+        return body
+
+    def log_message(self, fmt, *args):
+        if self.api.verbose: super().log_message(fmt, *args)
+
+
+class ApiServer:
+    """Lokalne API JSON nad warstwą DB (domyślnie tylko 127.0.0.1).
+    Zapisy idą przez jeden wątek (_DBWriter) – kolejne żądania nie walczą o blokadę bazy;
+    odczyty korzystają z połączeń tylko do odczytu, po jednym na wątek puli."""
+    ROUTES = [
+        ("GET",    r"/api/health",                   "health"),
+        ("GET",    r"/api/products",                 "products"),
+        ("POST",   r"/api/products",                 "product_add"),
+        ("GET",    r"/api/products/(\d+)",           "product"),
+        ("GET",    r"/api/products/(\d+)/movements", "movements"),
+        ("GET",    r"/api/stock",                    "stock"),
+        ("POST",   r"/api/stock/corrections",        "stock_corrections"),
+        ("GET",    r"/api/purchases",                "purchases"),
+        ("POST",   r"/api/purchases",                "purchase_add"),
+        ("GET",    r"/api/sales",                    "sales"),
+        ("POST",   r"/api/sales",                    "sale_add"),
+        ("GET",    r"/api/sales/(\d+)",              "sale"),
+        ("DELETE", r"/api/sales/(\d+)",              "sale_delete"),
+        ("GET",    r"/api/sales/(\d+)/invoice",      "sale_invoice"),
+        ("GET",    r"/api/invoices",                 "invoices"),
+        ("GET",    r"/api/stats",                    "stats"),
+        ("GET",    r"/api/analytics/velocity",       "velocity"),
+    ]
+
+    def __init__(self, db_path, config, host="127.0.0.1", port=8765, workers=8, verbose=False):
+        self.db_path  = db_path
+        self.config   = config
+        self.verbose  = verbose
+        self._opts    = config.get_db_options()
+        self.writer   = _DBWriter(DB(db_path, **self._opts))   # migracja schematu przed czytnikami
+        self._routes  = [(m, re.compile(f"^{p}$"), name) for m, p, name in self.ROUTES]
+        self.httpd    = _PoolHTTPServer((host, port), type("Handler", (_ApiHandler,), {"api": self}), workers)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reader(self):
+        """Połączenie tylko do odczytu bieżącego wątku puli"""
+        return self.writer.db.reader()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        """Zamyka gniazdo, czeka na trwające żądania i zamyka połączenia (po shutdown())"""
+        self.httpd.server_close()
+        self.writer.stop()   # zamyka też połączenia czytników
+
+    def handle(self, method, path, query, body):
+        allowed = False
+        for m, rx, name in self._routes:
+            hit = rx.match(path)
+            if not hit: continue
+            if m == method: return getattr(self, f"_{name}")(*map(int, hit.groups()), q=query, body=body)
+            allowed = True
+        if allowed: raise ApiError(405, f"metoda {method} niedozwolona dla {path}")
+        raise ApiError(404, f"nieznany adres {path}")
+
+    # ── pomocnicze ──
+    @staticmethod
+    def _page(rows, q):
+        rows   = rows if isinstance(rows, list) else list(rows)
+        offset = int(q.get("offset", 0)); limit = int(q.get("limit", 100))
+        return {"total": len(rows), "offset": offset, "items": [dict(r) for r in rows[offset:offset + limit]]}
+
+    @staticmethod
+    def _field(body, name, kind, default=...):
+        v = body.get(name, default)
+        if v is ...: raise ApiError(400, f"brak pola '{name}'")
+        if not isinstance(v, kind) or isinstance(v, bool): raise ApiError(400, f"niepoprawne pole '{name}'")
+        return v
+
+    @staticmethod
+    def _date(v):
+        if v is None: return datetime.now().strftime("%Y-%m-%d")
+        datetime.strptime(v, "%Y-%m-%d")   # ValueError -> 400
+        return v
+
+    def _items(self, body, qty_field="qty"):
+        items = self._field(body, "items", list)
+        if not items: raise ApiError(400, "pusta lista 'items'")
+        for it in items:
+            if not isinstance(it, dict) or not ("product_id" in it or "sku" in it):
+                raise ApiError(400, "pozycja wymaga 'product_id' lub 'sku'")
+            q = self._field(it, qty_field, int)
+            if qty_field == "qty" and q <= 0: raise ApiError(400, "ilość musi być dodatnia")
+        return items
+
+    @staticmethod
+    def _resolve(db, items, qty_field="qty"):
+        """[(pid, ilość)] – w wątku zapisu, więc produkt nie zniknie przed zapisem"""
+        out = []
+        for it in items:
+            pid = it.get("product_id") or db.get_product_id_by_sku(it.get("sku"))
+            if not pid or not db.get_product_info(pid): raise ApiError(404, f"nieznany produkt {it}")
+            out.append((int(pid), it[qty_field]))
+        return out
+
+    # ── produkty i stany ──
+    def _health(self, q, body):
+        return 200, {"status": "ok", "version": APP_VERSION}
+
+    def _products(self, q, body):
+        return 200, self._page(self.reader().list_products(), q)
+
+    def _product(self, pid, q, body):
+        r = self.reader().get_product_info(pid)
+        if not r: raise ApiError(404, f"brak produktu {pid}")
+        return 200, dict(r)
+
+    def _movements(self, pid, q, body):
+        return 200, self._page(self.reader().list_movements(pid, q.get("from"), q.get("to")), q)
+
+    def _stock(self, q, body):
+        db  = self.reader()
+        if not q.get("sku"): raise ApiError(400, "podaj ?sku=")
+        pid = db.get_product_id_by_sku(q["sku"])
+        if pid is None: raise ApiError(404, f"brak produktu {q['sku']}")
+        out = {"product_id": pid, "sku": q["sku"], "stock": db.get_product_info(pid)["stock"]}
+        if q.get("date"): out["stock_at"] = db.stock_at(pid, self._date(q["date"]))
+        return 200, out
+
+    def _product_add(self, q, body):
+        sku, title = self._field(body, "sku", str), self._field(body, "title", str, "")
+        return 201, {"id": self.writer.call(lambda db: db.add_product(sku, title)), "sku": sku, "title": title}
+
+    def _stock_corrections(self, q, body):
+        items = self._items(body, "delta")
+        n = self.writer.call(lambda db: db.apply_stock_corrections(self._resolve(db, items, "delta")))
+        return 200, {"applied": n}
+
+    # ── zakupy i sprzedaż ──
+    def _purchases(self, q, body):
+        """?from=YYYY-MM-DD&to=YYYY-MM-DD – tylko zakupy z okresu"""
+        return 200, self._page(self.reader().list_purchases(q.get("from"), q.get("to")), q)
+
+    def _purchase_add(self, q, body):
+        total = float(self._field(body, "total_pln", (int, float)))
+        date  = self._date(body.get("date"))
+        items = self._items(body)
+        oid   = self.writer.call(lambda db: db.add_purchase_order(total, date, self._resolve(db, items)))
+        return 201, {"id": oid}
+
+    def _sales(self, q, body):
+        db     = self.reader()
+        offset = int(q.get("offset", 0)); limit = int(q.get("limit", 100))
+        return 200, {"total": db.count_sales(), "offset": offset,
+                     "items": [dict(r) for r in db.list_sales(limit, offset)]}
+
+    def _sale(self, sid, q, body):
+        s = self.reader().get_sale(sid)
+        if not s: raise ApiError(404, f"brak sprzedaży {sid}")
+        return 200, s
+
+    def _sale_add(self, q, body):
+        platform = self._field(body, "platform", str)
+        pln   = float(self._field(body, "total_pln", (int, float)))
+        date  = self._date(body.get("date"))
+        items = self._items(body)
+        eur   = body.get("total_eur")
+        # kurs NBP pobierany przed kolejką zapisu – wątek zapisu nie czeka na sieć
+        eur   = float(eur) if eur is not None else pln / get_eur_rate(date)
+        inv   = body.get("invoice")
+        if inv is not None:
+            if not isinstance(inv, dict): raise ApiError(400, "niepoprawne pole 'invoice'")
+            inv = {"prefix": inv.get("prefix") or self.config.get("invoice_prefix", "R"),
+                   "customer_name": inv.get("customer_name", ""), "customer_address": inv.get("customer_address", "")}
+        def write(db):
+            try: oid = db.add_sale_order(platform, pln, eur, self._resolve(db, items), 0.0, date, invoice=inv)
+            except ValueError as e: raise ApiError(409, str(e))
+            return db.get_sale(oid), db.get_sale_invoice(oid)
+        sale, invoice = self.writer.call(write)
+        return 201, dict(sale, invoice=invoice)
+
+    def _sale_delete(self, sid, q, body):
+        def write(db):
+            if not db.get_sale(sid): raise ApiError(404, f"brak sprzedaży {sid}")
+            try: db.delete_sale(sid)
+            except ValueError as e: raise ApiError(409, str(e))
+        self.writer.call(write)
+        return 200, {"deleted": sid}
+
+    def _sale_invoice(self, sid, q, body):
+        inv = self.reader().get_sale_invoice(sid)
+        if not inv: raise ApiError(404, f"brak rachunku dla sprzedaży {sid}")
+        return 200, inv
+
+    def _invoices(self, q, body):
+        return 200, self._page(self.reader().list_invoices(q.get("from"), q.get("to")), q)
+
+    # ── statystyki ──
+    def _stats(self, q, body):
+        """?year=&period=year|quarter|month|ttm&n= albo ?from=YYYY-MM&to=YYYY-MM"""
+        with self.writer.db.snapshot() as db: return self._stats_in(db, q)
+
+    def _stats_in(self, db, q):
+        if q.get("from"):
+            months = (q["from"], q.get("to", q["from"]))
+        else:
+            kind = q.get("period", "year")
+            if kind not in ("year", "quarter", "month", "ttm"): raise ApiError(400, f"nieznany okres '{kind}'")
+            if kind in ("quarter", "month") and not q.get("n"): raise ApiError(400, "podaj ?n= (numer kwartału / miesiąca)")
+            months = period_months(kind, int(q.get("year") or datetime.now().year), int(q.get("n") or 0))
+        return 200, {"months": months,
+                     "stats": db.get_stats(months=months),
+                     "previous_year": db.get_stats(months=period_shift(months)),
+                     "platforms": [dict(r) for r in db.get_platform_breakdown(months=months)],
+                     "revenue_limit": RevenueLimit(db, self.config).status()}
+
+    def _velocity(self, q, body):
+        """Rotacja produktów; ?dead=1 – tylko zalegające, ?limit=&offset="""
+        rows = self.reader().get_sku_velocity()
+        if q.get("dead") in ("1", "true"): rows = [r for r in rows if r["dead"]]
+        return 200, self._page(rows, q)
+
+
 # ─────────────────────────────────────────────────────────
 #  START
 # ─────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    import argparse
+    ap = argparse.ArgumentParser(description=APP_NAME)
+    ap.add_argument("--import", dest="import_file", metavar="PLIK",
+                    help="import CSV/XLSX bez uruchamiania interfejsu")
+    ap.add_argument("--dry-run", action="store_true", help="tylko walidacja importu, bez zapisu")
+    ap.add_argument("--marketplace", metavar="PLATFORMA", choices=PLATFORMS,
+                    help="--import to eksport zamówień z tej platformy (CSV/JSON)")
+    ap.add_argument("--db", metavar="PLIK", help="ścieżka bazy (domyślnie z config.json)")
+    ap.add_argument("--profile", nargs="?", const=50.0, type=float, metavar="MS",
+                    help="pomiar zapytań od startu (próg wolnego zapytania, domyślnie 50 ms)")
+    ap.add_argument("--api", nargs="?", const="127.0.0.1:8765", metavar="[HOST:]PORT",
+                    help="serwer API JSON bez interfejsu (domyślnie 127.0.0.1:8765)")
+    ap.add_argument("--api-workers", type=int, default=8, metavar="N", help="wątki obsługi żądań API")
+    ap.add_argument("--verbose", action="store_true", help="log każdego żądania API")
+    ap.add_argument("--archive-year", type=int, metavar="ROK",
+                    help="przenieś zamknięty rok (--close-year) do <baza>_archiwum/archive_ROK.db i zakończ")
+    ap.add_argument("--close-year", type=int, metavar="ROK",
+                    help="zamknij rok (bilans otwarcia partii FIFO, sumy roku) i zakończ")
+    args, qt_args = ap.parse_known_args()
+    if args.api:
+        cfg  = Config()
+        host, _, port = args.api.rpartition(":")
+        srv  = ApiServer(args.db or cfg.get_db_path(), cfg, host or "127.0.0.1", int(port),
+                         args.api_workers, args.verbose)
+        print(f"API: {srv.url}/api  (Ctrl+C kończy)", flush=True)
+        try: srv.serve_forever()
+        except KeyboardInterrupt: pass
+        finally: srv.close()
+        sys.exit(0)
+    if args.archive_year:
+        cfg = Config()
+        db  = DB(args.db or cfg.get_db_path(),**cfg.get_db_options())
+        try: n = db.archive_year(args.archive_year)
+        except ValueError as e: print(e); sys.exit(1)
+        print(f"{args.archive_year}: sprzedaże {n['sales']}, rachunki {n['invoices']}, zakupy {n['purchases']} "
+              f"-> {os.path.join(db.archive_dir(), f'archive_{args.archive_year}.db')}")
+        sys.exit(0)
+    if args.close_year:
+        cfg = Config()
+        db  = DB(args.db or cfg.get_db_path(),**cfg.get_db_options())
+        try: cp = db.close_year(args.close_year)
+        except ValueError as e: print(e); sys.exit(1)
+        print(f"{args.close_year}: sprzedaże {cp['sale_count']}, przychód {cp['revenue']:.2f}, koszt {cp['cost']:.2f}, "
+              f"zakupy {cp['purchase_count']}; bilans otwarcia {cp['lots']} partii, {cp['stock_qty']} szt., "
+              f"{cp['stock_value']:.2f} PLN")
+        sys.exit(0)
+    if args.import_file:
+        cfg = Config()
+        db  = DB(args.db or cfg.get_db_path(),**cfg.get_db_options())
+        if args.marketplace:
+            rep = db.import_marketplace_orders(args.marketplace, read_marketplace_rows(args.import_file), args.dry_run)
+            print(format_marketplace_report(args.marketplace, rep))
+        else:
+            rep = db.bulk_import(read_import_rows(args.import_file), dry_run=args.dry_run)
+            print(format_import_report(rep))
+        sys.exit(1 if rep["errors"] else 0)
+
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setApplicationName(APP_NAME)
-    apply_theme(app, THEME_DAY)   # domyślnie motyw dzienny
+    apply_theme(app, Config().get_theme())   # motyw zapisany w config.json (domyślnie dzienny)
     if not os.path.exists("data.db"):
         DB("data.db").conn.close()
     w = MainWindow()
+    if args.profile is not None:
+        w.db.enable_profiling(args.profile, os.path.join(os.path.dirname(os.path.abspath(w.db_path)), "slow_queries.log"))
     w.show()
     sys.exit(app.exec())
@@ -0,0 +1,124 @@
+"""
+Test obciążenia API JSON (python magazyn.py --api).
+
+    python tools/api_load.py                                  # własny serwer na danych "small"
+    python tools/api_load.py --clients 32 --seconds 20 --writes 0.2
+    python tools/api_load.py --url http://127.0.0.1:8765      # działający serwer (zapisuje do jego bazy!)
+
+Bez --url skrypt generuje bazę testową, uruchamia `magazyn.py --api 127.0.0.1:0`
+jako osobny proces i zatrzymuje go po teście. Każdy klient to wątek wysyłający
+mieszankę odczytów (produkty, stan, sprzedaż, statystyki) i zapisów (sprzedaż FIFO,
+zakup). Wynik: żądania/s oraz p50/p99 opóźnienia dla każdego rodzaju żądania.
+Kod wyjścia 1 = odpowiedzi 5xx lub błędy połączenia.
+"""
+
+import os, sys, json, time, random, argparse, tempfile, threading, subprocess, urllib.request, urllib.error
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def request(url, method="GET", body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req  = urllib.request.Request(url, data, {"Content-Type": "application/json"}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as r: return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def start_server(db, workers):
+    p = subprocess.Popen([sys.executable, os.path.join(ROOT, "magazyn.py"), "--api", "127.0.0.1:0",
+                          "--api-workers", str(workers), "--db", db],
+                         stdout=subprocess.PIPE, text=True, env=dict(os.environ, QT_QPA_PLATFORM="offscreen"))
+    line = p.stdout.readline()
+    if not line.startswith("API: "):
+        p.kill(); raise RuntimeError(f"serwer nie wystartował: {line!r}")
+    return p, line.split()[1].removesuffix("/api")
+
+
+READS = {
+    "GET stock":    lambda rnd, skus: f"/api/stock?sku={rnd.choice(skus)}",
+    "GET products": lambda rnd, skus: "/api/products?limit=50",
+    "GET sales":    lambda rnd, skus: "/api/sales?limit=50",
+    "GET stats":    lambda rnd, skus: f"/api/stats?period=quarter&n={rnd.randint(1, 4)}",
+}
+
+
+def client(base, skus, seconds, writes, seed, out):
+    rnd, lat, err = random.Random(seed), {}, {"5xx": 0, "conn": 0}
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        r = rnd.random()
+        if r < writes * 0.7:
+            kind, method, path = "POST sales", "POST", "/api/sales"
+            body = {"platform": "Allegro", "total_pln": 99.0, "total_eur": 23.0, "date": "2001-01-01",
+                    "items": [{"sku": rnd.choice(skus), "qty": 1}]}
+        elif r < writes:
+            kind, method, path = "POST purchases", "POST", "/api/purchases"
+            body = {"total_pln": 50.0, "date": "2000-01-01", "items": [{"sku": rnd.choice(skus), "qty": 5}]}
+        else:
+            kind   = rnd.choice(list(READS)); method, body = "GET", None
+            path   = READS[kind](rnd, skus)
+        t = time.perf_counter()
+        try:
+            status, _ = request(base + path, method, body)
+            if status >= 500: err["5xx"] += 1
+        except OSError:
+            err["conn"] += 1; continue
+        lat.setdefault(kind, []).append(time.perf_counter() - t)
+    out.append((lat, err))
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))] * 1000
+
+
+def run(base, clients, seconds, writes, seed):
+    skus = [p["sku"] for p in request(base + "/api/products?limit=100000")[1]["items"]]
+    if not skus: raise RuntimeError("brak produktów w bazie serwera")
+    out = []
+    ts  = [threading.Thread(target=client, args=(base, skus, seconds, writes, seed + i, out)) for i in range(clients)]
+    t = time.perf_counter()
+    for th in ts: th.start()
+    for th in ts: th.join()
+    elapsed = time.perf_counter() - t
+
+    lat = {}
+    for l, _ in out:
+        for k, v in l.items(): lat.setdefault(k, []).extend(v)
+    err = {k: sum(e[k] for _, e in out) for k in ("5xx", "conn")}
+    total = sum(map(len, lat.values()))
+    print(f"{clients} klientów x {seconds} s, zapisy {writes:.0%}: {total} żądań, {total / elapsed:.0f} req/s")
+    print(f"  {'żądanie':<16}{'liczba':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for k in sorted(lat):
+        print(f"  {k:<16}{len(lat[k]):>8}{pct(lat[k], 50):>9.1f}{pct(lat[k], 99):>9.1f}")
+    allv = [x for v in lat.values() for x in v]
+    print(f"  {'razem':<16}{total:>8}{pct(allv, 50):>9.1f}{pct(allv, 99):>9.1f}")
+    print(f"błędy 5xx {err['5xx']}, błędy połączenia {err['conn']}")
+    return not err["5xx"] and not err["conn"]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Test obciążenia API JSON")
+    ap.add_argument("--url", help="adres działającego serwera (domyślnie uruchamiany własny)")
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--writes", type=float, default=0.1, help="odsetek żądań zapisu")
+    ap.add_argument("--workers", type=int, default=8, help="wątki serwera (gdy uruchamiany własny)")
+    ap.add_argument("--scale", default="small", help="rozmiar danych testowych (generate_data.py)")
+    ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    if a.url:
+        ok = run(a.url.rstrip("/"), a.clients, a.seconds, a.writes, a.seed)
+    else:
+        from generate_data import generate, SCALES
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "api.db")
+            generate(db, **SCALES[a.scale])
+            proc, base = start_server(db, a.workers)
+            try: ok = run(base, a.clients, a.seconds, a.writes, a.seed)
+            finally: proc.terminate(); proc.wait()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,344 @@
+"""
+Benchmark warstwy DB, odświeżania dashboardu i generatorów raportów.
+
+    python tools/benchmark.py                         # small + medium
+    python tools/benchmark.py --scales small medium large --out wyniki.json
+    python tools/benchmark.py --compare bench_results/stary.json
+
+Bazy testowe powstają w bench_data/ (tools/generate_data.py) i są używane
+ponownie, dopóki nie poda się --regen. Wyniki (min / mediana / średnia w ms)
+zapisywane są jako JSON, --compare wypisuje zmianę względem innego pliku.
+Przypadki mem.* podają pamięć (MB) odczytów całej historii sprzedaży,
+theme.toggle – przełączenie motywu z otwartym dashboardem i tabelą produktów.
+"""
+
+import os, sys, gc, json, time, shutil, inspect, argparse, itertools, platform, statistics, subprocess, tempfile, tracemalloc
+from datetime import datetime
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sqlite3
+import magazyn
+from magazyn import DB, Config
+from generate_data import SCALES, generate
+
+
+def ctx_for(db):
+    """Deterministyczne argumenty dla przypadków testowych"""
+    c = db.conn
+    year = c.execute("SELECT MAX(strftime('%Y',date)) FROM sales_orders").fetchone()[0] or str(datetime.now().year)
+    pid  = c.execute("SELECT product_id FROM purchase_items WHERE available_qty>0 ORDER BY id LIMIT 1").fetchone()[0]
+    return {
+        "year": int(year), "df": f"{year}-01-01", "dt": f"{year}-12-31",
+        "pid": pid, "sku": c.execute("SELECT sku FROM products WHERE id=?", (pid,)).fetchone()[0],
+        "sale_ids":  [r[0] for r in c.execute("SELECT id FROM sales_orders ORDER BY id DESC LIMIT 200")],
+        "item_ids":  [r[0] for r in c.execute("SELECT id FROM purchase_items ORDER BY id DESC LIMIT 200")],
+        "inv_ids":   [r[0] for r in c.execute("SELECT id FROM invoices ORDER BY id DESC LIMIT 200")],
+        "n": 0,
+    }
+
+
+def _seq(x):
+    x["n"] += 1; return x["n"]
+
+
+def _drain(it):
+    for _ in it: pass
+
+
+def unit_of_work(db, x):
+    """100 korekt stanu w jednej transakcji (jeden COMMIT)"""
+    with db.transaction():
+        for _ in range(100): db.update_stock(x["pid"], 0)
+
+
+def report_snapshot(db, x):
+    """Odczyty raportu rocznego w jednej migawce na połączeniu do odczytu"""
+    with db.snapshot() as r:
+        r.get_detailed_sales(x["df"], x["dt"]); r.list_purchases(x["df"], x["dt"]); r.get_stats(x["year"])
+
+
+# nazwa -> (funkcja(db, ctx), czy zmienia dane)
+DB_CASES = {
+    "add_product":              (lambda db, x: db.add_product(f"BENCH-{_seq(x)}", "Bench"), True),
+    "check_sku_exists":         (lambda db, x: db.check_sku_exists(x["sku"]), False),
+    "get_product_id_by_sku":    (lambda db, x: db.get_product_id_by_sku(x["sku"]), False),
+    "list_products":            (lambda db, x: db.list_products(), False),
+    "iter_products":            (lambda db, x: _drain(db.iter_products()), False),
+    "get_product_info":         (lambda db, x: db.get_product_info(x["pid"]), False),
+    "update_stock":             (lambda db, x: db.update_stock(x["pid"], 0), True),
+    "apply_stock_corrections":  (lambda db, x: db.apply_stock_corrections([(x["pid"], 1), (x["pid"], -1)]), True),
+    "check_stock":              (lambda db, x: db.check_stock(x["pid"], 1), False),
+    "update_product":           (lambda db, x: db.update_product(x["pid"], x["sku"], "Bench"), True),
+    "delete_product":           (lambda db, x: db.delete_product(x["pid"]), True),
+    "stock_at":                 (lambda db, x: db.stock_at(x["pid"], x["df"]), False),
+    "list_movements":           (lambda db, x: db.list_movements(x["pid"]), False),
+    "verify_stock_cache":       (lambda db, x: db.verify_stock_cache(), False),
+    "rebuild_stock_snapshots":  (lambda db, x: db.rebuild_stock_snapshots(), True),
+    "add_purchase_order":       (lambda db, x: db.add_purchase_order(100.0, x["df"], [(x["pid"], 10)]), True),
+    "list_purchases":           (lambda db, x: db.list_purchases(x["df"], x["dt"]), False),
+    "iter_purchases":           (lambda db, x: _drain(db.iter_purchases(x["df"], x["dt"])), False),
+    "delete_purchase":          (lambda db, x: db.delete_purchase(x["item_ids"].pop()) if x["item_ids"] else None, True),
+    "get_fifo_batches":         (lambda db, x: db.get_fifo_batches(x["pid"], 5), False),
+    "add_sale_order":           (lambda db, x: db.add_sale_order("OLX", 50.0, 11.0, [(x["pid"], 1)], 0.0, x["dt"],
+                                                             invoice={"prefix": "B"}), True),
+    "list_sales":               (lambda db, x: db.list_sales(), False),
+    "list_sales_page":          (lambda db, x: db.list_sales(50, 100), False),
+    "iter_sales":               (lambda db, x: _drain(db.iter_sales(x["df"], x["dt"])), False),
+    "count_sales":              (lambda db, x: db.count_sales(), False),
+    "get_sale":                 (lambda db, x: db.get_sale(x["sale_ids"][0]), False),
+    "delete_sale":              (lambda db, x: db.delete_sale(x["sale_ids"].pop()) if x["sale_ids"] else None, True),
+    "get_detailed_sales":       (lambda db, x: db.get_detailed_sales(x["df"], x["dt"]), False),
+    "iter_sale_lines":          (lambda db, x: _drain(db.iter_sale_lines(x["df"], x["dt"])), False),
+    "add_invoice":              (lambda db, x: db.add_invoice(f"B/{_seq(x)}", None, None, "Bench", "", 10.0), True),
+    "list_invoices":            (lambda db, x: db.list_invoices(x["df"], x["dt"]), False),
+    "iter_invoices":            (lambda db, x: _drain(db.iter_invoices(x["df"], x["dt"])), False),
+    "delete_invoice":           (lambda db, x: db.delete_invoice(x["inv_ids"].pop()) if x["inv_ids"] else None, True),
+    "next_invoice_number":      (lambda db, x: db.next_invoice_number("B"), True),
+    "seed_invoice_sequence":    (lambda db, x: db.seed_invoice_sequence("B", x["year"], 1), True),
+    "reset_invoice_sequence":   (lambda db, x: db.reset_invoice_sequence("B"), True),
+    "get_sale_invoice":         (lambda db, x: db.get_sale_invoice(x["sale_ids"][0]), False),
+    "set_invoice_file":         (lambda db, x: db.set_invoice_file(x["inv_ids"][0], None), True),
+    "inventory_valuation":      (lambda db, x: db.inventory_valuation(x["dt"]), False),
+    "get_stats":                (lambda db, x: db.get_stats(x["year"]), False),
+    "get_monthly_revenue":      (lambda db, x: db.get_monthly_revenue(x["year"]), False),
+    "get_sales_series":         (lambda db, x: db.get_sales_series(x["df"], x["dt"], "day"), False),
+    "get_period_revenue":       (lambda db, x: db.get_period_revenue(magazyn.period_months("quarter", x["year"], 2)), False),
+    "get_platform_breakdown":   (lambda db, x: db.get_platform_breakdown(x["year"]), False),
+    "get_sales_totals":         (lambda db, x: db.get_sales_totals(x["df"], x["dt"]), False),
+    "get_report_orders":        (lambda db, x: db.get_report_orders(x["df"], x["dt"]), False),
+    "get_sku_profitability":    (lambda db, x: db.get_sku_profitability(x["df"], x["dt"]), False),
+    "get_sku_velocity":         (lambda db, x: (db._cache.clear(), db.get_sku_velocity()), False),
+    "get_daily_sales":          (lambda db, x: db.get_daily_sales(x["df"], x["dt"]), False),
+    "get_platform_sales_count": (lambda db, x: db.get_platform_sales_count("OLX", x["year"]), False),
+    "bulk_import":              (lambda db, x: db.bulk_import([(2, {"kind": "produkt", "sku": f"BI-{_seq(x)}",
+                                                                    "title": "Bench"})]), True),
+    "import_marketplace_orders":(lambda db, x: db.import_marketplace_orders("OLX", [(2, {
+                                    "order": f"MP-{_seq(x)}", "date": x["dt"], "sku": x["sku"], "qty": "1",
+                                    "amount": "25", "eur": "6"})]), True),
+    "set_listing_sku":          (lambda db, x: db.set_listing_sku("OLX", "BENCH-OFFER", x["pid"]), True),
+    "list_listing_skus":        (lambda db, x: db.list_listing_skus("OLX"), False),
+    "data_version":             (lambda db, x: db.data_version(), False),
+    "check_invariants":         (lambda db, x: db.check_invariants(), False),
+    "rebuild_period_totals":    (lambda db, x: db.rebuild_period_totals(), True),
+    "verify_platform_counters": (lambda db, x: db.verify_platform_counters(), False),
+    "rebuild_platform_counters":(lambda db, x: db.rebuild_platform_counters(), True),
+    "transaction":              (lambda db, x: unit_of_work(db, x), True),
+    "snapshot":                 (lambda db, x: report_snapshot(db, x), False),
+    "backup":                   (lambda db, x: db.backup(os.path.join(x["tmp"], "backup.db")), False),
+    "export_csv":               (lambda db, x: db.export_csv(os.path.join(x["tmp"], "e.csv"), x["df"], x["dt"]), False),
+    "list_archives":            (lambda db, x: db.list_archives(), False),
+    "closed_until":             (lambda db, x: db.closed_until(), False),
+    "list_closed_periods":      (lambda db, x: db.list_closed_periods(), False),
+    "closed_period":            (lambda db, x: db.closed_period(x["year"] - 1), False),
+}
+
+# odczyty historyczne powtarzane po przeniesieniu najstarszego roku do archiwum (widoki UNION ALL)
+ARCHIVED_CASES = ("list_sales_page", "count_sales", "get_detailed_sales", "get_report_orders", "get_sales_totals",
+                  "get_sku_profitability", "inventory_valuation", "list_invoices", "check_invariants")
+
+
+# odczyty powtarzane po zamknięciu zakończonych lat (od bilansu otwarcia, sumy z closed_periods)
+CLOSED_CASES = ("get_fifo_batches", "inventory_valuation", "get_sales_totals", "get_stats", "get_sku_velocity",
+                "check_invariants")
+
+# metody narzędziowe, których nie mierzymy
+NOT_TIMED = {"enable_profiling", "disable_profiling", "reader", "close_readers", "close", "restore",
+             "archive_dir", "archive_year",   # archive_year – jednorazowo w archived_cases()
+             "close_year"}                    # close_year – jednorazowo w closed_cases()
+
+
+def dashboard_queries(db, x):
+    """Zapytania wykonywane przez DashboardWidget.refresh()"""
+    months = magazyn.period_months("year", x["year"])
+    db.get_stats(months=months); db.get_stats(months=magazyn.period_shift(months)); db.get_stats()
+    db.get_sales_series(x["df"], x["dt"], "month")
+    db.get_sales_series(f"{x['year']-1}-01-01", f"{x['year']-1}-12-31", "month")
+    for p in db.get_platform_breakdown(x["year"]):
+        db.get_platform_sales_count(p["platform"], x["year"])
+
+
+def chart_10y_daily():
+    """Wykres z 4 seriami dziennymi z 10 lat (deterministyczne dane)"""
+    import random
+    rnd   = random.Random(1); n = 3653
+    chart = magazyn.MonthlyBarChart(); chart.resize(900, 240)
+    chart.set_series([str(i) for i in range(n)],
+                     {k: [rnd.uniform(0, 1000) for _ in range(n)] for k in chart.SERIES})
+    for k in chart.SERIES: chart.set_visible(k, True)
+    return chart
+
+
+def archived_cases(src, tmp, case, res, scale):
+    """Kopia bazy z najstarszym zakończonym rokiem zamkniętym i przeniesionym do archive_YYYY.db:
+    czas przeniesienia (jeden pomiar) i odczyty historyczne przez widoki archiwum"""
+    work = os.path.join(tmp, f"{scale}_arch.db"); shutil.copy2(src, work)
+    db   = DB(work)
+    year = int(db.conn.execute("SELECT MIN(date) FROM sales_orders").fetchone()[0][:4])
+    if year >= datetime.now().year: db.close(); return
+    db.close_year(year)   # archiwizować można tylko zamknięty rok
+    t = time.perf_counter(); n = db.archive_year(year)
+    res["db.archive_year"] = {"min_ms": round((time.perf_counter() - t) * 1000, 3), "runs": 1,
+                              "median_ms": round((time.perf_counter() - t) * 1000, 3), **n}
+    print(f"[{scale}] db.archive_year({year}){'':<17} {res['db.archive_year']['median_ms']:>10.3f} ms  {n}")
+    x = ctx_for(db); x.update(tmp=tmp, df=f"{year}-07-01", dt=f"{year+1}-06-30")   # okres na granicy archiwum
+    for name in ARCHIVED_CASES:
+        case(f"archived.{name}", lambda fn=DB_CASES[name][0]: fn(db, x))
+    db.close()
+
+
+def closed_cases(src, tmp, case, res, scale):
+    """Kopia bazy z zamkniętymi wszystkimi zakończonymi latami: łączny czas close_year (jeden
+    pomiar) i odczyty za ostatni zamknięty rok – wycena od partii bilansu otwarcia"""
+    work  = os.path.join(tmp, f"{scale}_closed.db"); shutil.copy2(src, work)
+    db    = DB(work)
+    first = int(db.conn.execute("SELECT MIN(date) FROM sales_orders").fetchone()[0][:4])
+    last  = datetime.now().year - 1
+    if first > last: db.close(); return
+    t = time.perf_counter()
+    for y in range(first, last + 1): cp = db.close_year(y)
+    ms = round((time.perf_counter() - t) * 1000, 3)
+    res["db.close_year"] = {"min_ms": ms, "median_ms": ms, "runs": 1, "years": last - first + 1, "lots": cp["lots"]}
+    print(f"[{scale}] db.close_year({first}..{last}){'':<11} {ms:>10.3f} ms  bilans otwarcia {cp['lots']} partii")
+    x = ctx_for(db); x.update(tmp=tmp, year=last, df=f"{last}-01-01", dt=f"{last}-12-31")
+    for name in CLOSED_CASES:
+        case(f"closed.{name}", lambda fn=DB_CASES[name][0]: fn(db, x))
+    db.close()
+
+
+# pamięć list całej historii: zajęte po wczytaniu (retained) i szczyt w trakcie, iter_* – tylko szczyt
+MEMORY_CASES = {
+    "list_sales":         lambda db: db.list_sales(),
+    "iter_sales":         lambda db: _drain(db.iter_sales()),
+    "get_detailed_sales": lambda db: db.get_detailed_sales("", "9999-12-31"),
+    "iter_sale_lines":    lambda db: _drain(db.iter_sale_lines("", "9999-12-31")),
+    "list_purchases":     lambda db: db.list_purchases(),
+    "list_invoices":      lambda db: db.list_invoices(),
+}
+
+
+def memory_cases(db, res, scale, only):
+    """tracemalloc dla odczytów całej historii (MB) – jeden pomiar, bez wpływu na czasy"""
+    for name, fn in MEMORY_CASES.items():
+        if only and not any(o in f"mem.{name}" for o in only): continue
+        gc.collect(); tracemalloc.start()
+        rows = fn(db); cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        res[f"mem.{name}"] = r = {"rows": len(rows) if rows is not None else None,
+                                  "retained_mb": round(cur / 2**20, 1), "peak_mb": round(peak / 2**20, 1)}
+        del rows
+        print(f"[{scale}] mem.{name:<32} {r['retained_mb']:>8.1f} MB zajęte, szczyt {r['peak_mb']:.1f} MB"
+              + (f"  ({r['rows']} wierszy)" if r["rows"] is not None else ""))
+
+
+def measure(fn, min_time=0.3, max_runs=50, min_runs=3):
+    times = []
+    t_end = time.perf_counter() + min_time
+    while len(times) < min_runs or (len(times) < max_runs and time.perf_counter() < t_end):
+        t = time.perf_counter(); fn(); times.append((time.perf_counter() - t) * 1000)
+    return {"min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3),
+            "mean_ms": round(statistics.fmean(times), 3), "runs": len(times)}
+
+
+def run_scale(scale, regen, only, tmp):
+    src = os.path.join(ROOT, "bench_data", f"{scale}.db")
+    os.makedirs(os.path.dirname(src), exist_ok=True)
+    if regen or not os.path.exists(src):
+        t = time.perf_counter(); generate(src, **SCALES[scale])
+        print(f"[{scale}] wygenerowano dane w {time.perf_counter()-t:.1f} s")
+    work = os.path.join(tmp, f"{scale}.db"); shutil.copy2(src, work)
+    db = DB(work); x = ctx_for(db); x["tmp"] = tmp
+    res = {}
+
+    missing = sorted(n for n, f in inspect.getmembers(DB, inspect.isfunction)
+                     if not n.startswith("_") and n not in DB_CASES and n not in NOT_TIMED)
+    if missing: print(f"[{scale}] bez benchmarku: {', '.join(missing)}")
+
+    def case(name, fn):
+        if only and not any(o in name for o in only): return
+        try: res[name] = measure(fn)
+        except ImportError as e: res[name] = {"skipped": str(e)}
+        r = res[name]
+        print(f"[{scale}] {name:<36} " + (f"{r['median_ms']:>10.3f} ms  (min {r['min_ms']:.3f}, n={r['runs']})"
+                                          if "median_ms" in r else r["skipped"]))
+
+    # najpierw odczyty, potem operacje zmieniające dane
+    for name, (fn, mutating) in sorted(DB_CASES.items(), key=lambda kv: kv[1][1]):
+        case(f"db.{name}", lambda fn=fn: fn(db, x))
+    case("dashboard.queries", lambda: dashboard_queries(db, x))
+    if not only or any(o in f"archived.{n}" for o in only for n in ARCHIVED_CASES + ("archive_year",)):
+        archived_cases(src, tmp, case, res, scale)
+    if not only or any(o in f"closed.{n}" for o in only for n in CLOSED_CASES + ("close_year",)):
+        closed_cases(src, tmp, case, res, scale)
+    memory_cases(db, res, scale, only)
+
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    magazyn.apply_theme(app, magazyn.THEME_DAY)
+    cfg = Config(os.path.join(tmp, "config.json"))
+    case("forecast.reorder", lambda: magazyn.ReorderForecast(db, cfg).compute())
+    dash = magazyn.DashboardWidget(db, cfg)
+    case("dashboard.refresh", dash.refresh)
+    case("dashboard.refresh_if_changed", dash.refresh_if_changed)
+    # przełączenie motywu z otwartym dashboardem i pełną tabelą produktów
+    prods  = magazyn.ProductsWidget(db, cfg); dash.show(); prods.show(); app.processEvents()
+    themes = itertools.cycle((magazyn.THEME_NIGHT, magazyn.THEME_DAY))
+    case("theme.toggle", lambda: (magazyn.apply_theme(app, next(themes)), app.processEvents()))
+    magazyn.apply_theme(app, magazyn.THEME_DAY)
+    chart = chart_10y_daily()
+    case("chart.render_10y_daily", lambda: (chart.invalidate(), chart.grab()))
+    case("chart.repaint_cached", chart.grab)
+    rep = magazyn.ReportDialog(db, cfg, None, "yearly"); rep.year_sp.setValue(x["year"])
+    rep.cb_purchases.setChecked(True)
+    case("report.dataset", lambda: magazyn.ReportDataset(db, x["df"], x["dt"], True, True, False))
+    ds = rep.dataset()
+    for fmt in ("csv", "xlsx", "pdf"):
+        gen = getattr(rep, f"_gen_{fmt}")
+        case(f"report.{fmt}", lambda gen=gen, fmt=fmt: gen(ds, os.path.join(tmp, f"r.{fmt}")))
+    rep.deleteLater(); dash.deleteLater(); prods.deleteLater(); chart.deleteLater(); app.processEvents()
+    db.close(); cfg.flush()
+    return res
+
+
+def meta():
+    try: rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError: rev = ""
+    return {"timestamp": datetime.now().isoformat(timespec="seconds"), "git": rev,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "machine": platform.platform(), "app_version": magazyn.APP_VERSION}
+
+
+def compare(new, old_path):
+    with open(old_path, encoding="utf-8") as f: old = json.load(f)["results"]
+    print(f"\nPorównanie z {old_path} (mediana):")
+    for scale, cases in new.items():
+        for name, r in cases.items():
+            o = old.get(scale, {}).get(name, {})
+            if "median_ms" in r and o.get("median_ms"):
+                ratio = r["median_ms"] / o["median_ms"]
+                print(f"[{scale}] {name:<36} {o['median_ms']:>10.3f} -> {r['median_ms']:>10.3f} ms  x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark Systemu Magazynowo-Sprzedażowego")
+    ap.add_argument("--scales", nargs="+", choices=SCALES, default=["small", "medium"])
+    ap.add_argument("--only", nargs="+", metavar="FRAGMENT", help="tylko przypadki zawierające fragment nazwy")
+    ap.add_argument("--regen", action="store_true", help="wygeneruj bazy testowe od nowa")
+    ap.add_argument("--out", metavar="PLIK")
+    ap.add_argument("--compare", metavar="PLIK")
+    a = ap.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for s in a.scales: results[s] = run_scale(s, a.regen, a.only, tmp)
+    out = a.out or os.path.join(ROOT, "bench_results", f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta(), "scales": {s: SCALES[s] for s in a.scales}, "results": results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nZapisano: {out}")
+    if a.compare: compare(results, a.compare)
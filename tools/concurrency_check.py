@@ -0,0 +1,141 @@
+"""
+Test współbieżności: N procesów sprzedaje i kupuje na jednym pliku bazy.
+
+    python tools/concurrency_check.py                       # 4 procesy x 200 operacji
+    python tools/concurrency_check.py --workers 8 --ops 500 --busy-timeout 2000
+    python tools/concurrency_check.py --readers 2              # + procesy czytające raporty
+
+Każdy proces ma własne połączenie (jak osobna instancja programu). Po zakończeniu
+sprawdzane są niezmienniki: DB.check_invariants() oraz zgodność liczby zapisanych
+sprzedaży i zakupów z raportami procesów. Procesy czytające (--readers) w pętli czytają
+raport w DB.snapshot() i sprawdzają, że widzą spójny stan (stany = suma rejestru ruchów,
+ruchy sprzedaży = pozycje sprzedaży); podawany jest też najdłuższy czas operacji zapisu.
+Kod wyjścia 1 = wykryto niezgodność.
+"""
+
+import os, sys, time, random, sqlite3, argparse, tempfile, multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from magazyn import DB, PLATFORMS
+
+
+def setup(path, products, start_qty):
+    db = DB(path)
+    for i in range(products): db.add_product(f"CC-{i:04d}", f"Produkt {i}")
+    ids = [r["id"] for r in db.conn.execute("SELECT id FROM products ORDER BY id")]
+    for pid in ids: db.add_purchase_order(start_qty * 10.0, "2000-01-01", [(pid, start_qty)])
+    db.conn.close()
+    return ids
+
+
+def worker(path, ids, ops, seed, busy_timeout, retries, out):
+    rnd = random.Random(seed)
+    st  = {"sales": 0, "sale_qty": 0, "rejected": 0, "purchases": 0, "purchase_qty": 0, "locked": 0, "failed": 0,
+           "max_write_ms": 0.0}
+    try:
+        db = DB(path, busy_timeout=busy_timeout, write_retries=retries)
+        for _ in range(ops):
+            t = time.perf_counter()
+            try:
+                if rnd.random() < 0.65:
+                    items = [(pid, rnd.randint(1, 3)) for pid in rnd.sample(ids, rnd.randint(1, 2))]
+                    try:
+                        db.add_sale_order(rnd.choice(PLATFORMS), 100.0, 23.0, items, 0.0, "2001-01-01")
+                        st["sales"] += 1; st["sale_qty"] += sum(q for _, q in items)
+                    except ValueError:
+                        st["rejected"] += 1
+                else:
+                    pid, qty = rnd.choice(ids), rnd.randint(1, 10)
+                    db.add_purchase_order(qty * 12.5, "2001-01-01", [(pid, qty)])
+                    st["purchases"] += 1; st["purchase_qty"] += qty
+            except sqlite3.OperationalError:
+                st["locked"] += 1
+            st["max_write_ms"] = max(st["max_write_ms"], (time.perf_counter() - t) * 1000)
+        db.conn.close()
+    except Exception as e:
+        print(f"proces {seed}: {e}", file=sys.stderr); st["failed"] += 1
+    finally:
+        out.put(st)
+
+
+def reader(path, stop, out):
+    """Raporty w pętli: każdy w jednej migawce musi widzieć spójne dane"""
+    st = {"reports": 0, "inconsistent": 0}
+    db = DB(path)
+    while not stop.is_set():
+        with db.snapshot() as r:
+            r.get_detailed_sales("2001-01-01", "2001-12-31"); list(r.list_purchases("2001-01-01", "2001-12-31"))
+            stock = r.conn.execute("SELECT COALESCE(SUM(stock),0) FROM products").fetchone()[0]
+            moved = r.conn.execute("SELECT COALESCE(SUM(qty),0) FROM stock_movements").fetchone()[0]
+            sold  = r.conn.execute("SELECT COALESCE(SUM(qty),0) FROM sales_items").fetchone()[0]
+            out_m = r.conn.execute("SELECT COALESCE(-SUM(qty),0) FROM stock_movements WHERE kind='sale'").fetchone()[0]
+        st["reports"] += 1
+        if stock != moved or sold != out_m: st["inconsistent"] += 1
+    db.close()
+    out.put(st)
+
+
+def run(path, workers, ops, products, start_qty, busy_timeout, retries, seed, readers=0):
+    ids = setup(path, products, start_qty)
+    q   = multiprocessing.Queue(); rq = multiprocessing.Queue(); stop = multiprocessing.Event()
+    ps  = [multiprocessing.Process(target=worker, args=(path, ids, ops, seed + i, busy_timeout, retries, q))
+           for i in range(workers)]
+    rs  = [multiprocessing.Process(target=reader, args=(path, stop, rq)) for _ in range(readers)]
+    for p in rs: p.start()
+    t = time.perf_counter()
+    for p in ps: p.start()
+    stats = [q.get() for _ in ps]
+    for p in ps: p.join()
+    elapsed = time.perf_counter() - t
+    stop.set()
+    rstats = [rq.get() for _ in rs]
+    for p in rs: p.join()
+
+    tot = {k: sum(s[k] for s in stats) for k in stats[0]}
+    tot["max_write_ms"] = max(s["max_write_ms"] for s in stats)
+    db  = DB(path)
+    problems = db.check_invariants()
+    n_sales  = db.conn.execute("SELECT COUNT(*) FROM sales_orders").fetchone()[0]
+    sold     = db.conn.execute("SELECT COALESCE(SUM(qty),0) FROM sales_items").fetchone()[0]
+    n_purch  = db.conn.execute("SELECT COUNT(*) FROM purchase_orders").fetchone()[0] - len(ids)
+    stock    = db.conn.execute("SELECT SUM(stock) FROM products").fetchone()[0]
+    if n_sales != tot["sales"] or sold != tot["sale_qty"]:
+        problems.append(f"sprzedaże w bazie {n_sales} ({sold} szt.), zgłoszone {tot['sales']} ({tot['sale_qty']} szt.)")
+    if n_purch != tot["purchases"]:
+        problems.append(f"zakupy w bazie {n_purch}, zgłoszone {tot['purchases']}")
+    expected = len(ids) * start_qty + tot["purchase_qty"] - tot["sale_qty"]
+    if stock != expected:
+        problems.append(f"łączny stan {stock}, oczekiwany {expected}")
+    db.conn.close()
+
+    print(f"{workers} procesów x {ops} operacji w {elapsed:.2f} s  "
+          f"({workers * ops / elapsed:.0f} op/s)")
+    print(f"sprzedaże {tot['sales']} (odrzucone z braku towaru {tot['rejected']}), "
+          f"zakupy {tot['purchases']}, błędy blokady {tot['locked']}, przerwane procesy {tot['failed']}")
+    print(f"najdłuższy zapis {tot['max_write_ms']:.0f} ms")
+    if rstats:
+        rep, bad = sum(s["reports"] for s in rstats), sum(s["inconsistent"] for s in rstats)
+        print(f"raporty w migawce: {rep}, niespójne {bad}")
+        if bad: problems.append(f"{bad} raportów widziało niespójny stan")
+    for p in problems: print("  ✗", p)
+    print("OK – niezmienniki zachowane" if not problems else f"BŁĄD – {len(problems)} niezgodności")
+    return not problems and not tot["locked"] and not tot["failed"]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Test współbieżnego dostępu do bazy")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--ops", type=int, default=200, help="operacji na proces")
+    ap.add_argument("--products", type=int, default=10)
+    ap.add_argument("--start-qty", type=int, default=50)
+    ap.add_argument("--busy-timeout", type=int, default=5000, metavar="MS")
+    ap.add_argument("--retries", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--readers", type=int, default=0, help="procesy czytające raporty w migawce")
+    ap.add_argument("--db", metavar="PLIK", help="plik bazy (domyślnie tymczasowy; zostanie nadpisany)")
+    a = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = a.db or os.path.join(tmp, "concurrency.db")
+        if os.path.exists(path): os.remove(path)
+        ok = run(path, a.workers, a.ops, a.products, a.start_qty, a.busy_timeout, a.retries, a.seed, a.readers)
+    sys.exit(0 if ok else 1)
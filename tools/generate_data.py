@@ -0,0 +1,101 @@
+"""
+Generator syntetycznych danych sklepu (deterministyczny – stałe ziarno).
+
+    python tools/generate_data.py --scale medium --out bench_data/medium.db
+    python tools/generate_data.py --products 500 --lots 4 --sales 20000 --years 2 --out demo.db
+
+Dane trafiają do bazy przez DB.bulk_import, więc FIFO, stany i wszystkie
+tabele pomocnicze są liczone dokładnie tak jak w programie.
+"""
+
+import os, sys, random, argparse, time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from magazyn import DB, PLATFORMS
+
+SCALES = {
+    "small":  dict(products=200,    lots=3,  sales=2_000,   years=1),
+    "medium": dict(products=2_000,  lots=5,  sales=50_000,  years=3),
+    "large":  dict(products=10_000, lots=10, sales=300_000, years=5),
+}
+
+
+def generate(path, products, lots, sales, years, invoices=0.3, seed=42, end_year=None):
+    """Tworzy bazę `path` i zwraca słownik z parametrami generowania"""
+    if os.path.exists(path): os.remove(path)
+    rnd      = random.Random(seed)
+    end_year = end_year or datetime.now().year
+    start    = datetime(end_year - years + 1, 1, 1)
+    n_days   = (datetime(end_year, 12, 31) - start).days + 1
+    day      = lambda: (start + timedelta(days=rnd.randrange(n_days))).strftime("%Y-%m-%d")
+
+    rows, n = [], 1
+    def add(**kw):
+        nonlocal n; n += 1; rows.append((n, kw))
+
+    for i in range(products):
+        add(kind="produkt", sku=f"SKU-{i:06d}", title=f"Produkt testowy {i}")
+
+    # zakupy: partie po 1–5 pozycji z tą samą datą
+    left, order = {}, 0
+    lot_list = [(i, j) for i in range(products) for j in range(lots)]
+    rnd.shuffle(lot_list)
+    while lot_list:
+        order += 1; d = day()
+        for _ in range(min(rnd.randint(1, 5), len(lot_list))):
+            i, _ = lot_list.pop()
+            qty = rnd.randint(5, 50); left[i] = left.get(i, 0) + qty
+            add(kind="zakup", date=d, sku=f"SKU-{i:06d}", qty=qty,
+                amount=round(qty * rnd.uniform(5, 200), 2), order=f"Z{order}")
+
+    # sprzedaż: popularność wg rozkładu Zipfa, 20% zamówień ma dwie pozycje
+    weights = [1 / (k + 1) for k in range(products)]
+    order   = 0
+    for pick in rnd.choices(range(products), weights=weights, k=sales):
+        order += 1; d = day(); plat = rnd.choice(PLATFORMS)
+        for i in ([pick, rnd.randrange(products)] if rnd.random() < 0.2 else [pick]):
+            qty = min(rnd.randint(1, 3), left.get(i, 0))
+            if qty <= 0: continue
+            left[i] -= qty
+            pln = round(qty * rnd.uniform(20, 400), 2)
+            add(kind="sprzedaz", date=d, sku=f"SKU-{i:06d}", qty=qty, amount=pln,
+                eur=round(pln / 4.3, 2), platform=plat, order=f"S{order}")
+
+    db  = DB(path)
+    rep = db.bulk_import(rows)
+    if rep["errors"]:
+        raise RuntimeError(f"generator: {len(rep['errors'])} błędów, pierwszy: {rep['errors'][0]}")
+
+    # rachunki dla części sprzedaży
+    inv = [(f"R/{k+1:06d}/{s['date'][:4]}", s["id"], None, f"Klient {rnd.randrange(10_000)}",
+            "ul. Testowa 1", s["date"], s["total_pln"])
+           for k, s in enumerate(db.conn.execute("SELECT id, date, total_pln FROM sales_orders ORDER BY id"))
+           if rnd.random() < invoices]
+    db.conn.executemany("""
+        INSERT INTO invoices(invoice_number,sale_order_id,file_path,customer_name,
+                             customer_address,issue_date,total_amount)
+        VALUES(?,?,?,?,?,?,?)
+    """, inv)
+    db.conn.commit(); db.conn.close()
+    return {"products": products, "lots": lots, "sales": rep["sales"], "sale_lines": rep["sale_lines"],
+            "purchase_lines": rep["purchase_lines"], "invoices": len(inv), "years": years,
+            "end_year": end_year, "seed": seed}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Generator danych testowych")
+    ap.add_argument("--out", required=True, metavar="PLIK")
+    ap.add_argument("--scale", choices=SCALES)
+    ap.add_argument("--products", type=int); ap.add_argument("--lots", type=int)
+    ap.add_argument("--sales", type=int);    ap.add_argument("--years", type=int)
+    ap.add_argument("--invoices", type=float, default=0.3, help="odsetek sprzedaży z rachunkiem")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--end-year", type=int)
+    a = ap.parse_args()
+    params = dict(SCALES[a.scale or "small"])
+    for k in ("products", "lots", "sales", "years"):
+        if getattr(a, k) is not None: params[k] = getattr(a, k)
+    t = time.perf_counter()
+    info = generate(a.out, invoices=a.invoices, seed=a.seed, end_year=a.end_year, **params)
+    print(f"{a.out}: {info}  ({time.perf_counter()-t:.1f} s)")
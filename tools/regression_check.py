@@ -0,0 +1,203 @@
+"""
+Testy regresji warstwy DB – scenariusze, które kiedyś psuły dane.
+
+    python tools/regression_check.py              # wszystkie scenariusze
+    python tools/regression_check.py restore      # tylko pasujące do nazwy
+
+Każdy scenariusz działa w świeżym katalogu tymczasowym; scenariusz bazy kończy się
+sprawdzeniem DB.check_invariants(). Kod wyjścia 1 = któryś scenariusz nie przeszedł.
+"""
+
+import os, sys, json, tempfile, threading, traceback
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import magazyn
+from magazyn import DB, Config
+
+
+def new_db(tmp, name="r.db"):
+    db = DB(os.path.join(tmp, name))
+    pid = db.add_product("RC-1", "Produkt testowy")
+    db.add_purchase_order(100.0, "2001-01-01", [(pid, 10)])
+    return db, pid
+
+
+def check_restore_profiling(tmp):
+    """Przywrócenie kopii przy włączonym profilowaniu (Diagnostyka, --profile)"""
+    db, pid = new_db(tmp)
+    bak = db.backup(os.path.join(tmp, "kopia.db"))
+    db.add_purchase_order(50.0, "2001-02-01", [(pid, 5)])
+    db.enable_profiling(log_path=os.path.join(tmp, "slow.log"))
+    db.restore(bak)
+    db.disable_profiling()
+    stock = db.conn.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()[0]
+    assert stock == 10, f"stan po przywróceniu {stock}, oczekiwany 10"
+    return db
+
+
+def check_delete_sale(tmp):
+    """Usunięcie sprzedaży zwraca ilość do partii, z których ją pobrano"""
+    db, pid = new_db(tmp)
+    db.add_purchase_order(60.0, "2001-02-01", [(pid, 5)])
+    oid = db.add_sale_order("Vinted", 90.0, 20.0, [(pid, 12)], 0, "2001-03-01")
+    db.delete_sale(oid)
+    lots = [r[0] for r in db.conn.execute("SELECT available_qty FROM purchase_items ORDER BY id")]
+    assert lots == [10, 5], f"partie po usunięciu {lots}, oczekiwane [10, 5]"
+    return db
+
+
+def check_delete_imported_sale(tmp):
+    """Sprzedaż z importu (FIFO zbiorczo) i sprzedaż sprzed zapisu pobrań partii"""
+    db, pid = new_db(tmp)
+    rows = [(1, {"kind": "sale", "sku": "RC-1", "qty": 3, "amount": 30, "eur": 7, "date": "2001-02-01", "order": "A"}),
+            (2, {"kind": "sale", "sku": "RC-1", "qty": 2, "amount": 20, "eur": 5, "date": "2001-02-02", "order": "B"})]
+    assert not db.bulk_import(rows)["errors"]
+    a, b = [r[0] for r in db.conn.execute("SELECT id FROM sales_orders ORDER BY id")]
+    db.delete_sale(b)
+    with db.transaction() as c: c.execute("DELETE FROM purchase_stock_history")   # baza sprzed historii
+    db.delete_sale(a)
+    return db
+
+
+def check_delete_sale_after_close(tmp):
+    """Sprzedaż nowego roku usunięta po zamknięciu roku wraca do partii bilansu otwarcia"""
+    db, pid = new_db(tmp)
+    db.add_sale_order("Vinted", 50.0, 12.0, [(pid, 3)], 0, "2001-06-01")
+    oid = db.add_sale_order("Vinted", 40.0, 9.0, [(pid, 2)], 0, "2002-03-01")
+    db.close_year(2001)
+    db.delete_sale(oid)
+    return db
+
+
+def check_import_rates_outside_lock(tmp):
+    """Kursy EUR z NBP pobierane przed BEGIN IMMEDIATE – zapytania sieciowe bez blokady zapisu"""
+    db, pid = new_db(tmp)
+    calls, fetch = [], magazyn.get_eur_rates
+    def rates(d0, d1):
+        calls.append(db.conn.in_transaction)
+        return {"2001-02-01": 4.5}
+    magazyn.get_eur_rates = rates
+    try:
+        db.bulk_import([(1, {"kind": "sale", "sku": "RC-1", "qty": 1, "amount": 45, "date": "2001-02-01"})])
+        db.import_marketplace_orders("Vinted", [(1, {"order": "V1", "sku": "RC-1", "qty": 1, "amount": 45,
+                                                     "date": "2001-02-01"})])
+    finally:
+        magazyn.get_eur_rates = fetch
+    assert calls == [False, False], f"pobrania kursów (w transakcji?): {calls}"
+    eur = [r[0] for r in db.conn.execute("SELECT total_eur FROM sales_orders ORDER BY id")]
+    assert eur == [10.0, 10.0], f"kwoty EUR {eur}"
+    return db
+
+
+def check_sale_repeated_product(tmp):
+    """Ten sam produkt w kilku pozycjach zamówienia – stan sprawdzany dla sumy ilości"""
+    db, pid = new_db(tmp)
+    try: db.add_sale_order("Vinted", 99.0, 22.0, [(pid, 6), (pid, 5)], 0, "2001-03-01")
+    except ValueError: pass
+    else: raise AssertionError("zapisano sprzedaż ponad stan")
+    db.add_sale_order("Vinted", 90.0, 20.0, [(pid, 6), (pid, 4)], 0, "2001-03-01")
+    return db
+
+
+def check_line_amounts_in_cents(tmp):
+    """Przychód pozycji dzielony wg ilości – każda część w pełnych groszach, suma = kwota zamówienia"""
+    db, pid = new_db(tmp)
+    p2 = db.add_product("RC-2", "Produkt 2"); db.add_purchase_order(40.0, "2001-01-01", [(p2, 10)])
+    oid = db.add_sale_order("Vinted", 11.55, 2.7, [(pid, 1), (p2, 2)], 0, "2001-03-01")
+    rev = [r[0] for r in db.conn.execute("SELECT revenue_pln FROM sales_items WHERE order_id=? ORDER BY id", (oid,))]
+    assert rev == [3.85, 7.7], f"przychód pozycji {rev}"
+    oid = db.add_sale_order("Vinted", 10.0, 2.3, [(pid, 1), (p2, 1), (pid, 1)], 0, "2001-03-02")
+    rev = [r[0] for r in db.conn.execute("SELECT revenue_pln FROM sales_items WHERE order_id=? ORDER BY id", (oid,))]
+    assert rev == [3.33, 3.33, 3.34], f"przychód pozycji {rev}"
+    return db
+
+
+def check_config_save_while_changing(tmp):
+    """Zapis config.json w wątku Timer równolegle ze zmianami ustawień w wątku okna"""
+    cfg, errors, stop = Config(os.path.join(tmp, "config.json")), [], threading.Event()
+    def saver():
+        while not stop.is_set():
+            try: cfg._save(); cfg.flush()
+            except Exception as e: errors.append(repr(e)); return
+    t = threading.Thread(target=saver); t.start()
+    try:
+        for i in range(5000):
+            cfg.set(f"k{i % 50}", i); cfg.pop(f"k{(i + 25) % 50}")
+            lim = cfg.get_limits(); lim.setdefault("year_limits", {})[str(i % 50)] = {"minimal_wage": i}
+            cfg.update_limits(lim)
+    finally:
+        stop.set(); t.join()
+    cfg.flush()
+    with open(cfg.path, encoding="utf-8") as f: d = json.load(f)
+    assert not errors, errors[0]
+    assert d["k49"] == 4999 and d["limits"]["year_limits"]["49"]["minimal_wage"] == 4999, "niepełny zapis config.json"
+    assert "49" not in Config.DEFAULTS["limits"]["year_limits"], "get_limits() zwrócił słownik DEFAULTS"
+
+
+def check_invoice_after_close(tmp):
+    """Rachunek z datą w zamkniętym roku nie może zniknąć, a jego numeracja – zostać zresetowana"""
+    db, pid = new_db(tmp)
+    db.add_invoice("R/1/2001", None, None, "Klient", "", 10.0)
+    with db.transaction() as c: c.execute("UPDATE invoices SET issue_date='2001-05-01'")
+    iid = db.conn.execute("SELECT id FROM invoices").fetchone()[0]
+    db.close_year(2001)
+    for name, call in (("delete_invoice", lambda: db.delete_invoice(iid)),
+                       ("reset_invoice_sequence", lambda: db.reset_invoice_sequence("R", 2001))):
+        try: call()
+        except ValueError: continue
+        raise AssertionError(f"{name} zmienił zamknięty rok")
+    assert db.conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0] == 1, "rachunek usunięty"
+    db.reset_invoice_sequence("R", 2002)
+    return db
+
+
+def check_archive_only_closed_year(tmp):
+    """Do archiwum trafia tylko zamknięty rok – potem zapisy z jego datą są odrzucane"""
+    db, pid = new_db(tmp)
+    db.add_sale_order("Vinted", 50.0, 12.0, [(pid, 10)], 0, "2001-06-01")
+    try: db.archive_year(2001)
+    except ValueError: pass
+    else: raise AssertionError("zarchiwizowano niezamknięty rok")
+    db.close_year(2001)
+    n = db.archive_year(2001)
+    assert n["sales"] == 1, f"przeniesiono {n}"
+    try: db.add_purchase_order(10.0, "2001-07-01", [(pid, 1)])
+    except ValueError: pass
+    else: raise AssertionError("zakup w zarchiwizowanym roku")
+    return db
+
+
+def check_invoice_sequence_exact_prefix(tmp):
+    """Nowa seria numerów liczy tylko rachunki z dokładnie tym prefiksem (bez LIKE i jego wzorców)"""
+    db, pid = new_db(tmp)
+    for no in ("r/0007/2001", "FA/0009/2001", "F_/0003/2001", "F%/x1/2001", "F%/0002/2001"):
+        db.add_invoice(no, None, None, "Klient", "", 10.0)
+    got = [db.next_invoice_number(p, 2001) for p in ("R", "F_", "F%")]
+    assert got == ["R/0001/2001", "F_/0004/2001", "F%/0003/2001"], f"numery {got}"
+    return db
+
+
+CHECKS = {n[6:]: f for n, f in list(globals().items()) if n.startswith("check_")}
+
+
+def run(only=()):
+    failed = 0
+    for name, fn in CHECKS.items():
+        if only and not any(o in name for o in only): continue
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                db = fn(tmp)
+                problems = db.check_invariants() if db else []
+                if db: db.close()
+                assert not problems, "; ".join(problems)
+                print(f"  ✓ {name}")
+            except Exception:
+                failed += 1
+                print(f"  ✗ {name}\n" + traceback.format_exc(limit=3))
+    print("OK" if not failed else f"BŁĄD – {failed} scenariuszy")
+    return not failed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) else 1)